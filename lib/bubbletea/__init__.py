@@ -1,6 +1,8 @@
 import streamlit as st
 from . import thegraph
 from . import cryptocompare as cp
+from . import http_client
+from . import cache
 from .transformers import urlparser
 from .transformers import timeseries as ts
 from .charts import line as line
@@ -26,13 +28,29 @@ NaInterpolationMethod = ts.NaInterpolationMethod
 ColumnType = ts.ColumnType
 ColumnConfig = ts.ColumnConfig
 SubgraphDef = thegraph.SubgraphDef
+DiskCache = thegraph.DiskCache
+RangeCache = thegraph.RangeCache
 beta_aggregate_groupby = ts.beta_aggregate_groupby
 beta_aggregate_timeseries = ts.beta_aggregate_timeseries
 
 beta_load_subgraph = thegraph.beta_load_subgraph
 beta_load_subgraphs = thegraph.beta_load_subgraphs
+beta_set_worker_pool_size = thegraph.beta_set_worker_pool_size
+beta_set_pool_size = thegraph.beta_set_pool_size
+beta_iter_subgraph_pages = thegraph.beta_iter_subgraph_pages
+beta_load_subgraph_snapshots = thegraph.beta_load_subgraph_snapshots
+beta_load_subgraph_live = thegraph.beta_load_subgraph_live
+beta_load_subgraph_async = thegraph.beta_load_subgraph_async
+beta_load_subgraphs_async = thegraph.beta_load_subgraphs_async
 
 beta_load_historical_data = cp.beta_load_historical_data
+beta_set_rate_limit = http_client.set_rate_limit
+
+MemoryCache = cache.MemoryCache
+FileCache = cache.FileCache
+SqliteCache = cache.SqliteCache
+beta_set_cache = cache.set_cache
+beta_get_cache = cache.get_cache
 
 beta_plot_line = line.plot
 beta_plot_bar = bar.plot
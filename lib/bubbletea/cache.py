@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Responses are cached as the raw bytes the endpoint sent, under keys built from the request alone.
+
+def get_cache_key(*parts):
+    # Cheap to build: the parts are strings or JSON values, nothing is hashed beyond their text.
+    text = '\n'.join([p if isinstance(p, str) else json.dumps(p, sort_keys=True) for p in parts])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class Cache:
+    # The counters of every backend, the backends store and evict in `_get`, `_set` and `_usage`.
+    def __init__(self, maxBytes:int, ttl:float=None) -> None:
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+        self.counterLock = threading.Lock()
+        pass
+
+    def _expired(self, created):
+        return self.ttl != None and time.time() - created > self.ttl
+
+    def get(self, key:str):
+        value = self._get(key)
+        with self.counterLock:
+            if value == None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key:str, value:bytes):
+        evicted = self._set(key, value)
+        with self.counterLock:
+            self.sets += 1
+            self.evictions += evicted
+
+    def stats(self):
+        with self.counterLock:
+            stats = {'hits': self.hits, 'misses': self.misses, 'sets': self.sets, 'evictions': self.evictions}
+        entries, size = self._usage()
+        stats.update({'entries': entries, 'bytes': size})
+        return stats
+
+class MemoryCache(Cache):
+    def __init__(self, maxBytes:int=256 * 1024 ** 2, ttl:float=None) -> None:
+        super().__init__(maxBytes, ttl)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        pass
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None:
+                return None
+            if self._expired(entry[1]):
+                del self.entries[key]
+                self.bytes -= len(entry[0])
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def _set(self, key, value):
+        # The least recently used entries go first, a value larger than the whole budget is not kept.
+        evicted = 0
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old != None:
+                self.bytes -= len(old[0])
+            if len(value) > self.maxBytes:
+                return evicted
+            self.entries[key] = (value, time.time())
+            self.bytes += len(value)
+            while self.bytes > self.maxBytes:
+                _, (v, _) = self.entries.popitem(last=False)
+                self.bytes -= len(v)
+                evicted += 1
+        return evicted
+
+    def _usage(self):
+        with self.lock:
+            return len(self.entries), self.bytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+class FileCache(Cache):
+    def __init__(self, cacheDir:str=os.path.join('.bubbletea', 'responses'), maxBytes:int=1024 ** 3, ttl:float=None) -> None:
+        super().__init__(maxBytes, ttl)
+        self.cacheDir = cacheDir
+        # The size of the directory, scanned once and then kept up to date by this process.
+        self.bytes = None
+        self.lock = threading.Lock()
+        pass
+
+    def _path(self, key):
+        return os.path.join(self.cacheDir, key)
+
+    def _get(self, key):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            # The mtime of a file is when it was stored, its atime when it was last read.
+            if self._expired(stat.st_mtime):
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path, (time.time(), stat.st_mtime))
+            return value
+        except FileNotFoundError:
+            return None
+
+    def _scan(self):
+        files = []
+        for e in os.scandir(self.cacheDir):
+            if e.is_file() and not e.name.endswith('.tmp'):
+                stat = e.stat()
+                files.append((stat.st_atime, stat.st_size, e.path))
+        return files
+
+    def _set(self, key, value):
+        os.makedirs(self.cacheDir, exist_ok=True)
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(value)
+        os.replace(tmp, path)
+        with self.lock:
+            if self.bytes == None:
+                self.bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self.bytes += len(value)
+            if self.bytes <= self.maxBytes:
+                return 0
+            # Other processes may share the directory, the files are listed again before evicting.
+            files = sorted(self._scan())
+            self.bytes = sum(size for _, size, _ in files)
+            evicted = 0
+            for _, size, p in files:
+                if self.bytes <= self.maxBytes:
+                    break
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+                self.bytes -= size
+                evicted += 1
+            return evicted
+
+    def _usage(self):
+        if not os.path.isdir(self.cacheDir):
+            return 0, 0
+        files = self._scan()
+        return len(files), sum(size for _, size, _ in files)
+
+    def clear(self):
+        with self.lock:
+            if os.path.isdir(self.cacheDir):
+                for _, _, p in self._scan():
+                    os.remove(p)
+            self.bytes = 0
+
+class SqliteCache(Cache):
+    def __init__(self, path:str=os.path.join('.bubbletea', 'cache.sqlite'), maxBytes:int=1024 ** 3, ttl:float=None) -> None:
+        # One database can be shared by several processes, for example the workers of a dashboard server.
+        super().__init__(maxBytes, ttl)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        pass
+
+    def _get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT value, created FROM entries WHERE key = ?', (key,)).fetchone()
+            if row == None:
+                return None
+            if self._expired(row[1]):
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return None
+            self.db.execute('UPDATE entries SET accessed = ? WHERE key = ?', (time.time(), key))
+            return bytes(row[0])
+
+    def _set(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', (key, value, len(value), now, now))
+            total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.maxBytes:
+                return 0
+            evicted = []
+            for k, size in self.db.execute('SELECT key, size FROM entries ORDER BY accessed'):
+                if total <= self.maxBytes:
+                    break
+                evicted.append((k,))
+                total -= size
+            self.db.executemany('DELETE FROM entries WHERE key = ?', evicted)
+            return len(evicted)
+
+    def _usage(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+
+    def clear(self):
+        with self.lock:
+            self.db.execute('DELETE FROM entries')
+
+_cache = MemoryCache()
+_lock = threading.Lock()
+
+def get_cache():
+    with _lock:
+        return _cache
+
+"""
+Set the backend caching the answers of subgraph pages and CryptoCompare requests, with or without Streamlit.
+Params:
+`cache`: One of
+    `MemoryCache(maxBytes=256 * 1024 ** 2, ttl=None)`: in process, the default.
+    `FileCache(cacheDir='.bubbletea/responses', maxBytes=1024 ** 3, ttl=None)`: one file per answer on local disk.
+    `SqliteCache(path='.bubbletea/cache.sqlite', maxBytes=1024 ** 3, ttl=None)`: one database, shared by the processes using the same path.
+    Answers are keyed by the url, the query and its variables. The least recently used are evicted once `maxBytes` is exceeded, answers older than `ttl` seconds are requested again. `None` turns caching off.
+`beta_get_cache().stats()` returns `{'hits', 'misses', 'sets', 'evictions', 'entries', 'bytes'}` of the current backend.
+"""
+def set_cache(cache:Cache):
+    global _cache
+    with _lock:
+        _cache = cache
@@ -1,7 +1,7 @@
 from pandas.core.tools.datetimes import to_datetime
-import streamlit as st
 import math
-import requests
+from .http_client import get_http_client, get_rate_limiter, RETRY_TOTAL
+from .cache import get_cache, get_cache_key
 import json
 import pandas as pd
 from enum import Enum
@@ -10,13 +10,37 @@ _URL_HIST_PRICE_DAY = 'https://min-api.cryptocompare.com/data/histoday'
 _URL_HIST_PRICE_HOUR = 'https://min-api.cryptocompare.com/data/histohour'
 _URL_HIST_PRICE_MINUTE = 'https://min-api.cryptocompare.com/data/histominute'
 
-@st.cache(show_spinner=False)
+_RATE_LIMIT_WINDOWS = {'second': 1, 'minute': 60}
+
+def _get_rate_limit_wait(text):
+    # Over-quota responses come back as 200 with the calls made and allowed per window.
+    # Only the short windows are waited for, an exceeded hourly quota is raised.
+    rateLimit = text.get("RateLimit") or {}
+    made = rateLimit.get("calls_made", {})
+    allowed = rateLimit.get("max_calls", {})
+    exceeded = [w for w in allowed.keys() if made.get(w, 0) >= allowed[w]]
+    if len(exceeded) == 0 or any(w not in _RATE_LIMIT_WINDOWS for w in exceeded):
+        return None
+    return max(_RATE_LIMIT_WINDOWS[w] for w in exceeded)
+
 def _load_historical_data(url:str):
-    response = requests.get(url)
-    text = json.loads(response.text)
-    if text["Response"] == "Error":
-        raise ValueError(text["Message"])
-    return text["Data"]
+    # Answers are kept by the cache backend under a key of the url, errors are never stored.
+    cache = get_cache()
+    key = None if cache == None else get_cache_key(url)
+    body = None if cache == None else cache.get(key)
+    if body != None:
+        return json.loads(body)["Data"]
+    for retry in range(RETRY_TOTAL + 1):
+        response = get_http_client().get(url)
+        text = json.loads(response.content)
+        if text["Response"] != "Error":
+            if cache != None:
+                cache.set(key, response.content)
+            return text["Data"]
+        wait = _get_rate_limit_wait(text)
+        if wait == None or retry == RETRY_TOTAL:
+            raise ValueError(text["Message"])
+        get_rate_limiter(url).pause(wait)
 
 
 def beta_load_historical_data(from_symbol:str, to_symbol:str, start_timestamp:int, end_timestamp:int, apikey:str, apilimit:int=2000, interval='H', exchange='CCCAGG'):
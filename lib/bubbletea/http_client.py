@@ -0,0 +1,147 @@
+import requests
+import time
+import threading
+import urllib.parse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_SIZE = 32
+RETRY_TOTAL = 5
+RETRY_BACKOFF_FACTOR = 0.2
+RETRY_STATUS_FORCELIST = [ 500, 502, 503, 504, 522 ]
+# Quotas per host as `[(calls, seconds), ...]`, CryptoCompare's free tier allows 20 calls a second and 300 a minute.
+RATE_LIMITS = {
+    'min-api.cryptocompare.com': [(20, 1), (300, 60)],
+}
+
+try:
+    import brotli
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+class RateLimiter:
+    def __init__(self, quotas=None) -> None:
+        self.quotas = [] if quotas == None else list(quotas)
+        self.arrivals = [0.0] * len(self.quotas)
+        self.pausedUntil = 0.0
+        self.lock = threading.Lock()
+        pass
+
+    def reserve(self):
+        # Reserves the next free slot of every quota and returns the seconds to wait for it.
+        # Slots are handed out in call order under the lock, waiting callers are served first come first served.
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.pausedUntil)
+            for i, (calls, seconds) in enumerate(self.quotas):
+                # Generic cell rate algorithm, a burst of `calls` is allowed within any `seconds` window.
+                start = max(start, self.arrivals[i] + seconds / calls - seconds)
+            for i, (calls, seconds) in enumerate(self.quotas):
+                # The call goes out at `start`, after a pause or the slot of another quota the next ones are spaced from there.
+                self.arrivals[i] = max(self.arrivals[i], start) + seconds / calls
+            return start - now
+
+    def paused_for(self):
+        with self.lock:
+            return max(0.0, self.pausedUntil - time.monotonic())
+
+    def pause(self, seconds):
+        # Every request to the host waits, not only the one that was told to retry later.
+        with self.lock:
+            self.pausedUntil = max(self.pausedUntil, time.monotonic() + seconds)
+
+    def wait(self):
+        delay = self.reserve()
+        while delay > 0:
+            time.sleep(delay)
+            delay = self.paused_for()
+
+_limiters = {}
+_limitersLock = threading.Lock()
+
+def get_rate_limiter(url):
+    host = urllib.parse.urlparse(url).netloc
+    with _limitersLock:
+        if host not in _limiters:
+            _limiters[host] = RateLimiter(RATE_LIMITS.get(host))
+        return _limiters[host]
+
+def set_rate_limit(host:str, quotas):
+    # `quotas` is a list of `(calls, seconds)`, for example `[(10, 1), (1000, 3600)]`. `None` lifts the limit.
+    with _limitersLock:
+        RATE_LIMITS[host] = quotas
+        _limiters[host] = RateLimiter(quotas)
+
+def get_retry_after(headers, retry):
+    value = headers.get('Retry-After')
+    if value != None:
+        try:
+            return Retry().parse_retry_after(value)
+        except Exception:
+            pass
+    return RETRY_BACKOFF_FACTOR * (2 ** retry)
+
+class HttpClient:
+    def __init__(self, poolSize=POOL_SIZE) -> None:
+        self.poolSize = poolSize
+        self.retries = Retry(total=RETRY_TOTAL,
+                             backoff_factor=RETRY_BACKOFF_FACTOR,
+                             status_forcelist=RETRY_STATUS_FORCELIST)
+        self.adapters = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        pass
+
+    def _get_adapter(self, url):
+        # One connection pool per host, created once and shared by every thread.
+        parsed_url = urllib.parse.urlparse(url)
+        prefix = f"{parsed_url.scheme}://{parsed_url.netloc}"
+        with self.lock:
+            if prefix not in self.adapters:
+                self.adapters[prefix] = HTTPAdapter(pool_connections=1, pool_maxsize=self.poolSize, max_retries=self.retries)
+            return prefix, self.adapters[prefix]
+
+    def _get_session(self, url):
+        # Sessions are not thread safe, every thread has its own on top of the shared pools.
+        session = getattr(self.local, 'session', None)
+        if session == None:
+            session = requests.Session()
+            session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+            self.local.session = session
+        prefix, adapter = self._get_adapter(url)
+        if session.adapters.get(prefix) is not adapter:
+            session.mount(prefix, adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        # Too Many Requests pauses the host for its `Retry-After` and the request is sent again.
+        limiter = get_rate_limiter(url)
+        for retry in range(RETRY_TOTAL + 1):
+            limiter.wait()
+            response = self._get_session(url).request(method, url, **kwargs)
+            if response.status_code != 429 or retry == RETRY_TOTAL:
+                return response
+            limiter.pause(get_retry_after(response.headers, retry))
+
+    def post(self, url, json, timeout=None):
+        return self.request('POST', url, json=json, timeout=timeout)
+
+    def get(self, url, timeout=None):
+        return self.request('GET', url, timeout=timeout)
+
+_client = None
+_lock = threading.Lock()
+
+def get_http_client():
+    global _client
+    with _lock:
+        if _client == None:
+            _client = HttpClient()
+        return _client
+
+def set_pool_size(poolSize):
+    # Pools keep up to `poolSize` idle connections per host, set it to the number of concurrent requests.
+    global _client
+    with _lock:
+        _client = HttpClient(poolSize)
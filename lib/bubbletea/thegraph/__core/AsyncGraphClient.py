@@ -0,0 +1,42 @@
+from . import schema_utils
+from ...http_client import RETRY_TOTAL, RETRY_BACKOFF_FACTOR, RETRY_STATUS_FORCELIST, ACCEPT_ENCODING, get_rate_limiter, get_retry_after
+import asyncio
+
+class AsyncGraphClient:
+    def __init__(self, maxConcurrency=32) -> None:
+        self.maxConcurrency = maxConcurrency
+        self.session = None
+        self.semaphore = None
+        pass
+
+    async def __aenter__(self):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('The async loader requires `aiohttp`. Install it with `pip install aiohttp`.')
+        self.semaphore = asyncio.Semaphore(self.maxConcurrency)
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.maxConcurrency), headers={'Accept-Encoding': ACCEPT_ENCODING})
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.close()
+
+    async def post(self, url, query, variables=None):
+        # Bounded by the shared semaphore, so many loads can share one client without flooding the endpoint.
+        # Requests also wait for the rate limiter of the host, which is shared with the threaded loaders.
+        limiter = get_rate_limiter(url)
+        async with self.semaphore:
+            for retry in range(RETRY_TOTAL + 1):
+                delay = limiter.reserve()
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = limiter.paused_for()
+                body = {'query': query} if variables == None else {'query': query, 'variables': variables}
+                async with self.session.post(url, json=body) as response:
+                    if response.status not in RETRY_STATUS_FORCELIST + [429] or retry == RETRY_TOTAL:
+                        body = await response.read()
+                        return schema_utils.process_body_to_json(response.status, body)
+                    if response.status == 429:
+                        limiter.pause(get_retry_after(response.headers, retry))
+                        continue
+                await asyncio.sleep(RETRY_BACKOFF_FACTOR * (2 ** retry))
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import pandas as pd
+from . import decimal_utils
+from .QueryTemplate import normalize_query
+
+
+class DiskCache:
+    def __init__(self, cacheDir:str=os.path.join('.bubbletea', 'cache'), maxBytes:int=1024 ** 3, ttl:float=None) -> None:
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        pass
+
+    def get_key(self, url:str, query:str, block=None, useBigDecimal=False):
+        # Equivalent queries share an entry, the normalized text is cached per query.
+        normalized = normalize_query(query)
+        text = f'{url}\n{normalized}\n{block}\n{useBigDecimal}'
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cacheDir, key)
+
+    def get(self, key):
+        path = self._entry_dir(key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            # Block pinned entries never change, they are only removed by eviction.
+            if self.ttl != None and not meta.get('immutable', False) and time.time() - meta['created'] > self.ttl:
+                shutil.rmtree(path, ignore_errors=True)
+                return None
+            result = {}
+            names = meta['entities']
+            arrowColumns = meta.get('arrowColumns', [[] for _ in names])
+            attrs = meta.get('attrs', [{} for _ in names])
+            for i, name in enumerate(names):
+                df = pd.read_parquet(os.path.join(path, f'{i}.parquet'))
+                for c in arrowColumns[i]:
+                    df[c] = decimal_utils.to_arrow_decimal(df[c].astype(str).where(df[c].notna(), None))
+                df.attrs.update(attrs[i])
+                result[name] = df
+            # The mtime of an entry is its last access, eviction removes the least recently used first.
+            os.utime(path)
+            return result
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def set(self, key, result:dict, immutable=False):
+        os.makedirs(self.cacheDir, exist_ok=True)
+        path = self._entry_dir(key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(tmp, exist_ok=True)
+        names = list(result.keys())
+        for i, name in enumerate(names):
+            result[name].to_parquet(os.path.join(tmp, f'{i}.parquet'))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            attrs = [result[name].attrs for name in names]
+            # Arrow decimal columns come back from Parquet as Decimal objects, they are converted again on read.
+            arrowColumns = [[c for c in result[name].columns if decimal_utils.is_arrow_decimal(result[name][c])] for name in names]
+            json.dump({'created': time.time(), 'entities': names, 'attrs': attrs, 'arrowColumns': arrowColumns, 'immutable': immutable}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Another worker stored the same entry first.
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            total = 0
+            for key in os.listdir(self.cacheDir):
+                path = self._entry_dir(key)
+                if key.endswith('.tmp') or not os.path.isdir(path):
+                    continue
+                size = sum(e.stat().st_size for e in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, size, path))
+                total += size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.maxBytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
@@ -0,0 +1,92 @@
+from .SubgraphLoader import SubgraphLoader
+from graphql import print_ast, FieldNode, NameNode, SelectionSetNode
+import pandas as pd
+import threading
+
+def sort_rows(df, orderBy=None, ascending=True):
+    # The order of a full load of an entity: `orderBy` then id, or id alone.
+    if len(df) == 0:
+        return df
+    if orderBy == None or orderBy == 'id' or orderBy not in df.columns:
+        return df.sort_values('id', ascending=ascending, kind='stable', ignore_index=True)
+    return df.sort_values([orderBy, 'id'], ascending=[ascending, True], kind='stable', ignore_index=True)
+
+def upsert(df, changes, orderBy=None, ascending=True, removed=()):
+    # Rows of `df` whose id is in `changes` are replaced by their new version, new ids are added.
+    # Rows whose id is in `removed` are dropped, they changed and no longer match the filters.
+    if len(df) > 0 and len(removed) > 0:
+        df = df[~df['id'].isin(removed)].reset_index(drop=True)
+    if len(changes) == 0:
+        return df
+    if len(df) > 0:
+        changes = pd.concat([df[~df['id'].isin(changes['id'])], changes], ignore_index=True)
+    return sort_rows(changes, orderBy, ascending)
+
+def _ids(df):
+    return set(df['id']) if 'id' in df.columns else set()
+
+def _changed_ids_query(entities):
+    # The ids of the items of `entities` changed since a block, without the user's filters.
+    fields = []
+    for e in entities:
+        arguments = [a for a in e.node.arguments if a.name.value not in ['where', 'orderBy', 'orderDirection']]
+        node = FieldNode(alias=e.node.alias, name=e.node.name, arguments=arguments, selection_set=SelectionSetNode(selections=[FieldNode(name=NameNode(value='id'))]))
+        fields.append(print_ast(node))
+    return '{' + ' '.join(fields) + '}'
+
+class LiveSubgraph:
+    def __init__(self, subgraphUrl:str, query, useBigDecimal=False, targetedSchema=False) -> None:
+        self.subgraphUrl = subgraphUrl
+        self.query = query
+        self.useBigDecimal = useBigDecimal
+        self.targetedSchema = targetedSchema
+        self.block = None
+        self.result = None
+        self.trackChanges = True
+        self.lock = threading.Lock()
+        for e in SubgraphLoader(subgraphUrl, query).entities:
+            if e.syncBy != None:
+                raise ValueError(f'`{e.key}`: live loads keep their frames in memory, `syncBy` is not supported.')
+        pass
+
+    def _load_changes(self, loader:SubgraphLoader, progressCallback=None):
+        try:
+            changes = loader.beta_load_subgraph(progressCallback, self.useBigDecimal, changedSince=self.block + 1)
+        except ValueError as err:
+            if '_change_block' not in str(err):
+                raise
+            # Endpoints without `_change_block` filters load whole entities from now on.
+            self.trackChanges = False
+            loader = SubgraphLoader(self.subgraphUrl, self.query, block=loader.block, targetedSchema=self.targetedSchema)
+            return loader.beta_load_subgraph(progressCallback, self.useBigDecimal)
+        result = dict(changes)
+        # Items changed out of the `where` filters are not in the changes, their ids are looked up without the filters.
+        filtered = [e for e in loader.entities if e.tracks_changes() and 'where' in [a.name.value for a in e.node.arguments]]
+        changed = {}
+        if len(filtered) > 0:
+            idLoader = SubgraphLoader(self.subgraphUrl, _changed_ids_query(filtered), block=loader.block, targetedSchema=self.targetedSchema)
+            changed = idLoader.beta_load_subgraph(changedSince=self.block + 1)
+        for e in loader.entities:
+            if e.tracks_changes():
+                removed = [] if e.key not in changed else list(_ids(changed[e.key]) - _ids(changes[e.key]))
+                df = upsert(self.result[e.key], changes[e.key], e.orderBy, e.orderDirection == 'asc', removed)
+                df.attrs.update(changes[e.key].attrs)
+                result[e.key] = df
+        return result
+
+    def refresh(self, progressCallback=None):
+        # One `_meta` request per call, the data is only requested once the subgraph has indexed a new block.
+        # Callers arriving during a refresh wait for it, then find the block unchanged and get its frames.
+        with self.lock:
+            loader = SubgraphLoader(self.subgraphUrl, self.query, targetedSchema=self.targetedSchema)
+            block = loader._load_block_number()
+            if self.result != None and block <= self.block:
+                return self.result
+            loader.block = block
+            if self.result == None or not self.trackChanges:
+                result = loader.beta_load_subgraph(progressCallback, self.useBigDecimal)
+            else:
+                result = self._load_changes(loader, progressCallback)
+            self.result = result
+            self.block = block
+            return result
@@ -0,0 +1,96 @@
+from . import schema_utils
+import re
+import asyncio
+import threading
+import requests
+
+MIN_ITEMS_PER_PAGE = 100
+MAX_ITEMS_PER_PAGE = 5000
+# Pages answered faster than this grow, pages slower than `SLOW_SECONDS` shrink.
+FAST_SECONDS = 2
+SLOW_SECONDS = 10
+
+_sizers = {}
+_limits = {}
+# The largest page size each endpoint has answered with a full page.
+_accepted = {}
+_lock = threading.Lock()
+
+class PageSizer:
+    def __init__(self, url=None, size=None) -> None:
+        self.url = url
+        self.size = schema_utils.get_max_items_per_page() if size == None else size
+        self.ceiling = None
+        self.lock = threading.Lock()
+        pass
+
+    def max_size(self):
+        # Pages stay within the documented limit until the endpoint has served it, then grow to twice what it served.
+        if self.url in _limits:
+            return _limits[self.url]
+        return min(MAX_ITEMS_PER_PAGE, max(schema_utils.get_max_items_per_page(), 2 * _accepted.get(self.url, 0)))
+
+    def accept(self, size, count):
+        # A page asked with `size` came back with `count` items, a full page shows the endpoint serves that size.
+        if count >= size:
+            with _lock:
+                _accepted[self.url] = max(size, _accepted.get(self.url, 0))
+
+    def is_last_page(self, size, count):
+        # Endpoints may cap pages below the size asked without an error. A short page only ends the pagination
+        # when it is empty or asked for no more than the endpoint has served whole.
+        return count < size and (count == 0 or size <= _accepted.get(self.url, 0))
+
+    def next_size(self):
+        with self.lock:
+            self.size = min(self.size, self.max_size())
+            return self.size
+
+    def record(self, size, seconds):
+        with self.lock:
+            if seconds < FAST_SECONDS and size >= self.size:
+                grown = min(size * 2, self.max_size())
+                if self.ceiling != None:
+                    # Search between the last good size and the size that failed, instead of hitting it again.
+                    grown = min(grown, (size + self.ceiling) // 2)
+                self.size = max(self.size, grown)
+            elif seconds > SLOW_SECONDS:
+                self.size = max(MIN_ITEMS_PER_PAGE, min(self.size, size // 2))
+
+    def shrink(self, size, error):
+        # Returns False when the page can not get any smaller, the error is then not a matter of page size.
+        limit = _find_first_limit(error)
+        with self.lock:
+            if limit != None:
+                _limits[self.url] = limit
+                self.size = min(self.size, limit)
+                return size > limit
+            if size <= MIN_ITEMS_PER_PAGE:
+                return False
+            self.ceiling = size
+            self.size = max(MIN_ITEMS_PER_PAGE, min(self.size, size // 2))
+            return True
+
+def _find_first_limit(error):
+    # Indexers reject oversized pages with "The `first` argument must be between 0 and 1000, but is 5000".
+    m = re.search(r'`first` argument must be between \d+ and (\d+)', str(error))
+    return None if m == None else int(m.group(1))
+
+def is_page_size_error(error):
+    # Timeouts and server errors of a heavy page, which a smaller page of the same cursor may get through.
+    if isinstance(error, (asyncio.TimeoutError, requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.RetryError)):
+        return True
+    if type(error).__module__.startswith('aiohttp'):
+        return True
+    if not isinstance(error, ValueError):
+        return False
+    msg = str(error)
+    return _find_first_limit(msg) != None or 'Connection Error: 5' in msg or 'timed out' in msg.lower() or 'timeout' in msg.lower()
+
+def get_page_sizer(url, name):
+    # Sizes are learned per endpoint and entity, later loads of the same entity start from the last size.
+    key = (url, name)
+    with _lock:
+        if key not in _sizers:
+            _sizers[key] = PageSizer(url)
+        return _sizers[key]
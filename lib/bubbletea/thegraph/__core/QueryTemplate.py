@@ -0,0 +1,87 @@
+import re
+import threading
+from collections import OrderedDict
+from graphql import parse, print_ast, FieldNode, NameNode
+
+# Parsed queries and compiled entities kept per process, the least recently used are dropped first.
+CACHE_SIZE = 512
+
+class LruCache:
+    def __init__(self, maxSize=CACHE_SIZE) -> None:
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        pass
+
+    def get(self, key, build):
+        # `build()` runs outside the lock, two threads missing the same key both build and the first one is kept.
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        value = build()
+        with self.lock:
+            value = self.entries.setdefault(key, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        return value
+
+_parsed = LruCache()
+_normalized = LruCache()
+
+def parse_query(query:str):
+    # The same text always gives the same nodes, so nodes can key the compiled entities of later loads.
+    # The nodes are shared, they must not be changed.
+    return _parsed.get(query, lambda: parse(query, no_location=True))
+
+def normalize_query(query:str):
+    # Printing the parsed query drops whitespace and comments, equivalent queries print the same.
+    return _normalized.get(query, lambda: print_ast(parse_query(query)))
+
+class QueryTemplate:
+    def __init__(self, text:str) -> None:
+        # `text` is a printed query with `$__name` variables, it is split once around them.
+        parts = text.split('$__')
+        self.text = text
+        self.fragments = [parts[0]]
+        self.variables = []
+        for p in parts[1:]:
+            name = re.match(r'\w+', p).group(0)
+            self.variables.append(name)
+            self.fragments.append(p[len(name):])
+        pass
+
+    def render(self, prefix:str=''):
+        # The variables are renamed to `$<prefix><name>`, so several renders can share one request.
+        pieces = [self.fragments[0]]
+        for name, fragment in zip(self.variables, self.fragments[1:]):
+            pieces.append(f'${prefix}{name}')
+            pieces.append(fragment)
+        return ''.join(pieces)
+
+def compose_query(fields, variables):
+    # One operation over `fields`, `variables` maps the variable names to `(type, value)`.
+    # Returns the query and the variable values to post with it.
+    body = '{' + ' '.join(fields) + '}'
+    if len(variables) == 0:
+        return body, None
+    declarations = ', '.join([f'${n}: {t}' for n, (t, v) in variables.items()])
+    return f'query({declarations}) {body}', {n: v for n, (t, v) in variables.items()}
+
+def merge_queries(queries):
+    # The root fields of every query in one query, aliased `b<i>_<alias>` by the index of their query.
+    fields = []
+    for i, query in enumerate(queries):
+        ast = parse_query(query)
+        if len(ast.definitions) != 1:
+            raise ValueError('The graph query must have one and only definition.')
+        for s in ast.definitions[0].selection_set.selections:
+            alias = NameNode(value=f'b{i}_{(s.name if s.alias == None else s.alias).value}')
+            fields.append(print_ast(FieldNode(alias=alias, name=s.name, arguments=s.arguments, directives=s.directives, selection_set=s.selection_set)))
+    return '{' + ' '.join(fields) + '}'
+
+def split_batch_key(key:str):
+    # `b<i>_<alias>` of `merge_queries` back into `(i, <alias>)`.
+    i, alias = key[1:].split('_', 1)
+    return int(i), alias
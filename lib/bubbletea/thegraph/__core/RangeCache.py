@@ -0,0 +1,239 @@
+from .TheGraphEntity import TheGraphEntity
+from .LiveSubgraph import sort_rows
+from .QueryTemplate import parse_query
+from graphql import print_ast, FieldNode, NameNode, ArgumentNode, ObjectValueNode, ObjectFieldNode, IntValueNode, SelectionSetNode
+from collections import OrderedDict
+import pandas as pd
+import hashlib
+import threading
+import time
+
+# Bound filters of a range, and the offset turning each into the `[lo, hi)` of its interval.
+BOUND_OFFSETS = {'gte': 0, 'gt': 1, 'lt': 0, 'lte': 1}
+
+def find_range(node):
+    # The first field of `where` with an integer lower and upper bound, as `(field, lo, hi)` with `hi` excluded.
+    where = next((a for a in node.arguments if a.name.value == 'where'), None)
+    if where == None or not isinstance(where.value, ObjectValueNode):
+        return None
+    lower = {}
+    upper = {}
+    for f in where.value.fields:
+        field, _, op = f.name.value.rpartition('_')
+        if field == '' or op not in BOUND_OFFSETS or not isinstance(f.value, IntValueNode):
+            continue
+        value = int(f.value.value) + BOUND_OFFSETS[op]
+        if op in ['gte', 'gt']:
+            lower[field] = max(value, lower.get(field, value))
+        else:
+            upper[field] = min(value, upper.get(field, value))
+    for field, lo in lower.items():
+        if field in upper and lo < upper[field]:
+            return field, lo, upper[field]
+    return None
+
+def _with_bounds(node, column, bounds=None, alias=None):
+    # `node` with the bounds of `column` replaced by `[lo, hi)`, or removed without `bounds`.
+    # The range column is always selected, the rows of the cached segments are filtered on it.
+    names = [f'{column}_{op}' for op in BOUND_OFFSETS]
+    arguments = []
+    for a in node.arguments:
+        if a.name.value == 'where':
+            fields = [f for f in a.value.fields if f.name.value not in names]
+            if bounds != None:
+                fields.append(ObjectFieldNode(name=NameNode(value=f'{column}_gte'), value=IntValueNode(value=str(bounds[0]))))
+                fields.append(ObjectFieldNode(name=NameNode(value=f'{column}_lt'), value=IntValueNode(value=str(bounds[1]))))
+            a = ArgumentNode(name=a.name, value=ObjectValueNode(fields=fields))
+        arguments.append(a)
+    selections = list(node.selection_set.selections)
+    if column not in [getattr(s, 'name', None) and s.name.value for s in selections]:
+        selections.append(FieldNode(name=NameNode(value=column)))
+    return FieldNode(alias=None if alias == None else NameNode(value=alias), name=node.name, arguments=arguments,
+                     directives=node.directives, selection_set=SelectionSetNode(selections=selections))
+
+def _between(df, column, lo, hi):
+    col = df[column]
+    if pd.api.types.is_datetime64_any_dtype(col):
+        # Integer timestamps are converted to datetimes when loaded.
+        lo, hi = pd.to_datetime(lo, unit='s'), pd.to_datetime(hi, unit='s')
+    return (col >= lo) & (col < hi)
+
+def _window(pieces, column, lo, hi, hidden, orderBy, ascending, attrs):
+    # The rows of `[lo, hi)` out of `(lo, hi, df)` pieces, pieces inside the window are taken whole.
+    frames = []
+    for pLo, pHi, df in pieces:
+        if pHi <= lo or pLo >= hi or len(df) == 0:
+            continue
+        frames.append(df if lo <= pLo and pHi <= hi else df[_between(df, column, lo, hi)])
+    df = pd.DataFrame() if len(frames) == 0 else pd.concat(frames, ignore_index=True)
+    df = sort_rows(df, orderBy, ascending)
+    if hidden and column in df.columns:
+        df = df.drop(columns=[column])
+    df.attrs.update(attrs)
+    return df
+
+class RangeEntry:
+    def __init__(self, column) -> None:
+        self.column = column
+        # Disjoint `[lo, hi, df, created, bytes]` segments ordered by `lo`.
+        self.segments = []
+        self.bytes = 0
+        self.attrs = {}
+        pass
+
+class RangeLoad:
+    def __init__(self, cache, query) -> None:
+        # `query` is what is left to load: the entities without a range and the gaps of the ranged ones, `None` if nothing.
+        self.cache = cache
+        self.query = query
+        self.keys = []
+        self.ranges = []
+        self.gaps = []
+        self.aliases = {}
+        pass
+
+    def report(self, progressCallback=None):
+        # Progress of the gaps of an entity is reported as one count under the entity's name.
+        if progressCallback == None or len(self.aliases) == 0:
+            return progressCallback
+        counts = {}
+        def report(progress):
+            counts.update(progress)
+            merged = {}
+            for k, n in counts.items():
+                name = self.aliases.get(k, k)
+                merged[name] = merged.get(name, 0) + n
+            progressCallback(merged)
+        return report
+
+    def finish(self, result):
+        # The loaded gaps are stored, then every ranged entity is served from the segments it found in `plan`
+        # and its gaps. Entries evicted by other loads meanwhile are not needed.
+        for alias, key, column, lo, hi in self.gaps:
+            self.cache._store(key, column, lo, hi, result[alias])
+        output = {}
+        for name in self.keys:
+            for rangeName, column, lo, hi, hidden, orderBy, ascending, pieces, attrs in self.ranges:
+                if rangeName != name:
+                    continue
+                loaded = [(gLo, gHi, result[alias]) for alias, _, _, gLo, gHi in self.gaps if self.aliases[alias] == name]
+                if len(loaded) > 0:
+                    attrs = loaded[-1][2].attrs
+                output[name] = _window(pieces + loaded, column, lo, hi, hidden, orderBy, ascending, attrs)
+            for k, v in result.items():
+                if k == name or k.startswith(f'{name}.'):
+                    output[k] = v
+        self.cache._evict()
+        return output
+
+class RangeCache:
+    def __init__(self, maxBytes:int=512 * 1024 ** 2, ttl:float=None) -> None:
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        pass
+
+    def get_key(self, url:str, node, column, block=None, useBigDecimal=False):
+        # Windows of one entity query share an entry, whatever their bounds on `column`.
+        text = f'{url}\n{print_ast(node)}\n{column}\n{block}\n{useBigDecimal}'
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _expire(self, entry:RangeEntry):
+        if self.ttl == None:
+            return
+        now = time.time()
+        for s in [s for s in entry.segments if now - s[3] > self.ttl]:
+            entry.segments.remove(s)
+            entry.bytes -= s[4]
+            self.bytes -= s[4]
+
+    def _lookup(self, key, lo, hi):
+        # The parts of `[lo, hi)` no segment covers, and the `(lo, hi, df)` of the segments overlapping it.
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None:
+                return [(lo, hi)], [], {}
+            self.entries.move_to_end(key)
+            self._expire(entry)
+            gaps = []
+            pieces = []
+            start = lo
+            for s in entry.segments:
+                if s[1] <= start:
+                    continue
+                if s[0] >= hi:
+                    break
+                if s[0] > start:
+                    gaps.append((start, s[0]))
+                pieces.append((s[0], s[1], s[2]))
+                start = max(start, s[1])
+            if start < hi:
+                gaps.append((start, hi))
+            return gaps, pieces, dict(entry.attrs)
+
+    def _store(self, key, column, lo, hi, df):
+        # Segments overlapping or touching `[lo, hi)` are merged into one, the new rows win inside `[lo, hi)`.
+        with self.lock:
+            entry = self.entries.setdefault(key, RangeEntry(column))
+            self.entries.move_to_end(key)
+            frames = [df]
+            segments = []
+            start, end, created = lo, hi, time.time()
+            for s in entry.segments:
+                if s[1] < lo or s[0] > hi:
+                    segments.append(s)
+                    continue
+                if len(s[2]) > 0:
+                    frames.append(s[2][~_between(s[2], column, lo, hi)])
+                # A merged segment expires with the oldest rows it holds.
+                start, end, created = min(start, s[0]), max(end, s[1]), min(created, s[3])
+                entry.bytes -= s[4]
+                self.bytes -= s[4]
+            frames = [f for f in frames if len(f) > 0]
+            merged = frames[0] if len(frames) == 1 else (df if len(frames) == 0 else pd.concat(frames, ignore_index=True))
+            size = int(merged.memory_usage(deep=True).sum())
+            segments.append([start, end, merged, created, size])
+            segments.sort(key=lambda s: s[0])
+            entry.segments = segments
+            entry.attrs = dict(df.attrs)
+            entry.bytes += size
+            self.bytes += size
+
+    def _evict(self):
+        # Whole entries go, the least recently used first.
+        with self.lock:
+            while self.bytes > self.maxBytes and len(self.entries) > 0:
+                _, entry = self.entries.popitem(last=False)
+                self.bytes -= entry.bytes
+
+    def plan(self, url:str, query:str, block=None, useBigDecimal=False):
+        # Entities of the whole set with an integer range on a field are served from the cached segments,
+        # only the gaps of their windows are loaded.
+        ast = parse_query(query)
+        if len(ast.definitions) != 1:
+            return RangeLoad(self, query)
+        fields = []
+        load = RangeLoad(self, query)
+        for s in ast.definitions[0].selection_set.selections:
+            e = TheGraphEntity(s)
+            found = find_range(s) if e.tracks_changes() else None
+            load.keys.append(e.key)
+            if found == None:
+                fields.append(print_ast(s))
+                continue
+            column, lo, hi = found
+            # Like a load without the cache, the column is kept when the items select it or page on it.
+            hidden = column != e.orderBy and column not in [getattr(f, 'name', None) and f.name.value for f in s.selection_set.selections]
+            key = self.get_key(url, _with_bounds(s, column), column, block, useBigDecimal)
+            gaps, pieces, attrs = self._lookup(key, lo, hi)
+            load.ranges.append((e.key, column, lo, hi, hidden, e.orderBy, e.orderDirection == 'asc', pieces, attrs))
+            for gap in gaps:
+                alias = f'r{len(load.gaps)}_{e.key}'
+                fields.append(print_ast(_with_bounds(s, column, gap, alias)))
+                load.gaps.append((alias, key, column, gap[0], gap[1]))
+                load.aliases[alias] = e.key
+        if len(load.ranges) > 0:
+            load.query = None if len(fields) == 0 else '{' + ' '.join(fields) + '}'
+        return load
@@ -0,0 +1,115 @@
+from . import schema_utils
+import os
+import json
+import time
+import hashlib
+import threading
+
+SCHEMA_DIR = os.path.join('.bubbletea', 'schema')
+SCHEMA_TTL = 3600
+# Bumped when the saved index changes shape, older files are then introspected again.
+SCHEMA_VERSION = 3
+
+_indexes = {}
+_lock = threading.Lock()
+
+class SchemaIndex:
+    def __init__(self, types, lists=None, nonNull=None) -> None:
+        # `types` is either the introspected type list or the type map of a saved index, `lists` and `nonNull` its
+        # list and non null fields.
+        if isinstance(types, dict):
+            self.types = types
+            self.lists = set() if lists == None else set(lists)
+            self.nonNull = set() if nonNull == None else set(nonNull)
+        else:
+            self.types = {t['name']: schema_utils.get_field_types(t) for t in types}
+            self.lists = {f"{t['name']}.{f}" for t in types for f in schema_utils.get_list_fields(t)}
+            self.nonNull = {f"{t['name']}.{f}" for t in types for f in schema_utils.get_non_null_fields(t)}
+        self.paths = {}
+        pass
+
+    def add_types(self, names, data):
+        # `data` is the response of `schema_utils.get_type_inspect_query(names)`, unknown names are kept as empty types.
+        for i, n in enumerate(names):
+            t = data[f't{i}']
+            self.types[n] = {} if t == None else schema_utils.get_field_types(t)
+            if t != None:
+                self.lists.update(f'{n}.{f}' for f in schema_utils.get_list_fields(t))
+                self.nonNull.update(f'{n}.{f}' for f in schema_utils.get_non_null_fields(t))
+        self.paths = {}
+
+    def is_list_field(self, typeName:str, field:str):
+        return f'{typeName}.{field}' in self.lists
+
+    def is_non_null_field(self, typeName:str, field:str):
+        return f'{typeName}.{field}' in self.nonNull
+
+    def find_column_type(self, path:str):
+        if path in self.paths:
+            return self.paths[path]
+        segs = path.split('.')
+        t = segs[0]
+        for field in segs[1:]:
+            fields = self.types.get(t)
+            t = None if fields == None else fields.get(field)
+            if t == None:
+                break
+        self.paths[path] = t
+        return t
+
+
+def find_missing_types(index:SchemaIndex, selections):
+    # The names of the types a query walks through which are not in the index yet.
+    missing = []
+    pending = [('Query', selections)]
+    while len(pending) > 0:
+        typeName, selections = pending.pop()
+        fields = None if index == None else index.types.get(typeName)
+        if fields == None:
+            if typeName not in missing:
+                missing.append(typeName)
+            continue
+        for s in selections:
+            if getattr(s, 'name', None) == None or s.selection_set == None:
+                continue
+            t = fields.get(s.name.value)
+            if t != None:
+                pending.append((t, s.selection_set.selections))
+    return missing
+
+
+def _index_path(url):
+    return os.path.join(SCHEMA_DIR, f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.v{SCHEMA_VERSION}.json")
+
+def get_schema_index(url:str):
+    with _lock:
+        entry = _indexes.get(url)
+    if entry != None and time.time() - entry[0] <= SCHEMA_TTL:
+        return entry[1]
+    path = _index_path(url)
+    try:
+        created = os.path.getmtime(path)
+        if time.time() - created > SCHEMA_TTL:
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        index = SchemaIndex(data['types'], data['lists'], data['nonNull'])
+    except (OSError, ValueError, KeyError):
+        return None
+    with _lock:
+        _indexes[url] = (created, index)
+    return index
+
+def set_schema_index(url:str, index:SchemaIndex):
+    with _lock:
+        _indexes[url] = (time.time(), index)
+    try:
+        os.makedirs(SCHEMA_DIR, exist_ok=True)
+        path = _index_path(url)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'types': index.types, 'lists': sorted(index.lists), 'nonNull': sorted(index.nonNull)}, f)
+        os.replace(tmp, path)
+    except OSError:
+        # The in-process index still works when the directory is read-only.
+        pass
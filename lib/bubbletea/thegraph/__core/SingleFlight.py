@@ -0,0 +1,112 @@
+from .QueryTemplate import normalize_query
+import asyncio
+import hashlib
+import threading
+
+def get_flight_key(url:str, query:str, *options):
+    # Equivalent loads share a flight, the normalized text is cached per query.
+    normalized = normalize_query(query)
+    text = '\n'.join([url, normalized] + [repr(o) for o in options])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def _share(result):
+    # Every caller gets its own frames over the shared columns, adding or replacing a column stays local.
+    return {k: v.copy(deep=False) for k, v in result.items()}
+
+class Flight:
+    def __init__(self) -> None:
+        self.cond = threading.Condition()
+        self.progress = {}
+        self.version = 0
+        self.done = False
+        self.result = None
+        self.error = None
+        pass
+
+    def report(self, progress):
+        with self.cond:
+            self.progress.update(progress)
+            self.version += 1
+            self.cond.notify_all()
+
+    def land(self, result=None, error=None):
+        with self.cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+    def wait(self, progressCallback=None):
+        # Progress of the load is replayed to `progressCallback` on the waiting thread.
+        version = 0
+        while True:
+            with self.cond:
+                while not self.done and self.version == version:
+                    self.cond.wait()
+                progress = dict(self.progress) if self.version != version else None
+                version = self.version
+                done = self.done
+            if progress != None and progressCallback != None:
+                progressCallback(progress)
+            if done:
+                break
+        if self.error != None:
+            raise self.error
+        return self.result
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self.flights = {}
+        self.lock = threading.Lock()
+        pass
+
+    def _join(self, key):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight != None:
+                return flight, False
+            flight = Flight()
+            self.flights[key] = flight
+            return flight, True
+
+    def _land(self, key, flight, result=None, error=None):
+        with self.lock:
+            del self.flights[key]
+        flight.land(result, error)
+
+    def _leader_report(self, flight, progressCallback=None):
+        def report(progress):
+            flight.report(progress)
+            if progressCallback != None:
+                progressCallback(progress)
+        return report
+
+    def do(self, key, load, progressCallback=None):
+        # Concurrent calls with the same key run `load(progressCallback)` once and all get its result.
+        flight, leader = self._join(key)
+        if not leader:
+            return _share(flight.wait(progressCallback))
+        try:
+            result = load(self._leader_report(flight, progressCallback))
+        except BaseException as err:
+            self._land(key, flight, error=err)
+            raise
+        self._land(key, flight, result)
+        return result
+
+    async def do_async(self, key, load, progressCallback=None):
+        flight, leader = self._join(key)
+        if not leader:
+            # The flight may be led from another thread or event loop, it is awaited on an executor thread.
+            # Its progress is handed back to this loop as it is reported, before the result.
+            loop = asyncio.get_running_loop()
+            report = None if progressCallback == None else lambda progress: loop.call_soon_threadsafe(progressCallback, progress)
+            result = await loop.run_in_executor(None, flight.wait, report)
+            return _share(result)
+        try:
+            result = await load(self._leader_report(flight, progressCallback))
+        except BaseException as err:
+            self._land(key, flight, error=err)
+            raise
+        self._land(key, flight, result)
+        return result
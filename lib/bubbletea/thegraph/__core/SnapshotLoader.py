@@ -0,0 +1,117 @@
+from .SubgraphLoader import SubgraphLoader
+from .TheGraphEntity import TheGraphEntity
+from . import schema_utils
+from . import columnar
+from graphql import print_ast, FieldNode, NameNode, ArgumentNode, ObjectValueNode, ObjectFieldNode, IntValueNode
+import pandas as pd
+import concurrent.futures
+
+# Snapshots asked for in one request, and requests in flight.
+SNAPSHOTS_PER_REQUEST = 50
+SNAPSHOT_CONCURRENCY = 4
+# The block of each row while the frames are built, entities may have a field named `block` of their own.
+BLOCK_COLUMN = '_snapshotBlock'
+
+def _to_unix(t):
+    if isinstance(t, (int, float)):
+        return int(t)
+    return int(pd.Timestamp(t).timestamp())
+
+class SnapshotLoader(SubgraphLoader):
+    def __init__(self, subgraphUrl:str, query, batchSize=SNAPSHOTS_PER_REQUEST, maxConcurrency=SNAPSHOT_CONCURRENCY) -> None:
+        super().__init__(subgraphUrl, query)
+        self.batchSize = batchSize
+        self.maxConcurrency = maxConcurrency
+        for e in self.entities:
+            if e.bypassPagination or len(e.nested) > 0:
+                raise ValueError(f'`{e.key}`: snapshots are single requests per block, `bypassPagination`, `shards` and `syncBy` are not supported.')
+        pass
+
+    def _load_block_timestamps(self, numbers):
+        # The timestamps of the blocks as the subgraph's `_meta` reports them, `None` for blocks it can not answer.
+        text = self._load_subgraph_query(self.subgraphUrl, schema_utils.get_meta_blocks_query(numbers))
+        return [None if text['data'][f'm{i}'] == None else text['data'][f'm{i}']['block']['timestamp'] for i in range(len(numbers))]
+
+    def _resolve_timestamps(self, timestamps):
+        # The last block at or before each timestamp. All timestamps are searched at once, a round is one request
+        # with a probe per timestamp. Rounds alternate between interpolating on the block times and halving.
+        text = self._post_query(self.subgraphUrl, schema_utils.get_meta_blocks_query([]))
+        head = text['data']['_meta']['block']
+        headNumber, headTime = head['number'], head['timestamp']
+        # `(lo, loTime, hi, hiTime)` per timestamp, the block is in `[lo, hi)`.
+        bounds = {t: (0, None, headNumber + 1, None) for t in timestamps if t < headTime}
+        blocks = {t: headNumber for t in timestamps if t >= headTime}
+        rounds = 0
+        while len(bounds) > 0:
+            probes = {}
+            for t, (lo, loTime, hi, hiTime) in bounds.items():
+                if rounds % 2 == 0 and loTime != None and hiTime != None and hiTime > loTime:
+                    mid = lo + int((t - loTime) * (hi - lo) / (hiTime - loTime))
+                else:
+                    mid = (lo + hi) // 2
+                probes[t] = min(max(mid, lo + 1), hi - 1)
+            numbers = sorted(set(probes.values()))
+            times = dict(zip(numbers, self._load_block_timestamps(numbers)))
+            for t, mid in probes.items():
+                lo, loTime, hi, hiTime = bounds[t]
+                if times[mid] == None or times[mid] > t:
+                    bounds[t] = (lo, loTime, mid, times[mid])
+                else:
+                    bounds[t] = (mid, times[mid], hi, hiTime)
+                lo, loTime, hi, hiTime = bounds[t]
+                if hi - lo <= 1:
+                    blocks[t] = lo
+                    del bounds[t]
+            rounds += 1
+        return blocks
+
+    def _snapshot_field(self, entity:TheGraphEntity, block):
+        # The entity's field pinned to `block`, aliased `b<block>_<key>` so many blocks fit in one request.
+        node = entity.node
+        arguments = [a for a in node.arguments if a.name.value != 'block']
+        number = ObjectValueNode(fields=[ObjectFieldNode(name=NameNode(value='number'), value=IntValueNode(value=str(block)))])
+        arguments.append(ArgumentNode(name=NameNode(value='block'), value=number))
+        alias = NameNode(value=f'b{block}_{entity.key}')
+        return print_ast(FieldNode(alias=alias, name=node.name, arguments=arguments, directives=node.directives, selection_set=node.selection_set))
+
+    def _load_snapshot_batch(self, blocks):
+        query = '{' + ' '.join([self._snapshot_field(e, b) for b in blocks for e in self.entities]) + '}'
+        return blocks, self._load_subgraph_query(self.subgraphUrl, query)['data']
+
+    def load_snapshots(self, blocks=None, timestamps=None, progressCallback=None, useBigDecimal=False):
+        self._start_schema_load()
+        if (blocks == None) == (timestamps == None):
+            raise ValueError('Snapshots are taken either at `blocks` or at `timestamps`.')
+        requested = None
+        if timestamps != None:
+            resolved = self._resolve_timestamps(sorted(set(_to_unix(t) for t in timestamps)))
+            requested = pd.DataFrame({'snapshot': pd.to_datetime(list(resolved.keys()), unit='s'), BLOCK_COLUMN: list(resolved.values())})
+            blocks = resolved.values()
+        blocks = sorted(set(int(b) for b in blocks))
+        if len(blocks) == 0:
+            # Nothing to request, every entity gets an empty frame indexed like a loaded one.
+            index = pd.Index([], dtype='int64', name='block')
+            return {e.key: pd.DataFrame(columns=[] if requested is None else ['snapshot'], index=index) for e in self.entities}
+        batches = [blocks[i:i + self.batchSize] for i in range(0, len(blocks), self.batchSize)]
+        pages = {e.key: [] for e in self.entities}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(len(batches), self.maxConcurrency))) as executor:
+            # Results come back in block order, progress is reported on the calling thread.
+            for batchBlocks, data in executor.map(self._load_snapshot_batch, batches):
+                for b in batchBlocks:
+                    for e in self.entities:
+                        items = data[f'b{b}_{e.key}']
+                        items = [] if items == None else (items if isinstance(items, list) else [items])
+                        page = columnar.page_to_columns(items)
+                        page[BLOCK_COLUMN] = [b] * len(items)
+                        pages[e.key].append(page)
+                        e.loaded += len(items)
+                if progressCallback != None:
+                    progressCallback({e.key: e.loaded for e in self.entities})
+        result = {}
+        for e in self.entities:
+            df = self._process_datatypes(e, pages[e.key], useBigDecimal)
+            if requested is not None:
+                # One snapshot per requested timestamp, timestamps within one block share its rows.
+                df = requested.merge(df, on=BLOCK_COLUMN).sort_values(['snapshot', BLOCK_COLUMN], kind='stable')
+            result[e.key] = df.set_index(BLOCK_COLUMN).rename_axis('block')
+        return result
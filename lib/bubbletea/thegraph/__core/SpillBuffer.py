@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import threading
+
+# Raw pages of an entity are converted to a typed batch once this many rows are pending.
+SPILL_BATCH_ROWS = 50000
+
+def _concat_tables(tables):
+    # Columns that were all null in a batch take the type of the other batches, decimals widen to fit every batch.
+    import pyarrow as pa
+    try:
+        return pa.concat_tables(tables, promote_options='permissive')
+    except TypeError:
+        return pa.concat_tables(tables, promote=True)
+
+class SpillBuffer:
+    def __init__(self, memoryBudget:int, spillDir:str=None, arrowDecimal=False) -> None:
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('memoryBudget requires `pyarrow`. Install it with `pip install pyarrow`.')
+        self.memoryBudget = memoryBudget
+        self.spillDir = spillDir
+        self.arrowDecimal = arrowDecimal
+        self.tables = []
+        self.bytes = 0
+        self.files = []
+        self.cursors = []
+        self.dir = None
+        self.lock = threading.Lock()
+        pass
+
+    def add(self, df, cursor=None):
+        # `cursor` is the highest `syncBy` value of the batch, the raw pages it was read from are gone afterwards.
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with self.lock:
+            self.tables.append(table)
+            self.bytes += table.nbytes
+            if cursor != None:
+                self.cursors.append(cursor)
+            if self.bytes > self.memoryBudget:
+                self._spill()
+
+    def _spill(self):
+        # Uncompressed Arrow IPC files, so they are read back memory mapped instead of into the heap.
+        import pyarrow as pa
+        if self.dir == None:
+            self.dir = tempfile.mkdtemp(prefix='bubbletea-spill-', dir=self.spillDir)
+        path = os.path.join(self.dir, f'{len(self.files)}.arrow')
+        table = _concat_tables(self.tables)
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        self.files.append(path)
+        self.tables = []
+        self.bytes = 0
+
+    def to_pandas(self, df=None):
+        # The spilled batches, the batches still in memory and `df` (the last pages) as one DataFrame.
+        import pyarrow as pa
+        tables = [pa.ipc.open_file(pa.memory_map(f)).read_all() for f in self.files] + self.tables
+        if df is not None and len(df) > 0:
+            tables.append(pa.Table.from_pandas(df, preserve_index=False))
+        self.tables = []
+        if len(tables) == 0:
+            return df
+        table = _concat_tables(tables)
+        del tables
+        # Decimal columns of `useBigDecimal='arrow'` stay Arrow backed, otherwise they come back as `Decimal` objects.
+        types_mapper = None
+        if self.arrowDecimal:
+            import pandas as pd
+            types_mapper = lambda t: pd.ArrowDtype(t) if pa.types.is_decimal(t) else None
+        result = table.to_pandas(split_blocks=True, self_destruct=True, types_mapper=types_mapper)
+        self.close()
+        return result
+
+    def close(self):
+        if self.dir != None:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+            self.files = []
@@ -1,39 +1,108 @@
-from .TheGraphEntity import TheGraphEntity
+from .TheGraphEntity import TheGraphEntity, NESTED_ITEMS_PER_PAGE
+from .SchemaIndex import SchemaIndex, get_schema_index, set_schema_index, find_missing_types
 from . import schema_utils
-import streamlit as st
-from decimal import Decimal
-import requests
+from . import sync_utils
+from . import decimal_utils
+from . import columnar
+from .PageSizer import get_page_sizer, is_page_size_error
+from .SpillBuffer import SpillBuffer, SPILL_BATCH_ROWS
+from .QueryTemplate import parse_query, compose_query
+from ...http_client import get_http_client
+from ...cache import get_cache, get_cache_key
 import pandas as pd
-from graphql import parse
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-import urllib.parse
+import json
+from graphql import ObjectFieldNode, ObjectValueNode, NameNode, IntValueNode, StringValueNode
+import concurrent.futures
+import queue
+import asyncio
+import time
 
-s = requests.Session()
+# Parents whose nested items are paged in one request, and requests of one nested entity in flight.
+NESTED_BATCH_SIZE = 50
+NESTED_CONCURRENCY = 4
+# Types of the `orderBy` fields a `bypassPagination` entity can page on, other orders page on ids and are sorted at the end.
+CURSOR_TYPES = ['Int', 'Int8', 'BigInt', 'BigDecimal', 'String', 'Bytes', 'ID', 'Timestamp']
 
-retries = Retry(total=5,
-                backoff_factor=0.2,
-                status_forcelist=[ 500, 502, 503, 504, 522 ])
-
-# s.mount('https://api.studio.thegraph.com', HTTPAdapter(max_retries=retries))
+def can_batch_pages(query:str):
+    # Entities paging on plain cursors, sharded, synced and nested entities have loads of their own.
+    try:
+        ast = parse_query(query)
+    except Exception:
+        return False
+    if len(ast.definitions) != 1:
+        return False
+    for s in ast.definitions[0].selection_set.selections:
+        e = TheGraphEntity(s)
+        if e.shards > 1 or e.syncBy != None or len(e.nested) > 0:
+            return False
+    return True
 
 class SubgraphLoader:
-    def __init__(self, subgraphUrl:str, query) -> None:
+    def __init__(self, subgraphUrl:str, query, syncDir=None, block=None, targetedSchema=False, memoryBudget=None) -> None:
         self.subgraphUrl = subgraphUrl
-        self.types = None
-        self.types = self._load_schema()
+        self.memoryBudget = memoryBudget
+        self.useBigDecimal = False
+        self.block = block
+        self.syncDir = sync_utils.SYNC_DIR if syncDir == None else syncDir
+        self.syncStates = {}
+        self.targetedSchema = targetedSchema
+        self.schema = get_schema_index(subgraphUrl)
+        self.schemaFuture = None
         self.entities = self._parse_thegraph_query(query)
         pass
 
-    @st.cache(show_spinner=False)
     def _load_schema(self):
         query = schema_utils.get_inspect_query()
-        response = requests.post(self.subgraphUrl, json={'query': query})
-        text = schema_utils.process_response_to_json(response)
+        text = self._post_query(self.subgraphUrl, query)
         return text['data']['__schema']['types']
 
+    def _load_schema_index(self):
+        selections = [e.node for e in self.entities]
+        missing = find_missing_types(self.schema, selections)
+        if len(missing) == 0:
+            return self.schema
+        if self.targetedSchema:
+            index = SchemaIndex({} if self.schema == None else dict(self.schema.types), None if self.schema == None else self.schema.lists, None if self.schema == None else self.schema.nonNull)
+            while len(missing) > 0:
+                text = self._post_query(self.subgraphUrl, schema_utils.get_type_inspect_query(missing))
+                index.add_types(missing, text['data'])
+                missing = find_missing_types(index, selections)
+        else:
+            index = SchemaIndex(self._load_schema())
+        set_schema_index(self.subgraphUrl, index)
+        return index
+
+    def _start_schema_load(self):
+        # The schema is only needed to convert the results, it loads next to the first data page.
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.schemaFuture = executor.submit(self._load_schema_index)
+        executor.shutdown(wait=False)
+
+    def _get_schema(self):
+        # Streams ask for the schema from their own threads, the future is read once into a local.
+        future = self.schemaFuture
+        if future != None:
+            self.schema = future.result()
+            self.schemaFuture = None
+        return self.schema
+
+    def _load_block_number(self):
+        text = self._post_query(self.subgraphUrl, schema_utils.get_meta_block_query())
+        return text['data']['_meta']['block']['number']
+
+    def _pin_block(self, block):
+        # Every generated query reads the same block, so the result is one consistent snapshot.
+        self.block = block
+        self.entities = [e.at_block(block) for e in self.entities]
+
+    def _resolve_block(self):
+        if self.block == 'latest':
+            self._pin_block(self._load_block_number())
+        elif self.block != None:
+            self._pin_block(int(self.block))
+
     def _parse_thegraph_query(self, queryTemplate):
-        ast = parse(queryTemplate, no_location=True)
+        ast = parse_query(queryTemplate)
         if(len(ast.definitions) != 1):
             raise ValueError('The graph query must have one and only definition.')
 
@@ -41,123 +110,607 @@ class SubgraphLoader:
         selections = ast.definitions[0].selection_set.selections
         for s in selections:
             entity = TheGraphEntity(s)
+            entity.pageSizer = get_page_sizer(self.subgraphUrl, entity.name)
+            # A limit a nested field runs into belongs to this endpoint, not to every sizer without one.
+            for c in entity.nested:
+                c.pageSizer = get_page_sizer(self.subgraphUrl, f'{entity.name}.{c.name}')
             entities.append(entity)
         return entities
 
 
-    # class SubgraphHashReference:
-    #     def __init__(self, url:str, query:str, progressCallback=None, useBigDecimal=False):
-    #         self.url = url
-    #         self.query = query
-    #         self.progressCallback = progressCallback
-    #         self.useBigDecimal = useBigDecimal
+    def _load_subgraph_query(self, url, query, variables=None):
+        # Answers are kept by the cache backend under a key of the request, error responses are never stored.
+        cache = get_cache()
+        if cache == None:
+            return self._post_query(url, query, variables)
+        key = get_cache_key(url, query, variables)
+        body = cache.get(key)
+        if body != None:
+            return schema_utils.process_body_to_json(200, body)
+        response = self._post(url, query, variables)
+        text = schema_utils.process_response_to_json(response)
+        cache.set(key, response.content)
+        return text
+
+    def _load_page_query(self, entities, query, variables):
+        # Pages are cached without their size, which adapts from load to load, and the same cursors find them again.
+        # A cached page comes with the sizes it was asked with, the entities take them back to judge a short page.
+        cache = get_cache()
+        if cache == None or variables == None:
+            return self._load_subgraph_query(self.subgraphUrl, query, variables)
+        key = get_cache_key(self.subgraphUrl, query, {n: v for n, v in variables.items() if not n.endswith('_first')}, 'page')
+        body = cache.get(key)
+        if body != None:
+            sizes, body = body.split(b'\n', 1)
+            for e, size in zip(entities, json.loads(sizes)):
+                e.pageSize = size
+            return schema_utils.process_body_to_json(200, body)
+        response = self._post(self.subgraphUrl, query, variables)
+        text = schema_utils.process_response_to_json(response)
+        cache.set(key, json.dumps([e.pageSize for e in entities]).encode('utf-8') + b'\n' + response.content)
+        return text
 
-    # def hash_subgraph_ref(hashRef):
-    #     hash =  f"bubbletea_load_subgraph_{hashRef.url}_{hashRef.query}_{hashRef.progressCallback}_{hashRef.useBigDecimal}"
-    #     return hash
+    def _post(self, url, query, variables=None):
+        body = {'query': query} if variables == None else {'query': query, 'variables': variables}
+        return get_http_client().post(url, json=body, timeout=schema_utils.REQUEST_TIMEOUT)
 
-    # @st.cache(show_spinner=False, hash_funcs={SubgraphHashReference: hash_subgraph_ref}, allow_output_mutation=True)
-    @st.cache(show_spinner=False)
-    def _load_subgraph_query(self, url, query):
+    def _post_query(self, url, query, variables=None):
+        return schema_utils.process_response_to_json(self._post(url, query, variables))
 
-        parsed_url = urllib.parse.urlparse(url)
-        s.mount(f"{parsed_url.scheme}://{parsed_url.netloc}", HTTPAdapter(max_retries=retries))
-        response = s.post(url, json={'query':query})
-        return schema_utils.process_response_to_json(response)
+    def _get_converter_plan(self, entity:TheGraphEntity, columns):
+        # The schema types of an entity's columns, resolved once and reused for every page.
+        key = tuple(columns)
+        if entity.converterPlan == None or entity.converterPlan[0] != key:
+            schema = self._get_schema()
+            en = entity.typeName if entity.typeName != None else schema.find_column_type(f'Query.{entity.name}')
+            plan = {}
+            for c in columns:
+                t = schema.find_column_type(f"{en}.{c}")
+                if t != None and t.lower() in ['int', 'bigdecimal', 'bigint']:
+                    plan[c] = t.lower()
+            entity.converterPlan = (key, plan)
+        return entity.converterPlan[1]
 
     def _process_datatypes(self, entity:TheGraphEntity, data, useBigDecimal):
-        if self.types == None:
-            self.types = self.__load_schema()
-        df = pd.json_normalize(data)
-        # en = schema_utils.find_column_type(en, self.types)
-        en = schema_utils.find_column_type(f'Query.{entity.name}', self.types)
-        # if en.endswith('s'):
-        #     en = f"{en[0:1].upper()}{en[1:len(en) - 1]}"
-
-        columns = df.columns
+        df = pd.DataFrame(columnar.concat_pages(data))
+        plan = self._get_converter_plan(entity, df.columns)
+
         astypes = {}
-        for c in columns:
-            path = f"{en}.{c}"
-            t = schema_utils.find_column_type(path, self.types)
-            dt = df.dtypes[c]
-            if t == None:
-                continue
-            t = t.lower()
-            if t in ['int']:
-                if dt == 'int64':
-                    timestamp_matched = df[(1500000000 <= df[c]) & (df[c] <= 1800000000)]
-                    if len(timestamp_matched) == len(df):
-                        df[c] = df[c].apply(lambda x: pd.to_datetime(x, unit='s'))
-                    pass
+        for c, t in plan.items():
+            col = df[c]
+            if t == 'int':
+                if col.dtype == 'int64':
+                    if len(col) == 0 or (schema_utils.TIMESTAMP_MIN <= col.min() and col.max() <= schema_utils.TIMESTAMP_MAX):
+                        df[c] = pd.to_datetime(col, unit='s')
                 else:
-                    timestamp_matched = df[df[c].str.match(schema_utils.REGEX_TIMESTAMP) == True]
-                    if len(timestamp_matched) == len(df):
-                        df[c] = df[c].apply(lambda x: pd.to_datetime(x, unit='s'))
-                    else:
+                    values = pd.to_numeric(col, errors='coerce')
+                    if len(values) == 0 or (values.notna().all() and schema_utils.TIMESTAMP_MIN <= values.min() and values.max() <= schema_utils.TIMESTAMP_STR_MAX):
+                        df[c] = pd.to_datetime(values, unit='s')
+                    elif values.notna().all():
                         astypes[c] = 'int64'
-            elif t in ['bigdecimal','bigint']:
-                if useBigDecimal:
-                    df[c] = df[c].apply(lambda x: Decimal(x))
-                else:
-                    astypes[c] = 'float64'
+            elif useBigDecimal == decimal_utils.ARROW:
+                df[c] = decimal_utils.to_arrow_decimal(col)
+            elif useBigDecimal:
+                df[c] = decimal_utils.to_decimal(col)
+            else:
+                astypes[c] = 'float64'
         if len(astypes.keys()) > 0:
             df = df.astype(astypes, copy=False)
         return df
 
-    def _load_page(self, progressCallback=None, initialPage=False):
-        query = '{'
-        has_entity = False
-        for e in self.entities:
-            if initialPage:
-                query += e.initialQuery
-                has_entity = True
-            elif e.bypassPagination and e.lastId != None:
-                # print(f"???_load_page {e.name}\t{e.lastId}")
-                eq = e.paginationQuery.replace('__LASTID__', e.lastId)
-                query += str(eq)
-                has_entity = True
-        query += '}'
-        if not has_entity:
-            return False
+    def _cursor_types(self, entity:TheGraphEntity, ordered=True):
+        # The schema types of the cursor variables. The requested order is kept when `orderBy` is a non null scalar,
+        # nulls would fall out of the cursor filters.
+        schema = self._get_schema()
+        en = entity.typeName if entity.typeName != None else schema.find_column_type(f'Query.{entity.name}')
+        idType = schema.find_column_type(f'{en}.id') or 'ID'
+        orderType = None
+        if ordered and entity.syncBy == None and entity.orderBy not in [None, 'id'] and schema.is_non_null_field(en, entity.orderBy):
+            t = schema.find_column_type(f'{en}.{entity.orderBy}')
+            orderType = t if t in CURSOR_TYPES else None
+        return idType, orderType
 
-        # print(f'~~~query~~~\n{query}\n\n')
-        
-        text = self._load_subgraph_query(self.subgraphUrl, query)
+    def _build_page_query(self, entities, initialPage=False):
+        fields = []
+        variables = {}
+        for e in entities:
+            if initialPage or (e.bypassPagination and e.hasNextPage):
+                # The first page needs no cursor, the schema is waited for from the second one.
+                if e.bypassPagination and not e.has_cursor_types() and not (initialPage and e.lastId == None):
+                    e.use_cursor_types(*self._cursor_types(e))
+                text, values = e.build_query(initialPage)
+                fields.append(text)
+                variables.update(values)
+        if len(fields) == 0:
+            return None
+        return compose_query(fields, variables)
+
+    def _process_page(self, entities, text, progressCallback=None):
         data = text['data']
         has_more_page = False
         progress = {}
         for k in data.keys():
-            for e in self.entities:
-                if k == e.name:
+            for e in entities:
+                if k == e.key:
                     d = data[k]
+                    if e.bypassPagination:
+                        d, more = e.advance(d)
+                        has_more_page = has_more_page or more
                     l = len(d)
-                    e.data.extend(d)
+                    columns = columnar.page_to_columns(d)
+                    for c in e.nested:
+                        # Nested items are kept apart with their parent ids, they end up in a frame of their own.
+                        if len(columns) > 0:
+                            e.nestedData.setdefault(c.name, []).append((columns['id'], columns.pop(c.name)))
+                    e.data.append(columns)
+                    e.loaded += l
+                    if e.spill != None and columnar.count_rows(e.data) >= SPILL_BATCH_ROWS:
+                        self._spill_pages(e)
                     if progressCallback != None:
-                        progress[k] = l + len(e.data)
-
-                    if e.bypassPagination:
-                        e.lastId = None if l == 0 else d[l-1]['id']
-                        # print(f'~~~{e.name}\t{k}\t{l}\t{e.lastId}~~~\n{d}\n\n')
-                        if l >= schema_utils.get_max_items_per_page():
-                            has_more_page = True 
+                        progress[k] = e.loaded
         if progressCallback != None:
             progressCallback(progress)
         return has_more_page
-    
 
-    def beta_load_subgraph(self, progressCallback=None, useBigDecimal=False):
-        # print('?????beta_load_subgraph')
-        has_more_page = self._load_page(progressCallback, True)
-        # print(f'?????has_more_page {has_more_page}')
+    def _record_page_time(self, entities, seconds):
+        for e in entities:
+            if e.bypassPagination and e.pageSize != None:
+                e.pageSizer.record(e.pageSize, seconds)
+
+    def _shrink_page(self, entities, error):
+        # The same cursors are asked again with smaller pages, the load goes on where it was.
+        if not is_page_size_error(error):
+            return False
+        shrunk = [e.pageSizer.shrink(e.pageSize, error) for e in entities if e.bypassPagination and e.pageSize != None]
+        return any(shrunk)
+
+    def _fetch_page(self, entities, initialPage=False):
+        return self._fetch_query(entities, lambda: self._build_page_query(entities, initialPage))
+
+    def _fetch_query(self, entities, build):
+        while True:
+            built = build()
+            if built == None:
+                return None
+            query, variables = built
+            # print(f'~~~query~~~\n{query}\n\n')
+            start = time.monotonic()
+            try:
+                if any(e.syncBy != None for e in entities):
+                    # Delta queries must see entities indexed since the last run, never a memoized page.
+                    text = self._post_query(self.subgraphUrl, query, variables)
+                else:
+                    text = self._load_page_query(entities, query, variables)
+            except Exception as err:
+                if not self._shrink_page(entities, err):
+                    raise
+                continue
+            self._record_page_time(entities, time.monotonic() - start)
+            return text
+
+    def _load_page(self, progressCallback=None, initialPage=False, entities=None):
+        text = self._fetch_page(entities, initialPage)
+        if text == None:
+            return False
+        return self._process_page(entities, text, progressCallback)
+
+    def _load_entity_pages(self, entities, progressCallback=None):
+        # The entities on one stream, every request asks for the next page of each entity that has one.
+        # Each entity keeps its own cursor and page size.
+        has_more_page = self._load_page(progressCallback, True, entities)
         while has_more_page:
-            has_more_page = self._load_page(progressCallback, False)
-            
+            has_more_page = self._load_page(progressCallback, False, entities)
+
+    def _load_entity(self, entity:TheGraphEntity, progressCallback=None):
+        if entity.shards > 1:
+            self._load_sharded_entity(entity, progressCallback)
+        else:
+            self._load_entity_pages([entity], progressCallback)
+
+    def _report_progress(self, progress, progressCallback=None):
+        merged = {}
+        while not progress.empty():
+            merged.update(progress.get())
+        if progressCallback != None and len(merged) > 0:
+            progressCallback(merged)
+
+    def _load_entity_streams(self, progressCallback=None):
+        # Every root entity paginates concurrently, a small entity is done without waiting for a large one.
+        # Progress is handed to the callback on the calling thread, Streamlit only draws from the script thread.
+        progress = queue.Queue()
+        report = None if progressCallback == None else progress.put
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self.entities))) as executor:
+            futures = [executor.submit(self._load_entity, e, report) for e in self.entities]
+            pending = futures
+            while len(pending) > 0:
+                done, pending = concurrent.futures.wait(pending, timeout=0.1)
+                self._report_progress(progress, progressCallback)
+        # A failing entity does not stop the others, its error is raised once every stream has ended.
+        for f in futures:
+            f.result()
+
+    def _nested_parent_field(self, entity:TheGraphEntity, child:TheGraphEntity):
+        # The single entity lookup of the parent type, for example `pool(id:)` for the swaps of `pools`.
+        schema = self._get_schema()
+        parentType = schema.find_column_type(f'Query.{entity.name}')
+        if not schema.is_list_field(parentType, child.name):
+            raise ValueError(f'`bypassPagination` of `{entity.name}.{child.name}` is only supported on list fields.')
+        child.typeName = schema.find_column_type(f'{parentType}.{child.name}')
+        for field, t in schema.types.get('Query', {}).items():
+            if t == parentType and not schema.is_list_field('Query', field):
+                return field
+        raise ValueError(f'The subgraph has no single `{parentType}` query to paginate `{entity.name}.{child.name}` with.')
+
+    def _add_nested_items(self, child:TheGraphEntity, state, parentId, items, pageSize):
+        parentIds, children, pending = state
+        items = [] if items == None else items
+        parentIds.extend([parentId] * len(items))
+        children.extend(items)
+        child.pageSizer.accept(pageSize, len(items))
+        if not child.pageSizer.is_last_page(pageSize, len(items)):
+            pending[parentId] = items[-1]['id']
+        else:
+            pending.pop(parentId, None)
+
+    def _start_nested(self, entity:TheGraphEntity, child:TheGraphEntity):
+        # The first items of every parent came with the parent pages, a parent with a full first page has more.
+        state = ([], [], {})
+        for ids, lists in entity.nestedData.get(child.name, []):
+            for parentId, items in zip(ids, lists):
+                self._add_nested_items(child, state, parentId, items, NESTED_ITEMS_PER_PAGE)
+        return state
+
+    def _nested_batches(self, child:TheGraphEntity, pending):
+        # Every batch has a copy of the entity to keep its own page size, the copies learn on the same sizer.
+        items = list(pending.items())
+        return [(child.with_filters([]), items[i:i + NESTED_BATCH_SIZE]) for i in range(0, len(items), NESTED_BATCH_SIZE)]
+
+    def _process_nested_page(self, child:TheGraphEntity, batch, pageSize, text, state):
+        for i, (parentId, lastId) in enumerate(batch):
+            parent = text['data'][f'p{i}']
+            self._add_nested_items(child, state, parentId, None if parent == None else parent[child.name], pageSize)
+
+    def _finish_nested(self, child:TheGraphEntity, state):
+        parentIds, children, pending = state
+        page = {'parent.id': parentIds}
+        page.update(columnar.page_to_columns(children))
+        child.data = [page]
+
+    def _load_nested_entity(self, entity:TheGraphEntity, child:TheGraphEntity):
+        field = self._nested_parent_field(entity, child)
+        child.use_cursor_types(self._cursor_types(child, False)[0])
+        state = self._start_nested(entity, child)
+
+        def load(job):
+            copy, batch = job
+            text = self._fetch_query([copy], lambda: compose_query(*copy.build_nested_query(field, batch, entity.block)))
+            return batch, copy.pageSize, text
+
+        while len(state[2]) > 0:
+            jobs = self._nested_batches(child, state[2])
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(jobs), NESTED_CONCURRENCY)) as executor:
+                for batch, pageSize, text in executor.map(load, jobs):
+                    self._process_nested_page(child, batch, pageSize, text, state)
+        self._finish_nested(child, state)
+
+    def _check_nested(self):
+        # Nested fields are checked against the schema before the first page, not after the parents have loaded.
+        for e in self.entities:
+            for c in e.nested:
+                self._nested_parent_field(e, c)
+                # Nested items page by id, their `orderBy` is applied once loaded and needs a field of the items.
+                if c.orderBy not in [None, 'id'] and c.orderBy not in [getattr(f, 'name', None) and f.name.value for f in c.selectionSet.selections]:
+                    raise ValueError(f'`orderBy: {c.orderBy}` of `{e.name}.{c.name}` sorts the loaded items, it must be a field of them.')
+
+    def _load_nested_entities(self):
+        for e in self.entities:
+            for c in e.nested:
+                self._load_nested_entity(e, c)
+
+    def _shard_bounds_query(self, entity:TheGraphEntity):
+        if entity.shardBy == 'id':
+            return None
+        lower, upper = self._shard_bounds_from_filters(entity)
+        if lower == None or upper == None:
+            return entity.build_bounds_query(entity.shardBy)
+        return None
+
+    def _shard_bounds_from_filters(self, entity:TheGraphEntity):
+        field = entity.shardBy
+        filters = entity.where_filters()
+        lower = filters.get(f'{field}_gte')
+        if lower == None and filters.get(f'{field}_gt') != None:
+            lower = int(filters.get(f'{field}_gt')) + 1
+        upper = filters.get(f'{field}_lt')
+        if upper == None and filters.get(f'{field}_lte') != None:
+            upper = int(filters.get(f'{field}_lte')) + 1
+        return lower, upper
+
+    def _shard_bounds(self, entity:TheGraphEntity, boundsData=None):
+        field = entity.shardBy
+        lower, upper = self._shard_bounds_from_filters(entity)
+        if boundsData != None:
+            if len(boundsData['lower']) == 0:
+                return None, None
+            lower = boundsData['lower'][0][field] if lower == None else lower
+            upper = int(boundsData['upper'][0][field]) + 1 if upper == None else upper
+        return int(lower), int(upper)
+
+    def _shard_filters(self, entity:TheGraphEntity, boundsData=None):
+        field = entity.shardBy
+        if field == 'id':
+            # Entity ids are hex strings, split the space on their leading hex digits.
+            # Bytes ids only take whole bytes, the bounds have an even number of digits.
+            width = 2
+            while 16 ** width < entity.shards:
+                width += 2
+            bounds = [f"0x{(i * 16 ** width // entity.shards):0{width}x}" for i in range(1, entity.shards)]
+            valueNode = StringValueNode
+        else:
+            lower, upper = self._shard_bounds(entity, boundsData)
+            if lower == None:
+                return [[]]
+            step = max(1, -(-(upper - lower) // entity.shards))
+            bounds = list(range(lower + step, upper, step))
+            schema = self._get_schema()
+            en = schema.find_column_type(f'Query.{entity.name}')
+            t = schema.find_column_type(f'{en}.{field}')
+            valueNode = StringValueNode if t != None and t.lower() in ['bigint', 'bigdecimal'] else IntValueNode
+
+        filters = []
+        for i in range(len(bounds) + 1):
+            f = []
+            if i > 0:
+                f.append(ObjectFieldNode(name=NameNode(value=f'{field}_gte'), value=valueNode(value=str(bounds[i - 1]))))
+            if i < len(bounds):
+                f.append(ObjectFieldNode(name=NameNode(value=f'{field}_lt'), value=valueNode(value=str(bounds[i]))))
+            filters.append(f)
+        return filters
+
+    def _shard_progress_callback(self, entity:TheGraphEntity, shards, progressCallback=None):
+        def report(progress):
+            if progressCallback != None:
+                progressCallback({entity.key: sum(s.loaded for s in shards)})
+        return report
+
+    def _load_sharded_entity(self, entity:TheGraphEntity, progressCallback=None):
+        query = self._shard_bounds_query(entity)
+        boundsData = None if query == None else self._load_subgraph_query(self.subgraphUrl, query)['data']
+        shards = [entity.with_filters(f) for f in self._shard_filters(entity, boundsData)]
+        report = self._shard_progress_callback(entity, shards, progressCallback)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            list(executor.map(lambda shard: self._load_entity_pages([shard], report), shards))
+        for shard in shards:
+            entity.data.extend(shard.data)
+
+    def _prepare_sync(self, useBigDecimal=False):
+        entities = []
+        for e in self.entities:
+            if e.syncBy == None:
+                entities.append(e)
+                continue
+            # The pinned block changes with every head, the state is kept for the unpinned query.
+            key = sync_utils.get_state_key(self.subgraphUrl, e if e.block == None else e.at_block(None), useBigDecimal)
+            state = sync_utils.load_state(self.syncDir, key)
+            self.syncStates[e.name] = (key, state)
+            if state == None or state['cursor'] == None:
+                entities.append(e)
+            elif e.syncBy == 'id':
+                e.lastId = state['cursor']
+                entities.append(e)
+            else:
+                cursor = state['cursor']
+                valueNode = IntValueNode if isinstance(cursor, int) else StringValueNode
+                cursorFilter = ObjectFieldNode(name=NameNode(value=f'{e.syncBy}_gte'), value=valueNode(value=str(cursor)))
+                entities.append(e.with_filters([cursorFilter], e.shards))
+        self.entities = entities
+
+    def _prepare_changes(self, changedSince=None):
+        # Entities tracking changes only load the items changed at or after block `changedSince`, the others load whole.
+        if changedSince == None:
+            return
+        number = ObjectFieldNode(name=NameNode(value='number_gte'), value=IntValueNode(value=str(changedSince)))
+        changed = ObjectFieldNode(name=NameNode(value='_change_block'), value=ObjectValueNode(fields=[number]))
+        self.entities = [e.with_filters([changed], e.shards) if e.tracks_changes() else e for e in self.entities]
+
+    def _prepare_spill(self, useBigDecimal=False):
+        # With a memory budget, pages are converted to typed batches as they arrive instead of at the end.
+        self.useBigDecimal = useBigDecimal
+        if self.memoryBudget == None:
+            return
+        for e in self.entities:
+            e.spill = SpillBuffer(self.memoryBudget, arrowDecimal=(useBigDecimal == decimal_utils.ARROW))
+
+    def _spill_pages(self, entity:TheGraphEntity):
+        df = self._process_datatypes(entity, entity.data, self.useBigDecimal)
+        cursor = None if entity.syncBy == None else sync_utils.find_cursor(entity.data, entity.syncBy)
+        entity.data = []
+        entity.spill.add(df, cursor)
+
+    def _merge_sync_state(self, entity:TheGraphEntity, df):
+        key, state = self.syncStates[entity.name]
+        data = entity.data if entity.spill == None else entity.data + [{entity.syncBy: entity.spill.cursors}]
+        cursor = sync_utils.find_cursor(data, entity.syncBy, None if state == None else state['cursor'])
+        if state != None:
+            df = pd.concat([state['df'], df], ignore_index=True)
+            df.drop_duplicates('id', keep='last', inplace=True, ignore_index=True)
+        sync_utils.save_state(self.syncDir, key, cursor, df)
+        return df
+
+    def _build_result(self, useBigDecimal=False):
         result = {}
         for e in self.entities:
             df = self._process_datatypes(e, e.data, useBigDecimal)
-            if e.bypassPagination and e.orderBy != None:
+            if e.spill != None:
+                df = e.spill.to_pandas(df)
+            if e.syncBy != None:
+                df = self._merge_sync_state(e, df)
+            if e.bypassPagination and e.orderBy in df.columns and not (e.cursorField != None and e.shards <= 1):
+                # Pages that followed `orderBy` arrive sorted, only id pages and concatenated shards are sorted here.
+                # Items without the `orderBy` field stay in id order.
                 ascending = (e.orderDirection == 'asc')
                 df.sort_values(e.orderBy, ascending=ascending, inplace=True)
-            result[e.name] = df
+            if self.block != None:
+                df.attrs['block'] = self.block
+            if e.bypassPagination:
+                df.attrs['pageSize'] = e.pageSizer.size
+            result[e.key] = df
+            for c in e.nested:
+                cdf = self._process_datatypes(c, c.data, useBigDecimal)
+                if c.orderBy not in [None, 'id'] and len(cdf) > 0:
+                    # The items of each parent in the requested order, ties in id order.
+                    cdf = cdf.sort_values(['parent.id', c.orderBy, 'id'], ascending=[True, c.orderDirection == 'asc', True], kind='stable', ignore_index=True)
+                if self.block != None:
+                    cdf.attrs['block'] = self.block
+                result[f'{e.key}.{c.name}'] = cdf
             # print(f'~~~{e.name} {len(e.data)}~~~\n{df}\n~~~\n')
-        return result
\ No newline at end of file
+        return result
+
+    def beta_load_subgraph(self, progressCallback=None, useBigDecimal=False, batchPages=False, changedSince=None):
+        # print('?????beta_load_subgraph')
+        self._start_schema_load()
+        self._resolve_block()
+        self._prepare_changes(changedSince)
+        self._prepare_sync(useBigDecimal)
+        self._prepare_spill(useBigDecimal)
+        self._check_nested()
+        if batchPages:
+            # One stream for all entities, a round trip pages every entity which is not done yet.
+            self._load_entity_pages(self.entities, progressCallback)
+        else:
+            self._load_entity_streams(progressCallback)
+        self._load_nested_entities()
+        return self._build_result(useBigDecimal)
+
+    def _iter_entity_pages(self, entities, useBigDecimal=False, progressCallback=None):
+        has_more_page = True
+        initialPage = True
+        while has_more_page:
+            text = self._fetch_page(entities, initialPage)
+            if text == None:
+                return
+            has_more_page = self._process_page(entities, text, progressCallback)
+            initialPage = False
+            for e in entities:
+                if len(e.data) > 0:
+                    yield e.key, self._process_datatypes(e, e.data, useBigDecimal)
+                    e.data = []
+
+    def iter_pages(self, progressCallback=None, useBigDecimal=False):
+        # Pages are converted and handed out as they arrive, nothing is kept on the entities.
+        if any(len(e.nested) > 0 for e in self.entities):
+            raise ValueError('Nested `bypassPagination` fields are paginated after their parents, they are not supported page by page.')
+        self._start_schema_load()
+        self._resolve_block()
+        for e in self.entities:
+            if e.shards <= 1:
+                yield from self._iter_entity_pages([e], useBigDecimal, progressCallback)
+                continue
+            query = self._shard_bounds_query(e)
+            boundsData = None if query == None else self._load_subgraph_query(self.subgraphUrl, query)['data']
+            shards = [e.with_filters(f) for f in self._shard_filters(e, boundsData)]
+            report = self._shard_progress_callback(e, shards, progressCallback)
+            for shard in shards:
+                yield from self._iter_entity_pages([shard], useBigDecimal, report)
+
+    async def _load_schema_async(self, client):
+        text = await client.post(self.subgraphUrl, schema_utils.get_inspect_query())
+        return text['data']['__schema']['types']
+
+    async def _load_schema_index_async(self, client):
+        selections = [e.node for e in self.entities]
+        missing = find_missing_types(self.schema, selections)
+        if len(missing) == 0:
+            return self.schema
+        if self.targetedSchema:
+            index = SchemaIndex({} if self.schema == None else dict(self.schema.types), None if self.schema == None else self.schema.lists, None if self.schema == None else self.schema.nonNull)
+            while len(missing) > 0:
+                text = await client.post(self.subgraphUrl, schema_utils.get_type_inspect_query(missing))
+                index.add_types(missing, text['data'])
+                missing = find_missing_types(index, selections)
+        else:
+            index = SchemaIndex(await self._load_schema_async(client))
+        set_schema_index(self.subgraphUrl, index)
+        return index
+
+    async def _fetch_query_async(self, client, entities, build):
+        while True:
+            built = build()
+            if built == None:
+                return None
+            query, variables = built
+            start = time.monotonic()
+            try:
+                text = await client.post(self.subgraphUrl, query, variables)
+            except Exception as err:
+                if not self._shrink_page(entities, err):
+                    raise
+                continue
+            self._record_page_time(entities, time.monotonic() - start)
+            return text
+
+    async def _load_page_async(self, client, progressCallback=None, initialPage=False, entities=None):
+        text = await self._fetch_query_async(client, entities, lambda: self._build_page_query(entities, initialPage))
+        if text == None:
+            return False
+        return self._process_page(entities, text, progressCallback)
+
+    async def _load_nested_entity_async(self, client, entity:TheGraphEntity, child:TheGraphEntity):
+        field = self._nested_parent_field(entity, child)
+        child.use_cursor_types(self._cursor_types(child, False)[0])
+        state = self._start_nested(entity, child)
+
+        async def load(copy, batch):
+            text = await self._fetch_query_async(client, [copy], lambda: compose_query(*copy.build_nested_query(field, batch, entity.block)))
+            return batch, copy.pageSize, text
+
+        while len(state[2]) > 0:
+            pages = await asyncio.gather(*[load(copy, batch) for copy, batch in self._nested_batches(child, state[2])])
+            for batch, pageSize, text in pages:
+                self._process_nested_page(child, batch, pageSize, text, state)
+        self._finish_nested(child, state)
+
+    async def _load_entity_pages_async(self, client, entities, schemaTask, progressCallback=None):
+        has_more_page = await self._load_page_async(client, progressCallback, True, entities)
+        if has_more_page:
+            # The cursor variables of the next pages are typed from the schema.
+            self.schema = await schemaTask
+        while has_more_page:
+            has_more_page = await self._load_page_async(client, progressCallback, False, entities)
+
+    async def _load_sharded_entity_async(self, client, entity:TheGraphEntity, schemaTask, progressCallback=None):
+        self.schema = await schemaTask
+        query = self._shard_bounds_query(entity)
+        boundsData = None if query == None else (await client.post(self.subgraphUrl, query))['data']
+        shards = [entity.with_filters(f) for f in self._shard_filters(entity, boundsData)]
+        report = self._shard_progress_callback(entity, shards, progressCallback)
+        await asyncio.gather(*[self._load_entity_pages_async(client, [shard], schemaTask, report) for shard in shards])
+        for shard in shards:
+            entity.data.extend(shard.data)
+
+    async def beta_load_subgraph_async(self, client, progressCallback=None, useBigDecimal=False, batchPages=False):
+        schemaTask = asyncio.ensure_future(self._load_schema_index_async(client))
+        if self.block == 'latest':
+            text = await client.post(self.subgraphUrl, schema_utils.get_meta_block_query())
+            self._pin_block(text['data']['_meta']['block']['number'])
+        else:
+            self._resolve_block()
+        self._prepare_sync(useBigDecimal)
+        self._prepare_spill(useBigDecimal)
+        if any(len(e.nested) > 0 for e in self.entities):
+            self.schema = await schemaTask
+            self._check_nested()
+        if batchPages:
+            jobs = [self._load_entity_pages_async(client, self.entities, schemaTask, progressCallback)]
+        else:
+            jobs = [self._load_sharded_entity_async(client, e, schemaTask, progressCallback) for e in self.entities if e.shards > 1]
+            jobs += [self._load_entity_pages_async(client, [e], schemaTask, progressCallback) for e in self.entities if e.shards <= 1]
+        # Every stream runs to its end before the first error is raised.
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        for r in results:
+            if isinstance(r, BaseException):
+                raise r
+        self.schema = await schemaTask
+        await asyncio.gather(*[self._load_nested_entity_async(client, e, c) for e in self.entities for c in e.nested])
+        return self._build_result(useBigDecimal)
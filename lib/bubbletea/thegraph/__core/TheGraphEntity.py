@@ -1,73 +1,341 @@
 
 import numpy as np
-from . import schema_utils
-from graphql import parse, print_ast, ArgumentNode, NameNode, IntValueNode, FieldNode, SelectionSetNode, ObjectValueNode, StringValueNode, ObjectFieldNode, EnumValueNode
+from .PageSizer import PageSizer
+from .QueryTemplate import LruCache, QueryTemplate
+from graphql import print_ast, ArgumentNode, NameNode, IntValueNode, FieldNode, SelectionSetNode, ObjectValueNode, ObjectFieldNode, EnumValueNode, VariableNode
+
+# Nested `bypassPagination` fields come with this many items in the pages of their parent.
+NESTED_ITEMS_PER_PAGE = 100
+
+# What an entity derives from its node, filters and block, built once and shared by the entities made from them.
+COMPILED_ATTRIBUTES = ['node', 'bypassPagination', 'orderBy', 'orderDirection', 'shards', 'shardBy', 'syncBy', 'whereArg', 'block',
+                       'nestedNodes', 'fieldNode', 'arguments', 'selectionSet', 'templates', 'initialQuery', 'paginationQuery']
+
+_compiled = LruCache()
+
+def _filters_key(filters):
+    # Object values such as `_change_block: {number_gte: N}` have no `value`, they are keyed by their printed form.
+    return tuple([(f.name.value, type(f.value).__name__, print_ast(f.value)) for f in filters])
+
+def _variable(name):
+    # Printed as `$__name`, every request renames it with `QueryTemplate.render`.
+    return VariableNode(name=NameNode(value=f'__{name}'))
 
 class TheGraphEntity:
-    def __init__(self, node) -> None:
+    def __init__(self, node, extraFilters=None, block=None) -> None:
         self.limit = np.Infinity
         self.name = node.name.value
+        # The response key, the alias when the field has one.
+        self.key = self.name if node.alias == None else node.alias.value
+        self.node = node
         self.bypassPagination = False
         self.orderBy = None
-        
-        self.__build_pagination_query__(node)
+        self.orderDirection = 'asc'
+        self.shards = 1
+        self.shardBy = 'id'
+        self.syncBy = None
+        self.whereArg = None
+        self.extraFilters = extraFilters if extraFilters != None else []
+        self.block = block
+        self.nestedNodes = []
+        self.fieldNode = None
+        self.arguments = None
+        self.selectionSet = None
+        self.templates = None
+        self.paginationQuery = None
+
+        # Nodes come from `parse_query`, which keeps them alive, so their ids stay theirs while they are cached.
+        key = (id(node), _filters_key(self.extraFilters), block)
+        self.__dict__.update(_compiled.get(key, lambda: self.__compile__(node)))
+        self.nested = [TheGraphEntity(s) for s in self.nestedNodes]
+        self.nestedData = {}
+        self.typeName = None
         self.lastId = None
+        self.hasNextPage = False
+        # Cursor of `cursorField` pagination, the last value, the ids already read with it, and the id cursor within it.
+        # Ordered entities follow `orderBy` from their first page, before the schema tells whether it can be a cursor.
+        # The cursor is read from the items, an `orderBy` field they do not select can not be one.
+        self.cursorField = self.orderBy if self.bypassPagination and self.syncBy == None and self.orderBy not in [None, 'id'] and self.selects(self.orderBy) else None
+        self.cursor = None
+        self.seenIds = set()
+        self.tie = False
+        self.tieId = None
+        self.strict = False
+        self.firstIds = []
+        self.variableTypes = {'first': 'Int'}
         self.data = []
+        self.loaded = 0
+        self.converterPlan = None
+        self.pageSizer = PageSizer()
+        self.pageSize = None
+        self.spill = None
         pass
 
+    def __compile__(self, node):
+        self.__build_pagination_query__(self.__extract_nested__(node))
+        return {k: getattr(self, k) for k in COMPILED_ATTRIBUTES}
+
+    def with_filters(self, filters, shards=1):
+        # A copy of this entity restricted by the extra `where` filters, paginated on its own.
+        e = TheGraphEntity(self.node, self.extraFilters + filters, self.block)
+        e.shards = shards
+        self._share_state(e)
+        return e
+
+    def at_block(self, block):
+        # A copy of this entity pinned to the given block number.
+        e = TheGraphEntity(self.node, self.extraFilters, block)
+        e.shards = self.shards
+        self._share_state(e)
+        return e
+
+    def _share_state(self, e):
+        # Copies load into the same buffers and learn the same page sizes as the entity they were made from.
+        e.pageSizer = self.pageSizer
+        e.spill = self.spill
+        e.nestedData = self.nestedData
+        e.typeName = self.typeName
+        e.cursorField = self.cursorField
+        e.variableTypes = self.variableTypes
+        for c, o in zip(e.nested, self.nested):
+            c.pageSizer = o.pageSizer
+            c.typeName = o.typeName
+            c.variableTypes = o.variableTypes
+
+    def use_cursor_types(self, idType, orderType=None):
+        # The schema types of the cursor variables. With an `orderType` the pages follow `orderBy` instead of the ids.
+        cursorField = None if orderType == None or not self.selects(self.orderBy) else self.orderBy
+        if cursorField != self.cursorField and self.lastId != None:
+            # The first page followed `orderBy`, which can not be a cursor. The ids start over, the items read are skipped.
+            self.seenIds = set(self.firstIds)
+            self.lastId = None
+            self.cursor = None
+            self.tie = False
+            self.tieId = None
+            self.strict = False
+        self.variableTypes = {'first': 'Int', 'lastId': idType, 'cursor': orderType}
+        self.cursorField = cursorField
+
+    def selects(self, field):
+        # Whether the items carry `field` under its own name.
+        if self.selectionSet == None:
+            return False
+        return any(isinstance(s, FieldNode) and s.alias == None and s.name.value == field for s in self.selectionSet.selections)
+
+    def has_cursor_types(self):
+        return 'lastId' in self.variableTypes
+
+    def tracks_changes(self):
+        # Whole entity sets can be refreshed with the items changed since a block, top N lists and nested items can not.
+        return self.bypassPagination and self.syncBy == None and len(self.nested) == 0
+
+    def _block_argument(self):
+        value = ObjectValueNode(fields=[ObjectFieldNode(name=NameNode(value='number'), value=IntValueNode(value=str(self.block)))])
+        return ArgumentNode(name=NameNode(value='block'), value=value)
+
+    def __extract_nested__(self, node):
+        # Nested list fields with `bypassPagination` become entities of their own. The parent query asks for their
+        # first items ordered by id, the loader then pages through the rest per parent id.
+        if node.selection_set == None:
+            return node
+        selections = []
+        for s in node.selection_set.selections:
+            if getattr(s, 'selection_set', None) != None and 'bypassPagination' in [a.name.value for a in s.arguments]:
+                self.nestedNodes.append(s)
+                selections.append(TheGraphEntity(s).__page_node__(first=IntValueNode(value=str(NESTED_ITEMS_PER_PAGE))))
+            else:
+                selections.append(s)
+        if len(self.nestedNodes) == 0:
+            return node
+        if 'id' not in [getattr(s, 'name', None) and s.name.value for s in selections]:
+            selections.append(FieldNode(name=NameNode(value='id')))
+        return FieldNode(directives=node.directives, alias=node.alias, name=node.name, arguments=node.arguments, selection_set=SelectionSetNode(selections=selections))
+
+    def build_nested_query(self, field, batch, block=None):
+        # One aliased `<field>(id:)` lookup per `(parentId, lastId)` of `batch`, each asking for the next page of this entity.
+        # Returns the query and its variables as `compose_query` takes them.
+        self.pageSize = self.pageSizer.next_size()
+        blockArg = '' if block == None else f', block: {{number: {block}}}'
+        lookups = []
+        variables = {}
+        for i, (parentId, lastId) in enumerate(batch):
+            text, values = self.__render__((('id_gt', 'lastId'),), 'id', 'asc', f'p{i}_', {'first': self.pageSize, 'lastId': lastId})
+            lookups.append(f'p{i}: {field}(id: $p{i}_parent{blockArg}) {{ {text} }}')
+            variables[f'p{i}_parent'] = ('ID!', parentId)
+            variables.update(values)
+        return lookups, variables
+
     def __build_pagination_query__(self, node):
-        iArguments = []
-        pArguments = []
+        arguments = []
         whereArg = None
         for a in node.arguments:
             if(a.name.value == 'where'):
                 whereArg = a
-                iArguments.append(a)
             elif a.name.value == 'bypassPagination':
                 self.bypassPagination = bool(a.value.value)
             elif a.name.value == 'orderBy':
                 self.orderBy = a.value.value
             elif a.name.value == 'orderDirection':
                 self.orderDirection = a.value.value
+            elif a.name.value == 'shards':
+                self.shards = int(a.value.value)
+                self.bypassPagination = self.shards > 1 or self.bypassPagination
+            elif a.name.value == 'shardBy':
+                self.shardBy = a.value.value
+            elif a.name.value == 'syncBy':
+                self.syncBy = a.value.value
+                self.bypassPagination = True
             else:
-                iArguments.append(a)
-                pArguments.append(a)
+                arguments.append(a)
+
+        if len(self.extraFilters) > 0:
+            names = [f.name.value for f in self.extraFilters]
+            fields = [] if whereArg == None else [f for f in whereArg.value.fields if f.name.value not in names]
+            fields += self.extraFilters
+            whereArg = ArgumentNode(name=NameNode(value='where'), value=ObjectValueNode(fields=fields))
+        self.whereArg = whereArg
+
+        if self.block != None and 'block' not in [a.name.value for a in node.arguments]:
+            arguments.append(self._block_argument())
+        else:
+            self.block = None
+
         if not self.bypassPagination:
+            if self.block != None:
+                node = FieldNode(directives=node.directives, alias=node.alias, name=node.name, arguments=list(node.arguments) + [self._block_argument()], selection_set=node.selection_set)
             self.initialQuery = print_ast(node)
             return
 
-        if whereArg == None:
-            ast = parse("""{stuff(where:{id_gt:"__LASTID__"}){id}}""", no_location=True)
-            whereArg = ast.definitions[0].selection_set.selections[0].arguments[0]
+        selections = node.selection_set.selections.copy()
+        selections.append(FieldNode(name=NameNode(value='id')))
+        if self.syncBy != None and self.syncBy not in [f.name.value for f in selections]:
+            selections.append(FieldNode(name=NameNode(value=self.syncBy)))
+        # Pages following `orderBy` read their cursor from the items, a field of a child entity (`pool__name`) can not be selected.
+        if self.orderBy not in [None, 'id'] and '__' not in self.orderBy and not any(isinstance(f, FieldNode) and f.alias == None and f.name.value == self.orderBy for f in selections):
+            selections.append(FieldNode(name=NameNode(value=self.orderBy)))
+        self.fieldNode = node
+        self.arguments = arguments
+        self.selectionSet = SelectionSetNode(selections=selections)
+        # Templates of the page queries, built on first use per cursor filters and order.
+        self.templates = {}
+        self.initialQuery = self.__template__((), 'id', 'asc').text
+        self.paginationQuery = self.__template__((('id_gt', 'lastId'),), 'id', 'asc').text
+
+    def __page_node__(self, cursorFilters=(), orderBy='id', direction='asc', first=None):
+        # The cursor filters are `(filter, variable)` pairs, they replace a user filter of the same name.
+        # A user's `timestamp_gte` is below any `timestamp_gte` cursor, the results only ever hold matching items.
+        names = [f for f, v in cursorFilters]
+        fields = [] if self.whereArg == None else [f for f in self.whereArg.value.fields if f.name.value not in names]
+        fields += [ObjectFieldNode(name=NameNode(value=f), value=_variable(v)) for f, v in cursorFilters]
+        arguments = [] if len(fields) == 0 else [ArgumentNode(name=NameNode(value='where'), value=ObjectValueNode(fields=fields))]
+        arguments += self.arguments
+        arguments.append(ArgumentNode(name=NameNode(value='orderBy'), value=EnumValueNode(value=orderBy)))
+        arguments.append(ArgumentNode(name=NameNode(value='orderDirection'), value=EnumValueNode(value=direction)))
+        # The page size is a variable of every request, it adapts to the response times.
+        arguments.append(ArgumentNode(name=NameNode(value='first'), value=_variable('first') if first == None else first))
+        node = self.fieldNode
+        return FieldNode(directives=node.directives, alias=node.alias, name=node.name, arguments=arguments, selection_set=self.selectionSet)
+
+    def __template__(self, cursorFilters, orderBy, direction):
+        key = (cursorFilters, orderBy, direction)
+        template = self.templates.get(key)
+        if template == None:
+            template = self.templates.setdefault(key, QueryTemplate(print_ast(self.__page_node__(cursorFilters, orderBy, direction))))
+        return template
+
+    def __render__(self, cursorFilters, orderBy, direction, prefix, values):
+        template = self.__template__(cursorFilters, orderBy, direction)
+        return template.render(prefix), {prefix + n: (self.variableTypes[n], values[n]) for n in template.variables}
+
+    def __next_page__(self, initialPage):
+        # The cursor filters and order of the next page.
+        if self.cursorField == None:
+            if self.lastId == None:
+                return (), 'id', 'asc'
+            return (('id_gt', 'lastId'),), 'id', 'asc'
+        f = self.cursorField
+        if initialPage:
+            return (), f, self.orderDirection
+        if self.tie:
+            # A page full of one value, the items of that value are read by id.
+            return ((f, 'cursor'),) + (() if self.tieId == None else (('id_gt', 'lastId'),)), 'id', 'asc'
+        if self.orderDirection == 'desc':
+            op = '_lt' if self.strict else '_lte'
         else:
-            fields = whereArg.value.fields.copy()
-            fields.append(ObjectFieldNode(name=NameNode(value='id_gt'),value=StringValueNode(value='__LASTID__')))
-            whereArg = ArgumentNode(name=NameNode(value='where'), value=ObjectValueNode(fields=fields))
+            op = '_gt' if self.strict else '_gte'
+        return ((f + op, 'cursor'),), f, self.orderDirection
+
+    def build_query(self, initialPage=False):
+        # The query of the next page and its variables, `pageSize` keeps the size it asks for, a page shorter than it may end the pagination.
+        if not self.bypassPagination:
+            return self.initialQuery, {}
+        self.pageSize = self.pageSizer.next_size()
+        lastId = self.tieId if self.tie else self.lastId
+        values = {'first': self.pageSize, 'lastId': lastId, 'cursor': self.cursor}
+        return self.__render__(*self.__next_page__(initialPage), f'{self.key}_', values)
 
-        pArguments.append(whereArg)
-        if self.bypassPagination:
-            iArguments.append(ArgumentNode(name=NameNode(value='orderBy'), value=EnumValueNode(value='id')))
-            pArguments.append(ArgumentNode(name=NameNode(value='orderBy'), value=EnumValueNode(value='id')))
-            iArguments.append(ArgumentNode(name=NameNode(value='orderDirection'), value=EnumValueNode(value='asc')))
-            pArguments.append(ArgumentNode(name=NameNode(value='orderDirection'), value=EnumValueNode(value='asc')))
-        iArguments.append(ArgumentNode(name=NameNode(value='first'), value=IntValueNode(value=schema_utils.get_max_items_per_page())))
-        pArguments.append(ArgumentNode(name=NameNode(value='first'), value=IntValueNode(value=schema_utils.get_max_items_per_page())))
+    def advance(self, page):
+        # Moves the cursor past a page, returns the items not read before and whether another page follows.
+        items, self.hasNextPage = self.__advance__(page)
+        return items, self.hasNextPage
 
-        selections = node.selection_set.selections.copy()
-        selections.append(FieldNode(name=NameNode(value='id')))
-        selectionSet = SelectionSetNode(selections=selections)
-        
-        iNode = FieldNode(directives=node.directives, alias=node.alias, name=node.name, arguments=iArguments, selection_set=selectionSet)
-        pNode = FieldNode(directives=node.directives, alias=node.alias, name=node.name, arguments=pArguments, selection_set=selectionSet)
+    def __advance__(self, page):
+        self.pageSizer.accept(self.pageSize, len(page))
+        full = not self.pageSizer.is_last_page(self.pageSize, len(page))
+        # `_gte` pages and ids starting over ask again for items already read, those are dropped.
+        items = page if len(self.seenIds) == 0 else [i for i in page if i['id'] not in self.seenIds]
+        if self.cursorField == None:
+            self.lastId = None if len(page) == 0 else page[-1]['id']
+            return items, full
+        f = self.cursorField
+        if not self.has_cursor_types():
+            self.firstIds = [i['id'] for i in page]
+        if len(page) > 0:
+            self.lastId = page[-1]['id']
+        if self.tie:
+            if full:
+                self.tieId = self.lastId
+            else:
+                # Every item of the value is read, the next page starts after it.
+                self.tie = False
+                self.tieId = None
+                self.strict = True
+                self.seenIds = set()
+            return items, True
+        if not full:
+            return items, False
+        last = page[-1][f]
+        if last == self.cursor:
+            # The whole page has the last value, a next `_gte` page would be the same one.
+            self.seenIds.update(i['id'] for i in page)
+            self.tie = True
+            return items, True
+        self.cursor = last
+        self.strict = False
+        self.seenIds = {i['id'] for i in page if i[f] == last}
+        return items, True
 
-        # print(print_ast(iNode))
-        # print(print_ast(pNode))
-        self.initialQuery = print_ast(iNode)
-        self.paginationQuery = print_ast(pNode)
+    def build_bounds_query(self, field):
+        # Aliased `first:1` lookups of the lowest and highest `field` value matching the entity's filters.
+        queries = []
+        for alias, direction in [('lower', 'asc'), ('upper', 'desc')]:
+            arguments = [] if self.whereArg == None else [self.whereArg]
+            arguments.append(ArgumentNode(name=NameNode(value='orderBy'), value=EnumValueNode(value=field)))
+            arguments.append(ArgumentNode(name=NameNode(value='orderDirection'), value=EnumValueNode(value=direction)))
+            arguments.append(ArgumentNode(name=NameNode(value='first'), value=IntValueNode(value='1')))
+            if self.block != None:
+                arguments.append(self._block_argument())
+            selectionSet = SelectionSetNode(selections=[FieldNode(name=NameNode(value=field))])
+            queries.append(print_ast(FieldNode(alias=NameNode(value=alias), name=self.node.name, arguments=arguments, selection_set=selectionSet)))
+        return '{' + ' '.join(queries) + '}'
 
+    def where_filters(self):
+        if self.whereArg == None:
+            return {}
+        return {f.name.value: getattr(f.value, 'value', None) for f in self.whereArg.value.fields}
 
     def __str__(self):
-        keys = ['name', 'bypassPagination', 'initialQuery', 'paginationQuery', 'orderBy', 'orderDirection']
+        keys = ['name', 'bypassPagination', 'shards', 'shardBy', 'syncBy', 'initialQuery', 'paginationQuery', 'orderBy', 'orderDirection', 'cursorField']
         msg = ''
         for k in keys:
             if(hasattr(self, k)):
@@ -0,0 +1,71 @@
+import heapq
+import itertools
+import threading
+import concurrent.futures
+
+MAX_WORKERS = 16
+
+class WorkerPool:
+    def __init__(self, maxWorkers=MAX_WORKERS) -> None:
+        self.maxWorkers = maxWorkers
+        self.tasks = []
+        self.counter = itertools.count()
+        self.threads = []
+        self.idle = 0
+        self.cond = threading.Condition()
+        pass
+
+    def submit(self, fn, *args, priority=0):
+        # Queued tasks with a higher priority start first, equal priorities start in submit order.
+        future = concurrent.futures.Future()
+        with self.cond:
+            heapq.heappush(self.tasks, (-priority, next(self.counter), future, fn, args))
+            if len(self.tasks) > self.idle and len(self.threads) < self.maxWorkers:
+                # Threads are started on demand and then kept for the life of the process.
+                t = threading.Thread(target=self._work, name=f'bubbletea-worker-{len(self.threads)}', daemon=True)
+                self.threads.append(t)
+                t.start()
+            self.cond.notify()
+        return future
+
+    def set_max_workers(self, maxWorkers):
+        with self.cond:
+            self.maxWorkers = maxWorkers
+            self.cond.notify_all()
+
+    def _next_task(self):
+        with self.cond:
+            self.idle += 1
+            while len(self.tasks) == 0 and len(self.threads) <= self.maxWorkers:
+                self.cond.wait()
+            self.idle -= 1
+            if len(self.threads) > self.maxWorkers:
+                # The pool was made smaller, this thread ends.
+                self.threads.remove(threading.current_thread())
+                return None
+            return heapq.heappop(self.tasks)
+
+    def _work(self):
+        while True:
+            task = self._next_task()
+            if task == None:
+                return
+            _, _, future, fn, args = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args)
+            except BaseException as err:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+
+_pool = None
+_lock = threading.Lock()
+
+def get_worker_pool():
+    global _pool
+    with _lock:
+        if _pool == None:
+            _pool = WorkerPool()
+        return _pool
@@ -0,0 +1,64 @@
+# Entities are kept as one dict of column lists per page instead of one dict per item.
+# Nested objects are flattened to `parent.child` columns, lists are kept as they are, like `pd.json_normalize`.
+
+
+def _get_path(item, keys):
+    for k in keys:
+        if item == None:
+            return None
+        item = item.get(k)
+    return item
+
+def _collect_paths(items, prefix, paths):
+    # Every item of a GraphQL selection has the same keys, only nested objects can be null.
+    # Nested columns follow the plain ones, in the same order `pd.json_normalize` gives them.
+    nested = []
+    for k, v in items[0].items():
+        keys = prefix + (k,)
+        if v == None:
+            v = next((i[k] for i in items if i[k] != None), None)
+        if isinstance(v, dict):
+            nested.append(keys)
+        else:
+            paths.append(keys)
+    for keys in nested:
+        _collect_paths([i[keys[-1]] for i in items if i[keys[-1]] != None], keys, paths)
+
+def page_to_columns(items):
+    if len(items) == 0:
+        return {}
+    paths = []
+    _collect_paths(items, (), paths)
+    columns = {}
+    for keys in paths:
+        if len(keys) == 1:
+            k = keys[0]
+            columns[k] = [i[k] for i in items]
+        else:
+            columns['.'.join(keys)] = [_get_path(i, keys) for i in items]
+    return columns
+
+def concat_pages(pages):
+    names = {}
+    for p in pages:
+        for c in p.keys():
+            names[c] = None
+    columns = {}
+    for c in names.keys():
+        values = []
+        for p in pages:
+            if c in p:
+                values.extend(p[c])
+            elif len(p) > 0:
+                values.extend([None] * len(next(iter(p.values()))))
+        columns[c] = values
+    return columns
+
+def column_values(pages, name):
+    values = []
+    for p in pages:
+        values.extend(p.get(name, []))
+    return values
+
+def count_rows(pages):
+    return sum(len(next(iter(p.values()))) for p in pages if len(p) > 0)
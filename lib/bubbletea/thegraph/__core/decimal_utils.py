@@ -0,0 +1,50 @@
+import pandas as pd
+from decimal import Decimal
+
+
+ARROW = 'arrow'
+DECIMAL128_MAX_PRECISION = 38
+DECIMAL256_MAX_PRECISION = 76
+
+def to_decimal(col:pd.Series):
+    return pd.Series([Decimal(x) for x in col.values], index=col.index, dtype=object)
+
+def is_arrow_decimal(col:pd.Series):
+    dtype = col.dtype
+    if not hasattr(pd, 'ArrowDtype') or not isinstance(dtype, pd.ArrowDtype):
+        return False
+    import pyarrow as pa
+    return pa.types.is_decimal(dtype.pyarrow_dtype)
+
+def _precision_and_scale(col:pd.Series):
+    # The Graph sends BigDecimal/BigInt as plain strings, the widest one decides the decimal type.
+    strs = col.str
+    length = strs.len()
+    dot = strs.find('.')
+    scale = (length - dot - 1).where(dot >= 0, 0).max()
+    digits = dot.where(dot >= 0, length) - strs.startswith('-').astype('float64')
+    scale = 0 if pd.isna(scale) else int(scale)
+    digits = 0 if pd.isna(digits.max()) else int(digits.max())
+    return max(digits + scale, 1), scale
+
+def to_arrow_decimal(col:pd.Series):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError('useBigDecimal=\'arrow\' requires `pyarrow`. Install it with `pip install pyarrow`.')
+    if not hasattr(pd, 'ArrowDtype'):
+        raise ValueError('useBigDecimal=\'arrow\' requires pandas 1.5 or newer.')
+
+    precision, scale = _precision_and_scale(col)
+    if precision <= DECIMAL128_MAX_PRECISION:
+        t = pa.decimal128(precision, scale)
+    elif precision <= DECIMAL256_MAX_PRECISION:
+        t = pa.decimal256(precision, scale)
+    else:
+        return to_decimal(col)
+    try:
+        arr = pa.array(col.values, type=pa.string(), from_pandas=True).cast(t)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # Exponent notation and other unusual formats go through Python's Decimal instead.
+        return to_decimal(col)
+    return pd.Series(pd.arrays.ArrowExtensionArray(arr), index=col.index)
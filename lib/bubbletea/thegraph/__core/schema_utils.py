@@ -1,17 +1,32 @@
 
 import json
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
 
 REGEX_TIMESTAMP = r'^1[5-9]\d\d\d\d\d\d\d\d$'
+TIMESTAMP_MIN = 1500000000
+TIMESTAMP_MAX = 1800000000
+# Upper bound of `REGEX_TIMESTAMP` for timestamps sent as strings.
+TIMESTAMP_STR_MAX = 1999999999
 ITEMS_PER_PAGE = 1000
+# Seconds to wait for a response, a page that takes longer is asked again with a smaller size.
+REQUEST_TIMEOUT = 120
 
 def get_max_items_per_page():
   return ITEMS_PER_PAGE
 
 def process_response_to_json(response):
-    if response.status_code != 200:
-        raise ValueError(f'The Graph Connection Error: {response.status_code}')
-    text = json.loads(response.text)
+    # The raw bytes are parsed directly, `response.text` would decode (and guess the charset of) the whole body first.
+    return process_body_to_json(response.status_code, response.content)
+
+def process_body_to_json(status_code, body):
+    if status_code != 200:
+        raise ValueError(f'The Graph Connection Error: {status_code}')
+    text = _loads(body)
     if 'errors' in text:
         errors = text['errors']
         raise ValueError(f'The Graph Error: {errors}')
@@ -44,6 +59,35 @@ def _find_field_type(fieldName, entity):
               return 
     return None
 
+def get_field_types(entity):
+    # Maps every field name of an introspected type to its resolved type name.
+    fieldTypes = {}
+    for f in entity.get('fields') or []:
+        t = f['type']
+        if t == None:
+            fieldTypes[f['name']] = None
+        elif t['name'] != None:
+            fieldTypes[f['name']] = t['name']
+        else:
+            fieldTypes[f['name']] = _ultimate_ofType(t)
+    return fieldTypes
+
+def get_list_fields(entity):
+    # The names of the fields of an introspected type which return a list.
+    fields = []
+    for f in entity.get('fields') or []:
+        t = f['type']
+        while t != None:
+            if t.get('kind') == 'LIST':
+                fields.append(f['name'])
+                break
+            t = t.get('ofType')
+    return fields
+
+def get_non_null_fields(entity):
+    # The names of the fields of an introspected type which are never null.
+    return [f['name'] for f in entity.get('fields') or [] if f['type'] != None and f['type'].get('kind') == 'NON_NULL']
+
 def find_column_type(entityPath, types):
     segs = entityPath.split('.')
     while len(segs) >= 2:
@@ -61,6 +105,16 @@ def find_column_type(entityPath, types):
         return find_column_type('.'.join(segs), types)
     return 
     
+def get_meta_block_query():
+    return "{_meta{block{number}}}"
+
+def get_meta_blocks_query(numbers):
+    # The number and timestamp of the head block, or of the given blocks as aliased `m<i>` lookups.
+    if len(numbers) == 0:
+        return "{_meta{block{number timestamp}}}"
+    lookups = ' '.join([f'm{i}: _meta(block: {{number: {n}}}) {{ block {{ number timestamp }} }}' for i, n in enumerate(numbers)])
+    return '{' + lookups + '}'
+
 def get_inspect_query():
     return """ 
      {
@@ -70,6 +124,15 @@ def get_inspect_query():
       }
     }
   }
+""" + _get_type_fragments()
+
+def get_type_inspect_query(names):
+    # One aliased `__type` lookup per name, the response holds them as `t0`, `t1`, ...
+    lookups = ' '.join([f't{i}: __type(name: "{n}") {{ ...FullType }}' for i, n in enumerate(names)])
+    return '{' + lookups + '}' + _get_type_fragments()
+
+def _get_type_fragments():
+    return """
     fragment FullType on __Type {
       name
       fields(includeDeprecated: true) {
@@ -80,20 +143,28 @@ def get_inspect_query():
       }
     }
     fragment TypeRef on __Type {
+      kind
       name
       ofType {
+        kind
         name
         ofType {
+          kind
           name
           ofType {
+            kind
             name
             ofType {
+              kind
               name
               ofType {
+                kind
                 name
                 ofType {
+                  kind
                   name
                   ofType {
+                    kind
                     name
                   }
                 }
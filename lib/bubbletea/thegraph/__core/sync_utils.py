@@ -0,0 +1,39 @@
+import os
+import hashlib
+import pandas as pd
+from . import columnar
+
+
+SYNC_DIR = os.path.join('.bubbletea', 'sync')
+
+def get_state_key(url, entity, useBigDecimal):
+    # The original node carries the user's filters, a change of filters starts a new state.
+    text = f'{url}\n{entity.initialQuery}\n{useBigDecimal}'
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def _state_path(syncDir, key):
+    return os.path.join(syncDir, f'{key}.pkl')
+
+def load_state(syncDir, key):
+    path = _state_path(syncDir, key)
+    if not os.path.exists(path):
+        return None
+    return pd.read_pickle(path)
+
+def save_state(syncDir, key, cursor, df):
+    os.makedirs(syncDir, exist_ok=True)
+    path = _state_path(syncDir, key)
+    tmp = f'{path}.tmp'
+    pd.to_pickle({'cursor': cursor, 'df': df}, tmp)
+    os.replace(tmp, path)
+
+def find_cursor(data, field, cursor=None):
+    values = columnar.column_values(data, field)
+    if len(values) == 0:
+        return cursor
+    if cursor != None:
+        values.append(cursor)
+    if field == 'id':
+        return max(values)
+    # BigInt values arrive as strings, compare them as numbers but keep the original representation.
+    return max(values, key=lambda v: int(v))
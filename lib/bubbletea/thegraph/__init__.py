@@ -1,14 +1,35 @@
-from .__core.SubgraphLoader import SubgraphLoader
+from .__core.SubgraphLoader import SubgraphLoader, can_batch_pages
+from .__core.QueryTemplate import LruCache, merge_queries, split_batch_key
+from .__core.LiveSubgraph import LiveSubgraph
+from .__core.SnapshotLoader import SnapshotLoader, SNAPSHOTS_PER_REQUEST, SNAPSHOT_CONCURRENCY
+from .__core.AsyncGraphClient import AsyncGraphClient
+from .__core.DiskCache import DiskCache
+from .__core.RangeCache import RangeCache
+from .__core.SingleFlight import SingleFlight, get_flight_key
+from .__core.WorkerPool import get_worker_pool
+from ..http_client import set_pool_size
 import streamlit as st
 import concurrent.futures
+import asyncio
+import queue
 
 class SubgraphDef:
-    def __init__(self, url:str, query:str, progressCallback=None, useBigDecimal=False) -> None:
+    def __init__(self, url:str, query:str, progressCallback=None, useBigDecimal=False, diskCache:DiskCache=None) -> None:
         self.url = url
         self.query = query
         self.progressCallback = progressCallback
         self.useBigDecimal = useBigDecimal
+        self.diskCache = diskCache
 
+_flights = SingleFlight()
+# Definitions against one endpoint loaded together, their entities page in shared requests.
+MAX_BATCH_DEFINITIONS = 8
+# Live queries whose frames are kept in memory, the least recently refreshed are dropped first.
+MAX_LIVE_SUBGRAPHS = 16
+_live = LruCache(MAX_LIVE_SUBGRAPHS)
+
+def _get_flight_key(url, query, useBigDecimal, syncDir, diskCache, block, targetedSchema, memoryBudget, rangeCache=None):
+    return get_flight_key(url, query, useBigDecimal, syncDir, None if diskCache == None else diskCache.cacheDir, block, targetedSchema, memoryBudget, None if rangeCache == None else id(rangeCache))
 
 
 """
@@ -18,8 +39,23 @@ Params:
 `query`: The graph query. [Docs](https://thegraph.com/docs/graphql-api#queries)
     `bypassPagination`: Boolean value, default `False`. The graph has a limitation of 10000 items max per request. To load all items in the selected query, add this flag in the filter of each entity. For example: `deposits(bypassPagination, ....) {...}`.
     If `False`, the function will retrieve 100 items.
+    Paginated entities adapt their page size to the endpoint: pages start at 1000 items and grow while responses are fast, past 1000 only once the endpoint has answered a full page of it, and shrink on timeouts or server errors, failed pages are retried from the same cursor. The size reached is recorded in `df.attrs['pageSize']` and the next load of the entity starts from it.
+    `orderBy` of a `bypassPagination` entity is kept in the pages when it is a non null scalar field: the pages continue from the last `orderBy` value and id, so the DataFrame arrives sorted. Other orders page by id and the DataFrame is sorted once loaded. The `orderBy` field is added to the items when the query does not select it.
+    `shards`: Int, default `1`. Split the entity into N disjoint ranges which are paginated in parallel and merged afterwards. Implies `bypassPagination`. For example: `transfers(shards: 8, ....) {...}`.
+    `shardBy`: The field to split on, default `id`. Use a numeric field such as `timestamp` or `blockNumber` when the ids are not evenly distributed hex strings. For example: `transfers(shards: 8, shardBy: timestamp, ....) {...}`.
+    `syncBy`: The field to sync an entity incrementally on, for example `timestamp` or `blockNumber`. Implies `bypassPagination`. The loaded DataFrame and the highest `syncBy` value are saved under `syncDir`, the next load only fetches entities from that cursor on and appends them. For example: `deposits(syncBy: timestamp, ....) {...}`.
+    `bypassPagination` on a nested list field loads all of its items, not only the first 100. The items of many parents are paged together in batched requests and returned as a DataFrame of their own under `<Entity_name>.<field>`, linked to the parent by a `parent.id` column. The items are paged by id, an `orderBy` of the nested field sorts the items of each parent once loaded, with `id` as tiebreaker, and needs the field selected. For example: `pools { name swaps(bypassPagination: true) {...} }` returns `pools` and `pools.swaps`. Only for list fields of root entities, not supported by `beta_iter_subgraph_pages`.
 `progressCallback`: A callback function that is called when items are retreived from the graph. The argument is defined as `({<Entity_name>: <Number_of_items_loaded>})`
-`useBigDecimal`: bool. Default `Faulse`. When True, `BigDecimal`, `BigInt` types from the graph will be converted to Decimal 128 type numbers so to keep the precision of the numbers. Otherwise, converted to float64. Recommend to set to `True` if to display the numbers.
+    Each root entity of the query paginates concurrently on its own stream, small entities are not held up by large ones. The callback is always called on the calling thread.
+`useBigDecimal`: bool or `'arrow'`. Default `Faulse`. When True, `BigDecimal`, `BigInt` types from the graph will be converted to Decimal 128 type numbers so to keep the precision of the numbers. Otherwise, converted to float64. Recommend to set to `True` if to display the numbers.
+    When `'arrow'`, they are parsed in native code into Arrow `decimal128`/`decimal256` columns (requires `pyarrow` and pandas 1.5+), which keep the precision and aggregate without Python objects.
+`syncDir`: The directory where `syncBy` entities are saved. Default `.bubbletea/sync`.
+`diskCache`: A `DiskCache` to serve results from local disk across restarts and processes, for example `DiskCache('.bubbletea/cache', maxBytes=1024 ** 3, ttl=3600)`. Entities are stored as Parquet files, the least recently used entries are evicted once `maxBytes` is exceeded and entries older than `ttl` seconds are reloaded. Default `None`.
+`block`: Pin every request of the load to one block. `'latest'` resolves the current `_meta { block { number } }` once, an int pins to that block number. The number is recorded in `df.attrs['block']` of each DataFrame. Results pinned to a block number never expire from `diskCache`. Default `None`.
+`targetedSchema`: bool. Default `False`. When True, only the types the query touches are introspected with batched `__type(name:)` lookups instead of downloading the full schema.
+`memoryBudget`: Int, bytes. Default `None`. When set, pages are converted to typed Arrow batches as they arrive and each entity keeps at most `memoryBudget` bytes of them in memory, the rest is spilled to temporary Arrow files which are memory mapped to build the final DataFrame (requires `pyarrow`). List fields then come back as arrays.
+`rangeCache`: A `RangeCache` to reuse the rows of overlapping windows, for example `RangeCache(maxBytes=512 * 1024 ** 2, ttl=3600)`. `bypassPagination` entities whose `where` has an integer lower and upper bound on one field, such as `timestamp_gte` and `timestamp_lt` from a date picker, keep the intervals they have loaded. A later window is served from the cached intervals and only its uncovered gaps are loaded, so sliding or widening a window only loads the difference. The least recently used entities are dropped once `maxBytes` is exceeded and intervals older than `ttl` seconds are loaded again, set a `ttl` when windows reach the head of the subgraph. Default `None`.
+Concurrent calls with the same url, query and options, for example from several sessions opening the same dashboard, share one load: later callers wait for it, get its progress and a copy of its DataFrames.
 Return:
 ```
 {
@@ -31,16 +67,92 @@ Return:
 ```
 
 """
-def beta_load_subgraph(url:str, query:str, progressCallback=None, useBigDecimal=False):
-    sl = SubgraphLoader(url, query)
-    return sl.beta_load_subgraph(progressCallback, useBigDecimal)
+def beta_load_subgraph(url:str, query:str, progressCallback=None, useBigDecimal=False, syncDir=None, diskCache:DiskCache=None, block=None, targetedSchema=False, memoryBudget:int=None, rangeCache:RangeCache=None):
+    # Identical loads in flight, e.g. from several sessions opening the same dashboard, share one pagination.
+    key = _get_flight_key(url, query, useBigDecimal, syncDir, diskCache, block, targetedSchema, memoryBudget, rangeCache)
+    load = lambda report: _load_subgraph(url, query, report, useBigDecimal, syncDir, diskCache, block, targetedSchema, memoryBudget, rangeCache)
+    return _flights.do(key, load, progressCallback)
+
+def _load_subgraph(url, query, progressCallback, useBigDecimal, syncDir, diskCache, block, targetedSchema, memoryBudget, rangeCache=None):
+    if diskCache != None:
+        key = diskCache.get_key(url, query, block, useBigDecimal)
+        result = diskCache.get(key)
+        if result != None:
+            return result
+    if rangeCache != None:
+        plan = rangeCache.plan(url, query, block, useBigDecimal)
+        result = {}
+        if plan.query != None:
+            sl = SubgraphLoader(url, plan.query, syncDir=syncDir, block=block, targetedSchema=targetedSchema, memoryBudget=memoryBudget)
+            result = sl.beta_load_subgraph(plan.report(progressCallback), useBigDecimal)
+        result = plan.finish(result)
+    else:
+        sl = SubgraphLoader(url, query, syncDir=syncDir, block=block, targetedSchema=targetedSchema, memoryBudget=memoryBudget)
+        result = sl.beta_load_subgraph(progressCallback, useBigDecimal)
+    if diskCache != None:
+        diskCache.set(key, result, isinstance(block, int))
+    return result
+
+def _batch_defs(defs):
+    # Lists of definitions to load together, definitions that can not share requests are lists of their own.
+    batches = []
+    filling = {}
+    for d in defs:
+        if d.diskCache != None or not can_batch_pages(d.query):
+            batches.append([d])
+            continue
+        key = (d.url, d.useBigDecimal)
+        batch = filling.get(key)
+        if batch == None or len(batch) >= MAX_BATCH_DEFINITIONS:
+            batch = []
+            filling[key] = batch
+            batches.append(batch)
+        batch.append(d)
+    return batches
+
+def _batch_progress_callback(defs):
+    # Progress of the merged entities, handed to the callback of their definition under their own names.
+    if all(d.progressCallback == None for d in defs):
+        return None
+    def report(progress):
+        for key, loaded in progress.items():
+            i, name = split_batch_key(key)
+            if defs[i].progressCallback != None:
+                defs[i].progressCallback({name: loaded})
+    return report
+
+def _split_batch_result(defs, result):
+    results = [{} for d in defs]
+    for key, df in result.items():
+        i, name = split_batch_key(key)
+        results[i][name] = df
+    return results
+
+def _collect_results(defs, loaded):
+    # Definitions of one url return their entities together, in the order of `defs` whichever finished first.
+    results = {}
+    for d in defs:
+        if id(d) in loaded:
+            results.setdefault(d.url, {}).update(loaded[id(d)])
+    return results
+
+def _load_subgraph_batch(defs):
+    sl = SubgraphLoader(defs[0].url, merge_queries([d.query for d in defs]))
+    result = sl.beta_load_subgraph(_batch_progress_callback(defs), defs[0].useBigDecimal, batchPages=True)
+    return _split_batch_result(defs, result)
 
 """
 Fetch data from multiple subgraphs .
 Params:
+`defs`: List of `SubgraphDef`.
 `url`: The url of the subgraph. [Explore subgraphs](https://thegraph.com/explorer/)
 `query`: The graph query. [Docs](https://thegraph.com/docs/graphql-api#queries)
     `bypassPagination`: Boolean value, default `False`. The graph has a limitation of 10000 items max per request. If to load all items in the selected query, add this flag in the filter of each entity. For example: `deposits(bypassPagination, ....) {...}`.
+`maxConcurrency`: Int, default `None`. The max number of subgraphs of this call loading at once. Loads run on a worker pool shared by the whole process, which bounds the total, see `beta_set_worker_pool_size`.
+`priority`: Int, default `0`. Loads waiting for a worker start in order of priority, give the loads a user is waiting on a higher priority than prefetching.
+`resultCallback`: A callback function called with `(<url>, {<Entity_name>: <DataFrame>})` as soon as each subgraph has loaded, so the first finished one can render first. Progress and results are handed to the callbacks on the calling thread.
+Definitions with the same `url` and `useBigDecimal`, no `diskCache` and no `shards`, `syncBy` or nested `bypassPagination` fields are merged into one query, up to 8 at a time. Their root fields are aliased per definition and each request pages every entity of the merged definitions, so the round trips go down by the number of merged definitions. If a merged load fails, its definitions are loaded one by one, an error only affects its own definition.
+Definitions with the same `url` return their entities together under it, an entity named like one of an earlier definition replaces it.
 Return:
 ```
 {
@@ -52,17 +164,200 @@ Return:
     }
 }
 """
-def beta_load_subgraphs(defs:list[SubgraphDef]):
-    results = {}
+def beta_load_subgraphs(defs:list[SubgraphDef], maxConcurrency=None, priority=0, resultCallback=None):
+    loaded = {}
+    progress = queue.Queue()
+
+    def queued(d:SubgraphDef):
+        return None if d.progressCallback == None else (lambda p: progress.put((d.progressCallback, p)))
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(defs)) as executor:
-        future_to_url = {executor.submit(beta_load_subgraph, d.url, d.query, d.progressCallback, d.useBigDecimal): d for d in defs}
-        
-        for future in concurrent.futures.as_completed(future_to_url):
-            d = future_to_url[future]
+    def load(batch):
+        if len(batch) == 1:
+            d = batch[0]
+            return [beta_load_subgraph(d.url, d.query, queued(d), d.useBigDecimal, None, d.diskCache)]
+        return _load_subgraph_batch([SubgraphDef(d.url, d.query, queued(d), d.useBigDecimal) for d in batch])
+
+    def report_progress():
+        while not progress.empty():
+            callback, p = progress.get()
+            callback(p)
+
+    pool = get_worker_pool()
+    pending = _batch_defs(defs)
+    running = {}
+    limit = len(pending) if maxConcurrency == None else max(1, maxConcurrency)
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < limit:
+            batch = pending.pop(0)
+            running[pool.submit(load, batch, priority=priority)] = batch
+        done, _ = concurrent.futures.wait(running.keys(), timeout=0.1, return_when=concurrent.futures.FIRST_COMPLETED)
+        report_progress()
+        for future in done:
+            batch = running.pop(future)
             try:
                 data = future.result()
-                results[d.url] = data
             except Exception as e:
-                st.exception(e)
-    return results
+                if len(batch) > 1:
+                    pending = [[d] for d in batch] + pending
+                else:
+                    st.exception(e)
+                continue
+            for d, r in zip(batch, data):
+                loaded[id(d)] = r
+                if resultCallback != None:
+                    resultCallback(d.url, r)
+    return _collect_results(defs, loaded)
+
+"""
+Set the number of threads of the worker pool `beta_load_subgraphs` runs on, shared by every call in the process.
+Params:
+`maxWorkers`: Int, default `16`.
+"""
+def beta_set_worker_pool_size(maxWorkers:int):
+    get_worker_pool().set_max_workers(maxWorkers)
+
+"""
+Set the number of idle connections the HTTP client shared by every synchronous load keeps per host. Set it to the number of requests in flight, for example when `beta_set_worker_pool_size` or `maxConcurrency` go up.
+Params:
+`poolSize`: Int, default `32`.
+"""
+def beta_set_pool_size(poolSize:int):
+    set_pool_size(poolSize)
+
+
+"""
+Fetch data from a single subgraph page by page. Each page is converted to a typed DataFrame as soon as it arrives, so the full result is never held in memory.
+Params:
+Same as `beta_load_subgraph`.
+Return:
+A generator of `(<Entity_name>, <DataFrame_of_one_page>)` tuples. Pages come in load order, which follows `orderBy` of `bypassPagination` entities when it is a non null scalar field.
+```
+for name, df in beta_iter_subgraph_pages(url, query):
+    ...
+```
+"""
+def beta_iter_subgraph_pages(url:str, query:str, progressCallback=None, useBigDecimal=False, block=None, targetedSchema=False):
+    sl = SubgraphLoader(url, query, block=block, targetedSchema=targetedSchema)
+    return sl.iter_pages(progressCallback, useBigDecimal)
+
+"""
+Fetch snapshots of a query at many blocks, for example balances or TVL over time. Many blocks are asked for in one request as aliased fields pinned to their block, and the requests run concurrently.
+Params:
+`url`: The url of the subgraph. [Explore subgraphs](https://thegraph.com/explorer/)
+`query`: The graph query. Each entity is loaded with one request per block, as without `bypassPagination`, so `bypassPagination`, `shards`, `syncBy` and nested `bypassPagination` fields are not supported. A `block` argument of the query is replaced by the snapshot block.
+`blocks`: List of block numbers.
+`timestamps`: List of unix timestamps, `datetime`s or `pd.Timestamp`s, instead of `blocks`. Each is resolved to the last block at or before it with batched lookups of the subgraph's `_meta`.
+`progressCallback`: A callback function called with `({<Entity_name>: <Number_of_items_loaded>})` on the calling thread.
+`useBigDecimal`: Same as `beta_load_subgraph`.
+`batchSize`: Int, default `50`. The number of blocks asked for in one request.
+`maxConcurrency`: Int, default `4`. The number of requests in flight.
+Return:
+```
+{
+    <Entity_name>: <DataFrame_of_the_items_of_every_snapshot_indexed_by_block>
+}
+```
+With `timestamps`, a `snapshot` column holds the requested time of each row, and timestamps resolving to the same block repeat its rows.
+"""
+def beta_load_subgraph_snapshots(url:str, query:str, blocks:list=None, timestamps:list=None, progressCallback=None, useBigDecimal=False, batchSize:int=SNAPSHOTS_PER_REQUEST, maxConcurrency:int=SNAPSHOT_CONCURRENCY):
+    sl = SnapshotLoader(url, query, batchSize, maxConcurrency)
+    return sl.load_snapshots(blocks, timestamps, progressCallback, useBigDecimal)
+
+"""
+Keep the result of a query up to date, for dashboards refreshing on a timer. The frames are kept in memory per url and query, each call first asks the subgraph for `_meta { block { number } }` and returns them as they are, without any data request, when no new block was indexed.
+Otherwise only the `bypassPagination` entities changed since the last block are loaded, with a `_change_block: {number_gte: <last block + 1>}` filter, and merged into the frames by `id`: changed rows are replaced, new rows are added, rows changed so they no longer match `where` are removed, and the order of `orderBy` is kept. Entities with a `where` filter take one more request per new block for the ids changed without the filter. Entities without `bypassPagination` and entities with nested `bypassPagination` fields are loaded again in full. Every request is pinned to the new block, which is recorded in `df.attrs['block']`.
+Entities removed from the subgraph stay in the frames. On endpoints without `_change_block` filters, entities are loaded in full whenever a new block was indexed.
+Params:
+`url`: The url of the subgraph. [Explore subgraphs](https://thegraph.com/explorer/)
+`query`: The graph query, same as `beta_load_subgraph`. `syncBy` is not supported.
+`progressCallback`: A callback function called with `({<Entity_name>: <Number_of_items_loaded>})` while a new block loads.
+`useBigDecimal`: Same as `beta_load_subgraph`.
+`targetedSchema`: Same as `beta_load_subgraph`.
+Return:
+```
+{
+    <Entity_name>: <DataFrame_of_items_from_the_graph>
+}
+```
+"""
+def beta_load_subgraph_live(url:str, query:str, progressCallback=None, useBigDecimal=False, targetedSchema=False):
+    key = get_flight_key(url, query, useBigDecimal, targetedSchema)
+    live = _live.get(key, lambda: LiveSubgraph(url, query, useBigDecimal, targetedSchema))
+    result = live.refresh(progressCallback)
+    # Callers get their own frames over the kept columns, the next refresh builds new frames.
+    return {k: v.copy(deep=False) for k, v in result.items()}
+
+"""
+Async counterpart of `beta_load_subgraph`, built on a non-blocking HTTP client (requires `aiohttp`).
+Params:
+Same as `beta_load_subgraph`, plus
+`client`: An `AsyncGraphClient` to share between loads. If `None`, a client is created for this call.
+`maxConcurrency`: Int, default `32`. The max number of page requests in flight when no `client` is given.
+Return:
+Same as `beta_load_subgraph`.
+"""
+async def beta_load_subgraph_async(url:str, query:str, progressCallback=None, useBigDecimal=False, client:AsyncGraphClient=None, maxConcurrency=32, diskCache:DiskCache=None, block=None, targetedSchema=False, memoryBudget:int=None, rangeCache:RangeCache=None):
+    if client == None:
+        async with AsyncGraphClient(maxConcurrency) as client:
+            return await beta_load_subgraph_async(url, query, progressCallback, useBigDecimal, client, diskCache=diskCache, block=block, targetedSchema=targetedSchema, memoryBudget=memoryBudget, rangeCache=rangeCache)
+    key = _get_flight_key(url, query, useBigDecimal, None, diskCache, block, targetedSchema, memoryBudget, rangeCache)
+    load = lambda report: _load_subgraph_async(client, url, query, report, useBigDecimal, diskCache, block, targetedSchema, memoryBudget, rangeCache)
+    return await _flights.do_async(key, load, progressCallback)
+
+async def _load_subgraph_async(client, url, query, progressCallback, useBigDecimal, diskCache, block, targetedSchema, memoryBudget, rangeCache=None):
+    if diskCache != None:
+        key = diskCache.get_key(url, query, block, useBigDecimal)
+        result = diskCache.get(key)
+        if result != None:
+            return result
+    if rangeCache != None:
+        plan = rangeCache.plan(url, query, block, useBigDecimal)
+        result = {}
+        if plan.query != None:
+            sl = SubgraphLoader(url, plan.query, block=block, targetedSchema=targetedSchema, memoryBudget=memoryBudget)
+            result = await sl.beta_load_subgraph_async(client, plan.report(progressCallback), useBigDecimal)
+        result = plan.finish(result)
+    else:
+        sl = SubgraphLoader(url, query, block=block, targetedSchema=targetedSchema, memoryBudget=memoryBudget)
+        result = await sl.beta_load_subgraph_async(client, progressCallback, useBigDecimal)
+    if diskCache != None:
+        diskCache.set(key, result, isinstance(block, int))
+    return result
+
+async def _load_subgraph_batch_async(client, defs):
+    # The result of every definition of the batch, or the error it failed with.
+    if len(defs) == 1:
+        d = defs[0]
+        try:
+            return [await beta_load_subgraph_async(d.url, d.query, d.progressCallback, d.useBigDecimal, client, diskCache=d.diskCache)]
+        except Exception as e:
+            return [e]
+    sl = SubgraphLoader(defs[0].url, merge_queries([d.query for d in defs]))
+    try:
+        result = await sl.beta_load_subgraph_async(client, _batch_progress_callback(defs), defs[0].useBigDecimal, batchPages=True)
+    except Exception:
+        # The definitions are loaded one by one, an error only affects its own definition.
+        loaded = await asyncio.gather(*[_load_subgraph_batch_async(client, [d]) for d in defs])
+        return [r[0] for r in loaded]
+    return _split_batch_result(defs, result)
+
+"""
+Async counterpart of `beta_load_subgraphs`. All subgraphs are loaded on one event loop and share one client.
+Params:
+`defs`: List of `SubgraphDef`.
+`maxConcurrency`: Int, default `32`. The max number of page requests in flight across all subgraphs.
+Return:
+Same as `beta_load_subgraphs`.
+"""
+async def beta_load_subgraphs_async(defs:list[SubgraphDef], maxConcurrency=32):
+    loaded = {}
+    async with AsyncGraphClient(maxConcurrency) as client:
+        batches = _batch_defs(defs)
+        data = await asyncio.gather(*[_load_subgraph_batch_async(client, b) for b in batches])
+    for batch, rs in zip(batches, data):
+        for d, r in zip(batch, rs):
+            if isinstance(r, Exception):
+                st.exception(r)
+            else:
+                loaded[id(d)] = r
+    return _collect_results(defs, loaded)
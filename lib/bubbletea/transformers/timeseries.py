@@ -62,6 +62,62 @@ def _to_df(data: Union[Dict, "list[Dict]", DataFrame]):
     return data if (isinstance(data, DataFrame)) else (pd.json_normalize(data))
 
 
+def _is_arrow_column(column: pd.Series):
+    return hasattr(pd, "ArrowDtype") and isinstance(column.dtype, pd.ArrowDtype)
+
+
+_ARROW_AGGREGATE_METHODS = ["sum", "min", "max", "mean", "count"]
+
+
+def _arrow_mean(total, count):
+    # The widened sum over the count. Arrow divides at the scale of the sum plus the digits of the count and one,
+    # so the sum is cast to the precision its values need for the quotient to fit.
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    scale = total.type.scale
+    largest = pc.max(pc.abs(total)).as_py() or 0
+    digits = len(str(int(largest))) + scale
+    count_digits = len(str(pc.max(count).as_py() or 0))
+    decimal = pa.decimal128 if digits + count_digits + 1 <= 38 else pa.decimal256
+    # Integers only cast to decimals of 19 digits, the counts are narrowed to their digits from there.
+    count = count.cast(pa.decimal128(19, 0)).cast(decimal(count_digits, 0))
+    return pc.divide(total.cast(decimal(digits, scale)), count)
+
+
+def _arrow_groupby(df: DataFrame, by_column: str, params: dict):
+    # Group and aggregate Arrow decimal columns in Arrow compute, without converting them to Python objects.
+    import pyarrow as pa
+
+    columns = list(dict.fromkeys([by_column] + [p.column for p in params.values()]))
+    table = pa.Table.from_pandas(df[columns], preserve_index=False)
+    methods = {name: str(getattr(p.aggfunc, "value", p.aggfunc)) for name, p in params.items()}
+    aggregations = []
+    for name, p in params.items():
+        t = table.schema.field(p.column).type
+        if methods[name] in ["sum", "mean"] and t.precision < (38 if t.bit_width == 128 else 76):
+            # Sums keep the input type, widen it so they can't overflow the precision.
+            wide = pa.decimal128(38, t.scale) if t.bit_width == 128 else pa.decimal256(76, t.scale)
+            i = table.schema.get_field_index(p.column)
+            table = table.set_column(i, p.column, table[p.column].cast(wide))
+        if methods[name] == "mean":
+            # Arrow's mean keeps the scale of the input, 1.5 and 2.25 would average to 1.88.
+            aggregations += [(p.column, "sum"), (p.column, "count")]
+        else:
+            aggregations.append((p.column, methods[name]))
+    grouped = table.group_by(by_column).aggregate(list(dict.fromkeys(aggregations)))
+    results = {by_column: grouped[by_column]}
+    for name, p in params.items():
+        if methods[name] == "mean":
+            results[name] = _arrow_mean(grouped[f"{p.column}_sum"], grouped[f"{p.column}_count"])
+        else:
+            results[name] = grouped[f"{p.column}_{methods[name]}"]
+    result = pa.table(results).to_pandas(
+        types_mapper=lambda t: pd.ArrowDtype(t) if pa.types.is_decimal(t) else None
+    )
+    return result.set_index(by_column).sort_index()[list(params.keys())]
+
+
 def _last_day_of_month(any_day):
     next_month = any_day.replace(day=28) + datetime.timedelta(days=4)
     return next_month - datetime.timedelta(days=next_month.day)
@@ -179,7 +235,9 @@ def beta_aggregate_groupby(
     for c in columns:
         if c.type != None:
             if c.type == ColumnType.bigdecimal:
-                df[c.name] = df[c.name].apply(lambda x: Decimal(x))
+                # Arrow decimal columns are already precise and aggregate natively.
+                if not _is_arrow_column(df[c.name]):
+                    df[c.name] = df[c.name].apply(lambda x: Decimal(x))
             else:
                 df[c.name] = df[c.name].astype(c.type, copy=False, errors="ignore")
         cname = c.name
@@ -187,7 +245,14 @@ def beta_aggregate_groupby(
             cname = c.alias
         params[cname] = pd.NamedAgg(column=c.name, aggfunc=c.aggregate_method)
 
-    df = df.groupby(by_column).agg(**params)
+    arrow_native = all(
+        _is_arrow_column(df[p.column]) and p.aggfunc in _ARROW_AGGREGATE_METHODS
+        for p in params.values()
+    )
+    if arrow_native:
+        df = _arrow_groupby(df, by_column, params)
+    else:
+        df = df.groupby(by_column).agg(**params)
     for c in columns:
         cname = c.name
         if c.alias:
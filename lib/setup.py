@@ -43,6 +43,10 @@ setuptools.setup(
     install_requires=[
         'streamlit==0.87.0','graphql-core==3.1.5', 'st-flashcard==0.0.5', 'python-dotenv==0.18.0', 'streamlit-aggrid==0.2.1'
     ],
+    extras_require={
+        'async': ['aiohttp>=3.7.4'],
+        'fast': ['orjson>=3.6', 'brotli>=1.0'],
+    },
     entry_points={
         'console_scripts': ['bubbletea = bubbletea.cli:run']
     },
@@ -0,0 +1,156 @@
+import json
+import asyncio
+import decimal
+import tempfile
+from graphql import build_schema, graphql_sync
+from lib.bubbletea.cache import get_cache, set_cache
+from lib.bubbletea.thegraph.__core import SchemaIndex
+from lib.bubbletea.thegraph.__core.SubgraphLoader import SubgraphLoader
+from lib.bubbletea.thegraph.__core.AsyncGraphClient import AsyncGraphClient
+
+# A subgraph answered in process: the queries the loaders send are executed by graphql-core against `SCHEMA`.
+SCHEMA = build_schema('''
+scalar BigInt
+scalar BigDecimal
+scalar Filter
+enum OrderDirection { asc desc }
+enum Deposit_orderBy { id amount timestamp rank }
+enum Pool_orderBy { id }
+type Pool { id: ID! deposits(first: Int, skip: Int, where: Filter, orderBy: Deposit_orderBy, orderDirection: OrderDirection): [Deposit!]! }
+type Deposit { id: ID! amount: BigDecimal! timestamp: BigInt! createdAt: Int! blockNumber: Int! rank: Int pool: Pool! }
+type _Block_ { number: Int! timestamp: Int }
+type _Meta_ { block: _Block_! }
+type Query {
+    deposits(first: Int, skip: Int, where: Filter, orderBy: Deposit_orderBy, orderDirection: OrderDirection, block: Filter): [Deposit!]!
+    pools(first: Int, skip: Int, where: Filter, orderBy: Pool_orderBy, orderDirection: OrderDirection, block: Filter): [Pool!]!
+    pool(id: ID!, block: Filter): Pool
+    _meta(block: Filter): _Meta_
+}
+''')
+SCHEMA.type_map['BigInt'].serialize = str
+SCHEMA.type_map['BigDecimal'].serialize = str
+
+FILTER_OPS = {
+    'gt': lambda a, b: a > b,
+    'gte': lambda a, b: a >= b,
+    'lt': lambda a, b: a < b,
+    'lte': lambda a, b: a <= b,
+    'in': lambda a, b: a in b,
+}
+
+def _matches(row, where):
+    for key, value in (where or {}).items():
+        if key.startswith('_'):
+            continue
+        field, _, op = key.rpartition('_')
+        if op not in FILTER_OPS:
+            field, op = key, None
+        current = row[field]['id'] if isinstance(row[field], dict) else row[field]
+        cast = type(current)
+        if op == None:
+            if current != cast(value):
+                return False
+        elif not FILTER_OPS[op](current, [cast(v) for v in value] if op == 'in' else cast(value)):
+            return False
+    return True
+
+def select(rows, first=100, skip=0, where=None, orderBy=None, orderDirection=None, maxFirst=100, **args):
+    # `first`, `skip`, `where` and `orderBy` as a subgraph applies them, ties of `orderBy` in id order.
+    # Pages are at most `maxFirst` items, so a few hundred rows already take several pages.
+    if first > maxFirst:
+        raise ValueError(f'The `first` argument must be between 0 and {maxFirst}, but is {first}')
+    rows = [r for r in rows if _matches(r, where)]
+    field = 'id' if orderBy == None else orderBy
+    rows = sorted(rows, key=lambda r: r['id'])
+    rows = sorted(rows, key=lambda r: r[field], reverse=orderDirection == 'desc')
+    return rows[skip:skip + first]
+
+def make_deposits(count, pools=3):
+    # `count` deposits spread over `pools` pools, with repeated amounts so pages end inside ties.
+    # `rank` is nullable in the schema, it can not be a cursor.
+    pool = [{'id': f'p{i}'} for i in range(pools)]
+    deposits = [{'id': f'd{i:04d}', 'amount': decimal.Decimal(i % 7) / 2, 'timestamp': 1600000000 + i * 60, 'createdAt': 1600000000 + i * 60, 'blockNumber': 10000 + i, 'rank': i % 5, 'pool': pool[i % pools]} for i in range(count)]
+    for p in pool:
+        p['deposits'] = lambda info, p=p, **args: select([d for d in deposits if d['pool'] is p], **args)
+    return deposits, pool
+
+class _Response:
+    def __init__(self, content) -> None:
+        self.status_code = 200
+        self.content = content
+
+class _AsyncResponse:
+    # What `AsyncGraphClient.post` reads of an aiohttp response, requests in flight are counted while it is open.
+    def __init__(self, stub, body) -> None:
+        self.stub = stub
+        self.body = body
+        self.status = 200
+        self.headers = {}
+        pass
+
+    async def __aenter__(self):
+        self.stub.inFlight += 1
+        self.stub.maxInFlight = max(self.stub.maxInFlight, self.stub.inFlight)
+        await asyncio.sleep(0.001)
+        return self
+
+    async def __aexit__(self, *args):
+        self.stub.inFlight -= 1
+
+    async def read(self):
+        return json.dumps(self.stub.execute(self.body['query'], self.body.get('variables'))).encode('utf-8')
+
+class _AsyncSession:
+    def __init__(self, stub) -> None:
+        self.stub = stub
+        pass
+
+    def post(self, url, json=None):
+        return _AsyncResponse(self.stub, json)
+
+    async def close(self):
+        pass
+
+class StubSubgraph:
+    def __init__(self, deposits, pools, head=1000, capFirst=None) -> None:
+        # With `capFirst`, root lists answer at most that many items without an error, like some indexers do.
+        cap = lambda rows: rows if capFirst == None else rows[:capFirst]
+        self.root = {
+            'deposits': lambda info, **args: cap(select(deposits, **args)),
+            'pools': lambda info, **args: cap(select(pools, **args)),
+            'pool': lambda info, id, **args: next((p for p in pools if p['id'] == id), None),
+            '_meta': lambda info, **args: {'block': {'number': head, 'timestamp': head}},
+        }
+        self.queries = []
+        self.inFlight = 0
+        self.maxInFlight = 0
+        pass
+
+    def execute(self, query, variables=None):
+        self.queries.append(query)
+        result = graphql_sync(SCHEMA, query, self.root, variable_values=variables)
+        if result.errors:
+            return {'errors': [{'message': e.message} for e in result.errors]}
+        return {'data': result.data}
+
+    def __enter__(self):
+        # Every loader of the process talks to the stub, answers and schemas are not kept across tests.
+        stub = self
+        self.previous = (SubgraphLoader._post, AsyncGraphClient.__aenter__, get_cache(), SchemaIndex.SCHEMA_DIR)
+        self.schemaDir = tempfile.TemporaryDirectory()
+        async def enter(client):
+            client.semaphore = asyncio.Semaphore(client.maxConcurrency)
+            client.session = _AsyncSession(stub)
+            return client
+        SubgraphLoader._post = lambda sl, url, query, variables=None: _Response(json.dumps(stub.execute(query, variables)).encode('utf-8'))
+        AsyncGraphClient.__aenter__ = enter
+        set_cache(None)
+        SchemaIndex.SCHEMA_DIR = self.schemaDir.name
+        SchemaIndex._indexes.clear()
+        return self
+
+    def __exit__(self, *args):
+        SubgraphLoader._post, AsyncGraphClient.__aenter__, cache, SchemaIndex.SCHEMA_DIR = self.previous
+        SchemaIndex._indexes.clear()
+        set_cache(cache)
+        self.schemaDir.cleanup()
@@ -0,0 +1,60 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import tempfile
+import pandas as pd
+from decimal import Decimal
+from lib.bubbletea.thegraph.__core.decimal_utils import to_arrow_decimal, is_arrow_decimal
+from lib.bubbletea.thegraph.__core.DiskCache import DiskCache
+from lib.bubbletea.transformers.timeseries import beta_aggregate_groupby, ColumnConfig, ColumnType
+
+def test_to_arrow_decimal():
+    col = to_arrow_decimal(pd.Series(['1.5', '-2.25', None, '1000']))
+    assert is_arrow_decimal(col)
+    t = col.dtype.pyarrow_dtype
+    assert (t.precision, t.scale) == (6, 2)
+    assert list(col[[0, 1, 3]]) == [Decimal('1.5'), Decimal('-2.25'), Decimal('1000')]
+    assert pd.isna(col[2])
+    # Wider than 38 digits is a decimal256, exponents fall back to Python decimals.
+    assert to_arrow_decimal(pd.Series(['1' * 40 + '.5'])).dtype.pyarrow_dtype.bit_width == 256
+    col = to_arrow_decimal(pd.Series(['1e-18']))
+    assert not is_arrow_decimal(col) and col[0] == Decimal('1e-18')
+
+def test_disk_cache_arrow():
+    df = pd.DataFrame({'id': ['a', 'b', 'c'], 'amount': to_arrow_decimal(pd.Series(['1.5', None, '123456789012345678901234567890.25']))})
+    df.attrs['block'] = 100
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = DiskCache(tmp)
+        cache.set('key', {'deposits': df})
+        loaded = cache.get('key')['deposits']
+    assert loaded['amount'].dtype == df['amount'].dtype
+    assert loaded.equals(df)
+    assert loaded.attrs == {'block': 100}
+
+def test_arrow_groupby():
+    df = pd.DataFrame({'g': ['a', 'a', 'b', 'c'], 'v': to_arrow_decimal(pd.Series(['1.5', '2.25', '3', None]))})
+    columns = [
+        ColumnConfig('v', 'mean', ColumnType.bigdecimal),
+        ColumnConfig('v', 'sum', ColumnType.bigdecimal, alias='total'),
+        ColumnConfig('v', 'count', ColumnType.bigdecimal, alias='n'),
+        ColumnConfig('v', 'max', ColumnType.bigdecimal, alias='top'),
+    ]
+    r = beta_aggregate_groupby(df, 'g', columns)
+    assert is_arrow_decimal(r['v']) and is_arrow_decimal(r['total'])
+    # The mean is not rounded to the scale of the input.
+    assert r['v']['a'] == Decimal('1.875') and r['v']['b'] == Decimal('3')
+    assert pd.isna(r['v']['c'])
+    assert list(r['total'][['a', 'b']]) == [Decimal('3.75'), Decimal('3')]
+    assert list(r['n']) == [2, 1, 0]
+    assert list(r['top'][['a', 'b']]) == [Decimal('2.25'), Decimal('3')]
+    # Sums of the largest decimal128 values do not overflow.
+    big = '9' * 36 + '.5'
+    df = pd.DataFrame({'g': ['a', 'a'], 'v': to_arrow_decimal(pd.Series([big, big]))})
+    r = beta_aggregate_groupby(df, 'g', [ColumnConfig('v', 'sum', ColumnType.bigdecimal), ColumnConfig('v', 'mean', ColumnType.bigdecimal, alias='m')])
+    assert r['v']['a'] == Decimal('1' + '9' * 36) and r['m']['a'] == Decimal(big)
+
+if __name__ == "__main__":
+    test_to_arrow_decimal()
+    test_disk_cache_arrow()
+    test_arrow_groupby()
+    print("Everything passed")
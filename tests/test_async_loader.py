@@ -0,0 +1,47 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+from tests.subgraph_stub import StubSubgraph, make_deposits
+from lib.bubbletea.thegraph import beta_load_subgraph, beta_load_subgraph_async, AsyncGraphClient
+
+URL = 'http://localhost/stub'
+QUERIES = [
+    '{ deposits(bypassPagination: true) { id amount timestamp pool { id } } pools { id } }',
+    '{ deposits(bypassPagination: true, orderBy: amount, orderDirection: desc) { id amount } }',
+    '{ deposits(bypassPagination: true, shards: 4, shardBy: timestamp) { id timestamp } }',
+    '{ pools(bypassPagination: true) { id deposits(bypassPagination: true) { id amount } } }',
+]
+
+def test_same_as_threaded():
+    # The async engine pages the same way as the threaded one and builds the same frames.
+    deposits, pools = make_deposits(450)
+    with StubSubgraph(deposits, pools):
+        for query in QUERIES:
+            expected = beta_load_subgraph(URL, query)
+            result = asyncio.run(beta_load_subgraph_async(URL, query))
+            assert list(result.keys()) == list(expected.keys())
+            for name, df in expected.items():
+                assert len(df) > 0
+                assert result[name].equals(df)
+
+def test_shared_client():
+    # Loads sharing a client share its bound on requests in flight.
+    deposits, pools = make_deposits(2000)
+    with StubSubgraph(deposits, pools) as stub:
+        async def load():
+            async with AsyncGraphClient(2) as client:
+                return await asyncio.gather(*[beta_load_subgraph_async(URL, q, client=client) for q in QUERIES[:3]])
+        results = asyncio.run(load())
+        assert [len(r['deposits']) for r in results] == [2000, 2000, 2000]
+        assert stub.maxInFlight == 2
+        # Progress is reported per entity as pages arrive.
+        progress = []
+        asyncio.run(beta_load_subgraph_async(URL, QUERIES[1], progressCallback=progress.append))
+        counts = [p['deposits'] for p in progress]
+        assert counts == sorted(counts) and counts[-1] == 2000 and len(counts) > 1
+
+if __name__ == "__main__":
+    test_same_as_threaded()
+    test_shared_client()
+    print("Everything passed")
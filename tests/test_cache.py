@@ -0,0 +1,65 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import tempfile
+from lib.bubbletea.cache import MemoryCache, FileCache, SqliteCache, get_cache_key, set_cache, get_cache
+from lib.bubbletea.thegraph.__core.SubgraphLoader import SubgraphLoader
+
+def _check_backend(cache):
+    assert cache.get('a') == None
+    cache.set('a', b'12345')
+    cache.set('b', b'12345')
+    assert cache.get('a') == b'12345'
+    # `b` is the least recently used, it goes when `c` does not fit.
+    cache.set('c', b'1234')
+    assert cache.get('b') == None
+    assert cache.get('c') == b'1234'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['sets'], stats['evictions']) == (2, 2, 3, 1)
+    assert (stats['entries'], stats['bytes']) == (2, 9)
+
+def test_backends():
+    _check_backend(MemoryCache(maxBytes=10))
+    with tempfile.TemporaryDirectory() as tmp:
+        _check_backend(FileCache(os.path.join(tmp, 'responses'), maxBytes=10))
+        _check_backend(SqliteCache(os.path.join(tmp, 'cache.sqlite'), maxBytes=10))
+
+def test_ttl():
+    cache = MemoryCache(ttl=-1)
+    cache.set('a', b'1')
+    assert cache.get('a') == None
+
+class _Response:
+    def __init__(self, content) -> None:
+        self.status_code = 200
+        self.content = content
+
+def test_loader_cache():
+    previous = get_cache()
+    cache = MemoryCache()
+    set_cache(cache)
+    try:
+        sl = SubgraphLoader('http://localhost/subgraph', '{ pools { id } }')
+        posts = []
+        sl._post = lambda url, query, variables=None: posts.append(query) or _Response(b'{"data": {"pools": []}}')
+        for i in range(2):
+            assert sl._load_subgraph_query(sl.subgraphUrl, '{ pools { id } }', {'first': 10}) == {'data': {'pools': []}}
+        assert len(posts) == 1
+        assert cache.get(get_cache_key(sl.subgraphUrl, '{ pools { id } }', {'first': 10})) != None
+        # Errors are raised and not kept.
+        sl._post = lambda url, query, variables=None: _Response(b'{"errors": [{"message": "boom"}]}')
+        for i in range(2):
+            try:
+                sl._load_subgraph_query(sl.subgraphUrl, '{ swaps { id } }')
+                assert False
+            except ValueError:
+                pass
+        assert cache.stats()['sets'] == 1
+    finally:
+        set_cache(previous)
+
+if __name__ == "__main__":
+    test_backends()
+    test_ttl()
+    test_loader_cache()
+    print("Everything passed")
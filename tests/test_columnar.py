@@ -0,0 +1,29 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pandas as pd
+from lib.bubbletea.thegraph.__core import columnar
+
+items = [
+    {'amount': '1.5', 'timestamp': 1609459200, 'reserve': {'symbol': 'AAVE', 'decimals': 18}, 'swaps': [{'id': 'a'}], 'id': '0x01'},
+    {'amount': '2.5', 'timestamp': 1609459300, 'reserve': {'symbol': 'USDC', 'decimals': 6}, 'swaps': [], 'id': '0x02'},
+]
+
+def test():
+    pages = [columnar.page_to_columns(items[:1]), columnar.page_to_columns(items[1:])]
+    df = pd.DataFrame(columnar.concat_pages(pages))
+    expected = pd.json_normalize(items)
+    assert list(df.columns) == list(expected.columns)
+    assert df.equals(expected)
+    assert columnar.column_values(pages, 'id') == ['0x01', '0x02']
+
+def test_null_nested_object():
+    pages = [columnar.page_to_columns([{'id': '0x01', 'reserve': None}]), columnar.page_to_columns([{'id': '0x02', 'reserve': {'symbol': 'AAVE'}}])]
+    df = pd.DataFrame(columnar.concat_pages(pages))
+    assert df['reserve.symbol'].tolist() == [None, 'AAVE']
+    assert columnar.page_to_columns([]) == {}
+
+if __name__ == "__main__":
+    test()
+    test_null_nested_object()
+    print("Everything passed")
@@ -0,0 +1,72 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import tempfile
+import pandas as pd
+from tests.subgraph_stub import StubSubgraph, make_deposits
+from lib.bubbletea.thegraph.__core.DiskCache import DiskCache
+from lib.bubbletea.thegraph import beta_load_subgraph
+
+def _result(n):
+    df = pd.DataFrame({'id': [f'd{i}' for i in range(n)], 'amount': [i / 2 for i in range(n)]})
+    df.attrs['block'] = 100
+    return {'deposits': df, 'pools': pd.DataFrame({'id': ['p0']})}
+
+def test_get_set():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = DiskCache(tmp)
+        key = cache.get_key('http://localhost/stub', '{ deposits { id } }')
+        # Equivalent queries share a key, other blocks and decimal modes do not.
+        assert key == cache.get_key('http://localhost/stub', '{deposits{id}}')
+        assert key != cache.get_key('http://localhost/stub', '{ deposits { id } }', block=5)
+        assert key != cache.get_key('http://localhost/stub', '{ deposits { id } }', useBigDecimal=True)
+        assert cache.get(key) == None
+        result = _result(10)
+        cache.set(key, result)
+        loaded = cache.get(key)
+        assert list(loaded.keys()) == ['deposits', 'pools']
+        assert loaded['deposits'].equals(result['deposits'])
+        assert loaded['deposits'].attrs == {'block': 100}
+        assert not any(name.endswith('.tmp') for name in os.listdir(tmp))
+
+def test_ttl():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = DiskCache(tmp, ttl=-1)
+        cache.set('latest', _result(1))
+        cache.set('pinned', _result(1), immutable=True)
+        assert cache.get('latest') == None
+        assert not os.path.exists(os.path.join(tmp, 'latest'))
+        # Entries of a pinned block never change, they do not expire.
+        assert cache.get('pinned') != None
+
+def test_evict():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = DiskCache(tmp)
+        for i, key in enumerate(['a', 'b', 'c']):
+            cache.set(key, _result(100))
+            os.utime(os.path.join(tmp, key), (time.time() - 100 + i, time.time() - 100 + i))
+        # Reading `a` makes `b` the least recently used.
+        assert cache.get('a') != None
+        size = sum(e.stat().st_size for e in os.scandir(os.path.join(tmp, 'a')))
+        cache.maxBytes = int(size * 2.5)
+        cache.evict()
+        assert sorted(os.listdir(tmp)) == ['a', 'c']
+
+def test_load_subgraph():
+    deposits, pools = make_deposits(250)
+    with StubSubgraph(deposits, pools) as stub, tempfile.TemporaryDirectory() as tmp:
+        cache = DiskCache(tmp)
+        query = '{ deposits(bypassPagination: true) { id amount } }'
+        first = beta_load_subgraph('http://localhost/stub', query, diskCache=cache)
+        requests = len(stub.queries)
+        second = beta_load_subgraph('http://localhost/stub', query, diskCache=cache)
+        assert len(stub.queries) == requests
+        assert second['deposits'].equals(first['deposits'])
+
+if __name__ == "__main__":
+    test_get_set()
+    test_ttl()
+    test_evict()
+    test_load_subgraph()
+    print("Everything passed")
@@ -0,0 +1,63 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+from lib.bubbletea.http_client import HttpClient, RateLimiter, get_retry_after, get_http_client, POOL_SIZE
+from lib.bubbletea.thegraph import beta_set_pool_size
+
+def test():
+    client = HttpClient(poolSize=8)
+    session = client._get_session('https://api.thegraph.com/subgraphs/name/a')
+    assert session is client._get_session('https://api.thegraph.com/subgraphs/name/b')
+    adapter = session.adapters['https://api.thegraph.com']
+    assert adapter._pool_maxsize == 8
+
+    sessions = []
+    t = threading.Thread(target=lambda: sessions.append(client._get_session('https://api.thegraph.com/subgraphs/name/c')))
+    t.start()
+    t.join()
+    # Every thread has its own session, the pool of the host is shared.
+    assert sessions[0] is not session
+    assert sessions[0].adapters['https://api.thegraph.com'] is adapter
+    assert len(client.adapters) == 1
+
+def test_rate_limiter():
+    limiter = RateLimiter([(4, 1)])
+    delays = [limiter.reserve() for i in range(8)]
+    # A burst of 4 goes out at once, the rest are spaced a quarter second apart in call order.
+    assert all(d <= 0 for d in delays[:4])
+    assert all(abs(d - (i + 1) * 0.25) < 0.05 for i, d in enumerate(delays[4:]))
+
+    # Callers waiting out a pause get a burst of 4 when it ends, then the spacing again.
+    limiter = RateLimiter([(4, 1)])
+    limiter.pause(2)
+    delays = [limiter.reserve() for i in range(8)]
+    assert all(1.9 < d <= 2 for d in delays[:4])
+    assert all(abs(d - 2 - (i + 1) * 0.25) < 0.05 for i, d in enumerate(delays[4:]))
+
+    # Every quota is kept, the second one holds the calls back past the slots of the first.
+    limiter = RateLimiter([(4, 1), (6, 60)])
+    delays = [limiter.reserve() for i in range(8)]
+    assert all(abs(d - e) < 0.05 for d, e in zip(delays, [0, 0, 0, 0, 0.25, 0.5, 10, 20]))
+
+    limiter = RateLimiter()
+    assert limiter.reserve() <= 0
+    limiter.pause(2)
+    assert 1.9 < limiter.reserve() <= 2
+    assert get_retry_after({'Retry-After': '3'}, 0) == 3
+    assert get_retry_after({}, 1) == 0.4
+
+def test_set_pool_size():
+    # Every later load shares a client with the new pool size.
+    beta_set_pool_size(4)
+    try:
+        assert get_http_client().poolSize == 4
+        assert get_http_client() is get_http_client()
+    finally:
+        beta_set_pool_size(POOL_SIZE)
+
+if __name__ == "__main__":
+    test()
+    test_rate_limiter()
+    test_set_pool_size()
+    print("Everything passed")
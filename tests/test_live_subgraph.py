@@ -0,0 +1,52 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pandas as pd
+from tests.subgraph_stub import StubSubgraph, make_deposits
+from lib.bubbletea.thegraph.__core.LiveSubgraph import LiveSubgraph, upsert
+from lib.bubbletea.thegraph.__core.SubgraphLoader import SubgraphLoader
+
+def test_upsert():
+    df = pd.DataFrame({'id': ['a', 'b', 'c'], 'amount': [3, 1, 2]})
+    changes = pd.DataFrame({'id': ['b', 'd'], 'amount': [5, 2]})
+    merged = upsert(df, changes, 'amount', False)
+    assert list(merged['id']) == ['b', 'a', 'c', 'd']
+    assert list(merged['amount']) == [5, 3, 2, 2]
+    assert list(upsert(df, changes)['id']) == ['a', 'b', 'c', 'd']
+    assert upsert(df, changes.iloc[0:0]) is df
+    assert list(upsert(df, changes, removed=['a'])['id']) == ['b', 'c', 'd']
+    assert list(upsert(df, changes.iloc[0:0], removed=['c'])['id']) == ['a', 'b']
+
+def test_changed_since():
+    query = '{ deposits(bypassPagination: true, where: {amount_gt: 5}) { id amount } pools(first: 10) { id } }'
+    queries = []
+    for block in [100, 200]:
+        sl = SubgraphLoader('http://localhost/subgraph', query, block=block)
+        sl._resolve_block()
+        sl._prepare_changes(block + 1)
+        queries.append([e.build_query(True)[0] for e in sl.entities])
+    assert '_change_block: {number_gte: 101}' in queries[0][0]
+    assert 'amount_gt: 5' in queries[0][0]
+    assert '_change_block: {number_gte: 201}' in queries[1][0]
+    assert '_change_block' not in queries[0][1]
+
+def test_refresh_filtered():
+    # Rows changed out of the `where` filter leave the live frame, rows changed into it join.
+    deposits, pools = make_deposits(150)
+    live = LiveSubgraph('http://localhost/stub', '{ deposits(bypassPagination: true, where: {rank_gte: 3}) { id rank } }')
+    with StubSubgraph(deposits, pools, head=1000):
+        df = live.refresh()['deposits']
+    assert sorted(df['id']) == sorted(d['id'] for d in deposits if d['rank'] >= 3)
+    deposits[3]['rank'] = 0
+    deposits[0]['rank'] = 4
+    with StubSubgraph(deposits, pools, head=1001) as stub:
+        df = live.refresh()['deposits']
+    assert sorted(df['id']) == sorted(d['id'] for d in deposits if d['rank'] >= 3)
+    assert 'd0003' not in list(df['id']) and 'd0000' in list(df['id'])
+    assert all('_change_block' in q for q in stub.queries if 'deposits(' in q)
+
+if __name__ == "__main__":
+    test_upsert()
+    test_changed_since()
+    test_refresh_filtered()
+    print("Everything passed")
@@ -0,0 +1,63 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+from tests.subgraph_stub import StubSubgraph, make_deposits
+from lib.bubbletea.thegraph import SubgraphDef, beta_load_subgraph, beta_load_subgraphs, beta_load_subgraphs_async
+
+URL = 'http://localhost/stub'
+OTHER_URL = 'http://localhost/other'
+QUERIES = [
+    '{ deposits(bypassPagination: true) { id amount } }',
+    '{ pools(bypassPagination: true) { id } }',
+    '{ big: deposits(bypassPagination: true, where: {amount_gte: 2}) { id timestamp } }',
+]
+
+def _defs():
+    return [SubgraphDef(URL, q) for q in QUERIES] + [SubgraphDef(OTHER_URL, QUERIES[0])]
+
+def _check(results, expected):
+    # Definitions of one url return their entities together, none is lost to the merged load.
+    assert sorted(results.keys()) == [OTHER_URL, URL]
+    assert sorted(results[URL].keys()) == ['big', 'deposits', 'pools']
+    assert list(results[OTHER_URL].keys()) == ['deposits']
+    for name, df in expected.items():
+        assert results[URL][name].equals(df)
+    assert results[OTHER_URL]['deposits'].equals(expected['deposits'])
+
+def _check_queries(queries):
+    # The definitions of one url page together, as aliased fields of the same requests.
+    pages = [q for q in queries if '__schema' not in q]
+    assert any('b0_deposits:' in q and 'b1_pools:' in q and 'b2_big:' in q for q in pages)
+    assert not any(('pools(' in q or 'big:' in q) and 'b1_pools:' not in q and 'b2_big:' not in q for q in pages)
+
+def test_load_subgraphs():
+    deposits, pools = make_deposits(450)
+    with StubSubgraph(deposits, pools) as stub:
+        expected = {}
+        for q in QUERIES:
+            expected.update(beta_load_subgraph(URL, q))
+        assert len(expected['deposits']) == 450
+        assert len(expected['big']) == len([d for d in deposits if d['amount'] >= 2])
+        loaded = []
+        sent = len(stub.queries)
+        results = beta_load_subgraphs(_defs(), resultCallback=lambda url, r: loaded.append((url, sorted(r.keys()))))
+        _check(results, expected)
+        _check_queries(stub.queries[sent:])
+        assert sorted(loaded) == [(OTHER_URL, ['deposits']), (URL, ['big']), (URL, ['deposits']), (URL, ['pools'])]
+
+def test_load_subgraphs_async():
+    deposits, pools = make_deposits(450)
+    with StubSubgraph(deposits, pools) as stub:
+        expected = {}
+        for q in QUERIES:
+            expected.update(beta_load_subgraph(URL, q))
+        sent = len(stub.queries)
+        results = asyncio.run(beta_load_subgraphs_async(_defs()))
+        _check(results, expected)
+        _check_queries(stub.queries[sent:])
+
+if __name__ == "__main__":
+    test_load_subgraphs()
+    test_load_subgraphs_async()
+    print("Everything passed")
@@ -0,0 +1,46 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from lib.bubbletea.thegraph.__core import PageSizer
+from lib.bubbletea.thegraph.__core.PageSizer import is_page_size_error
+
+def test():
+    sizer = PageSizer.PageSizer('http://localhost/test')
+    assert sizer.next_size() == 1000
+    # Pages grow past the documented limit once the endpoint has served a full page of it.
+    sizer.record(1000, 0.5)
+    assert sizer.next_size() == 1000
+    sizer.accept(1000, 999)
+    sizer.record(1000, 0.5)
+    assert sizer.next_size() == 1000
+    sizer.accept(1000, 1000)
+    sizer.record(1000, 0.5)
+    assert sizer.next_size() == 2000
+    sizer.record(2000, 30)
+    assert sizer.next_size() == 1000
+
+def test_shrink():
+    sizer = PageSizer.PageSizer('http://localhost/test_shrink')
+    assert sizer.shrink(1000, ValueError('The Graph Connection Error: 524'))
+    assert sizer.next_size() == 500
+    # Growing searches below the size that failed.
+    sizer.record(500, 0.5)
+    assert sizer.next_size() == 750
+    sizer.size = PageSizer.MIN_ITEMS_PER_PAGE
+    assert not sizer.shrink(PageSizer.MIN_ITEMS_PER_PAGE, ValueError('The Graph Connection Error: 524'))
+
+def test_first_limit():
+    sizer = PageSizer.PageSizer('http://localhost/test_first_limit', 4000)
+    error = ValueError("The Graph Error: [{'message': 'The `first` argument must be between 0 and 1000, but is 4000'}]")
+    assert is_page_size_error(error)
+    assert sizer.shrink(4000, error)
+    assert sizer.next_size() == 1000
+    sizer.record(1000, 0.5)
+    assert sizer.next_size() == 1000
+    assert not is_page_size_error(ValueError("The Graph Error: [{'message': 'Type `Query` has no field `foo`'}]"))
+
+if __name__ == "__main__":
+    test()
+    test_shrink()
+    test_first_limit()
+    print("Everything passed")
@@ -0,0 +1,33 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from lib.bubbletea.thegraph.__core.QueryTemplate import QueryTemplate, parse_query, compose_query, merge_queries, split_batch_key
+
+def test_render():
+    t = QueryTemplate('swaps(where: {id_gt: $__lastId}, first: $__first) { id }')
+    assert t.variables == ['lastId', 'first']
+    assert t.render('p0_') == 'swaps(where: {id_gt: $p0_lastId}, first: $p0_first) { id }'
+
+def test_compose():
+    assert compose_query(['a { id }'], {}) == ('{a { id }}', None)
+    query, variables = compose_query(['a(first: $a_first) { id }'], {'a_first': ('Int', 100)})
+    assert query == 'query($a_first: Int) {a(first: $a_first) { id }}'
+    assert variables == {'a_first': 100}
+
+def test_parse_cache():
+    assert parse_query('{ a { id } }') is parse_query('{ a { id } }')
+
+def test_merge():
+    query = merge_queries(['{ deposits(first: 5) { id } }', '{ d: deposits { id } pools { id } }'])
+    fields = parse_query(query).definitions[0].selection_set.selections
+    assert [f.alias.value for f in fields] == ['b0_deposits', 'b1_d', 'b1_pools']
+    assert [f.name.value for f in fields] == ['deposits', 'deposits', 'pools']
+    assert split_batch_key('b1_d') == (1, 'd')
+    assert split_batch_key('b12_pool_day') == (12, 'pool_day')
+
+if __name__ == "__main__":
+    test_render()
+    test_compose()
+    test_parse_cache()
+    test_merge()
+    print("Everything passed")
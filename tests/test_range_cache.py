@@ -0,0 +1,76 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pandas as pd
+from lib.bubbletea.thegraph.__core.RangeCache import RangeCache, find_range
+from lib.bubbletea.thegraph.__core.QueryTemplate import parse_query
+
+URL = 'http://localhost/subgraph'
+QUERY = '{ deposits(bypassPagination: true, where: {timestamp_gte: %d, timestamp_lt: %d}) { id amount } pools(first: 5) { id } }'
+
+def _rows(lo, hi):
+    return pd.DataFrame({'id': ['%04d' % t for t in range(lo, hi)], 'amount': list(range(lo, hi)), 'timestamp': list(range(lo, hi))})
+
+def _load(cache, lo, hi):
+    return _answer(cache.plan(URL, QUERY % (lo, hi)))
+
+def _answer(plan):
+    # Answers every gap of the plan like the subgraph would, returns the served frames and the loaded gaps.
+    result = {}
+    gaps = []
+    if plan.query != None:
+        for s in parse_query(plan.query).definitions[0].selection_set.selections:
+            if s.alias == None:
+                result[s.name.value] = pd.DataFrame({'id': ['p0']})
+            else:
+                _, gapLo, gapHi = find_range(s)
+                gaps.append((gapLo, gapHi))
+                result[s.alias.value] = _rows(gapLo, gapHi)
+    return plan.finish(result), gaps
+
+def test_find_range():
+    node = parse_query('{ deposits(where: {pool: "p0", timestamp_gt: 10, timestamp_lte: 20}) { id } }').definitions[0].selection_set.selections[0]
+    assert find_range(node) == ('timestamp', 11, 21)
+    node = parse_query('{ deposits(where: {timestamp_gte: 10}) { id } }').definitions[0].selection_set.selections[0]
+    assert find_range(node) == None
+
+def test_gaps():
+    cache = RangeCache()
+    result, gaps = _load(cache, 100, 200)
+    assert gaps == [(100, 200)]
+    assert list(result) == ['deposits', 'pools']
+    assert list(result['deposits'].columns) == ['id', 'amount']
+    result, gaps = _load(cache, 150, 260)
+    assert gaps == [(200, 260)]
+    assert list(result['deposits']['amount']) == list(range(150, 260))
+    result, gaps = _load(cache, 50, 300)
+    assert gaps == [(50, 100), (260, 300)]
+    assert list(result['deposits']['amount']) == list(range(50, 300))
+    result, gaps = _load(cache, 120, 130)
+    assert gaps == []
+    assert list(result['deposits']['amount']) == list(range(120, 130))
+
+def test_evict():
+    cache = RangeCache(maxBytes=1)
+    _load(cache, 100, 200)
+    result, gaps = _load(cache, 100, 200)
+    assert gaps == [(100, 200)]
+    assert cache.bytes == 0
+
+def test_evict_during_load():
+    # A load keeps the segments it planned with, even when another load evicts them before it finishes.
+    cache = RangeCache(maxBytes=20000)
+    _load(cache, 100, 200)
+    plan = cache.plan(URL, QUERY % (120, 250))
+    _load(cache, 1000, 1400)
+    assert cache.bytes <= cache.maxBytes and len(cache.entries) == 0
+    result, gaps = _answer(plan)
+    assert gaps == [(200, 250)]
+    assert list(result['deposits']['amount']) == list(range(120, 250))
+
+if __name__ == "__main__":
+    test_find_range()
+    test_gaps()
+    test_evict()
+    test_evict_during_load()
+    print("Everything passed")
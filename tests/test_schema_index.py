@@ -0,0 +1,73 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+from tests.subgraph_stub import StubSubgraph, make_deposits
+from lib.bubbletea.thegraph import beta_load_subgraph, beta_load_subgraph_async
+from lib.bubbletea.thegraph.__core import schema_utils
+from lib.bubbletea.thegraph.__core.SchemaIndex import SchemaIndex, find_missing_types
+from graphql import parse
+
+def _type(name, fields):
+    return {'name': name, 'fields': [{'name': f, 'type': t} for f, t in fields.items()]}
+
+def _non_null_list(name):
+    return {'kind': 'NON_NULL', 'name': None, 'ofType': {'kind': 'LIST', 'name': None, 'ofType': {'kind': 'NON_NULL', 'name': None, 'ofType': {'kind': 'OBJECT', 'name': name, 'ofType': None}}}}
+
+types = [
+    _type('Query', {'deposits': _non_null_list('Deposit'), 'deposit': {'kind': 'OBJECT', 'name': 'Deposit', 'ofType': None}}),
+    _type('Deposit', {'id': {'name': 'ID', 'ofType': None}, 'amount': {'name': 'BigDecimal', 'ofType': None}, 'reserve': {'name': None, 'ofType': {'name': 'Reserve', 'ofType': None}}}),
+    _type('Reserve', {'symbol': {'name': 'String', 'ofType': None}}),
+    {'name': 'String', 'fields': None},
+]
+
+def test():
+    index = SchemaIndex(types)
+    for path in ['Query.deposits', 'Deposit.amount', 'Deposit.reserve.symbol', 'Deposit.missing', 'Missing.id', 'Deposit.amount.value']:
+        assert index.find_column_type(path) == schema_utils.find_column_type(path, types)
+    assert index.find_column_type('Deposit.reserve.symbol') == 'String'
+    assert SchemaIndex(index.types).find_column_type('Query.deposits') == 'Deposit'
+
+def test_list_fields():
+    index = SchemaIndex(types)
+    assert index.is_list_field('Query', 'deposits')
+    assert not index.is_list_field('Query', 'deposit')
+    assert not index.is_list_field('Deposit', 'reserve')
+    assert SchemaIndex(index.types, index.lists).is_list_field('Query', 'deposits')
+
+def test_non_null_fields():
+    index = SchemaIndex(types)
+    assert index.is_non_null_field('Query', 'deposits')
+    assert not index.is_non_null_field('Query', 'deposit')
+    assert SchemaIndex(index.types, index.lists, index.nonNull).is_non_null_field('Query', 'deposits')
+
+def test_missing_types():
+    selections = parse('{ deposits { amount reserve { symbol } } }').definitions[0].selection_set.selections
+    assert find_missing_types(None, selections) == ['Query']
+    index = SchemaIndex({'Query': {'deposits': 'Deposit'}})
+    assert find_missing_types(index, selections) == ['Deposit']
+    index.add_types(['Deposit'], {'t0': types[1]})
+    assert find_missing_types(index, selections) == ['Reserve']
+    index.add_types(['Reserve'], {'t0': None})
+    assert find_missing_types(index, selections) == []
+
+def test_targeted_schema():
+    # Only the types of the query are looked up, the whole schema is never asked for.
+    deposits, pools = make_deposits(150)
+    query = '{ deposits(bypassPagination: true, orderBy: amount) { id amount createdAt pool { id } } }'
+    for load in [lambda: beta_load_subgraph('http://localhost/stub', query, targetedSchema=True),
+                 lambda: asyncio.run(beta_load_subgraph_async('http://localhost/stub', query, targetedSchema=True))]:
+        with StubSubgraph(deposits, pools) as stub:
+            df = load()['deposits']
+        lookups = [q for q in stub.queries if '__type(' in q]
+        assert len(lookups) > 0 and not any('__schema' in q for q in stub.queries)
+        assert df['amount'].dtype == 'float64' and df['createdAt'].dtype == 'datetime64[ns]'
+        assert list(df['amount']) == sorted(df['amount'])
+
+if __name__ == "__main__":
+    test()
+    test_list_fields()
+    test_non_null_fields()
+    test_missing_types()
+    test_targeted_schema()
+    print("Everything passed")
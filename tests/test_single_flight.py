@@ -0,0 +1,87 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import asyncio
+import threading
+import pandas as pd
+from lib.bubbletea.thegraph.__core.SingleFlight import SingleFlight, get_flight_key
+
+def test():
+    flights = SingleFlight()
+    key = get_flight_key('http://localhost/test', '{ deposits { id } }', False)
+    assert key == get_flight_key('http://localhost/test', '{deposits{id}}', False)
+    assert key != get_flight_key('http://localhost/test', '{deposits{id}}', True)
+
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def load(report):
+        calls.append(1)
+        started.set()
+        release.wait()
+        report({'deposits': 2})
+        return {'deposits': pd.DataFrame({'id': ['a', 'b']})}
+
+    results = []
+    progress = []
+    leader = threading.Thread(target=lambda: results.append(flights.do(key, load)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(flights.do(key, load, progress.append))) for i in range(3)]
+    [t.start() for t in followers]
+    # The followers are all waiting on the flight before it lands.
+    while len(flights.flights[key].cond._waiters) < 3:
+        time.sleep(0.01)
+    release.set()
+    [t.join() for t in [leader] + followers]
+
+    assert len(calls) == 1
+    assert len(results) == 4
+    assert all(list(r['deposits']['id']) == ['a', 'b'] for r in results)
+    assert {'deposits': 2} in progress
+    assert len(flights.flights) == 0
+
+def test_error():
+    flights = SingleFlight()
+    def load(report):
+        raise ValueError('The Graph Error')
+    try:
+        flights.do('key', load)
+        assert False
+    except ValueError:
+        pass
+    assert len(flights.flights) == 0
+
+def test_async_progress():
+    # A caller waiting on a flight gets its progress page by page, on its own event loop.
+    flights = SingleFlight()
+    progress = []
+    async def run():
+        go = asyncio.Event()
+        async def load(report):
+            await go.wait()
+            for i in range(1, 4):
+                report({'deposits': i * 100})
+                await asyncio.sleep(0.05)
+            return {'deposits': pd.DataFrame({'id': ['a']})}
+        def follow(p):
+            progress.append((threading.get_ident(), p['deposits']))
+        leader = asyncio.ensure_future(flights.do_async('key', load))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do_async('key', load, follow))
+        while len(flights.flights['key'].cond._waiters) < 1:
+            await asyncio.sleep(0.01)
+        go.set()
+        return await asyncio.gather(leader, follower)
+    results = asyncio.run(run())
+    assert [list(r['deposits']['id']) for r in results] == [['a'], ['a']]
+    counts = [n for _, n in progress]
+    assert len(counts) > 1 and counts == sorted(counts) and counts[-1] == 300
+    assert all(thread == threading.get_ident() for thread, _ in progress)
+
+if __name__ == "__main__":
+    test()
+    test_error()
+    test_async_progress()
+    print("Everything passed")
@@ -0,0 +1,56 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tests.subgraph_stub import StubSubgraph, make_deposits
+from lib.bubbletea.thegraph.__core.SnapshotLoader import SnapshotLoader
+
+def _time(n):
+    return 1600000000 + n * 12 + (n * n) % 7
+
+def _loader(query='{ pools(first: 10, block: {number: 5}) { id tvl } }'):
+    sl = SnapshotLoader('http://localhost/subgraph', query)
+    sl._post_query = lambda url, query, variables=None: {'data': {'_meta': {'block': {'number': 1000, 'timestamp': _time(1000)}}}}
+    sl._load_block_timestamps = lambda numbers: [_time(n) for n in numbers]
+    return sl
+
+def test_snapshot_field():
+    sl = _loader()
+    field = sl._snapshot_field(sl.entities[0], 123)
+    assert field.startswith('b123_pools: pools(first: 10, block: {number: 123})')
+    assert 'number: 5' not in field
+
+def test_resolve_timestamps():
+    sl = _loader()
+    timestamps = [1500000000, _time(5) + 3, _time(500), _time(999) - 1, _time(1000) + 50]
+    blocks = sl._resolve_timestamps(timestamps)
+    assert blocks == {t: max([n for n in range(1001) if _time(n) <= t], default=0) for t in timestamps}
+
+def test_unsupported():
+    try:
+        SnapshotLoader('http://localhost/subgraph', '{ pools(bypassPagination: true) { id } }')
+    except ValueError:
+        return
+    assert False
+
+def test_no_blocks():
+    sl = _loader('{ pools(first: 10) { id tvl } swaps(first: 5) { id } }')
+    sl._load_subgraph_query = None
+    for result in [sl.load_snapshots(blocks=[]), sl.load_snapshots(timestamps=[])]:
+        assert list(result.keys()) == ['pools', 'swaps']
+        assert all(len(df) == 0 and df.index.name == 'block' for df in result.values())
+
+def test_block_field():
+    # A field of the entity named `block` stays a column, the snapshot blocks are the index.
+    deposits, pools = make_deposits(20)
+    with StubSubgraph(deposits, pools):
+        df = SnapshotLoader('http://localhost/stub', '{ deposits(first: 3) { id block: blockNumber } }').load_snapshots(blocks=[7, 5])['deposits']
+    assert df.index.name == 'block' and list(df.index) == [5, 5, 5, 7, 7, 7]
+    assert list(df['block']) == [10000, 10001, 10002] * 2
+
+if __name__ == "__main__":
+    test_snapshot_field()
+    test_resolve_timestamps()
+    test_unsupported()
+    test_no_blocks()
+    test_block_field()
+    print("Everything passed")
@@ -0,0 +1,65 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pandas as pd
+from tests.subgraph_stub import StubSubgraph, make_deposits
+from lib.bubbletea.thegraph import beta_load_subgraph
+from lib.bubbletea.thegraph.__core.SpillBuffer import SpillBuffer
+
+def _batch(start, n):
+    return pd.DataFrame({
+        'id': [f'0x{i:04x}' for i in range(start, start + n)],
+        'amount': [i + 0.5 for i in range(start, start + n)],
+        'timestamp': pd.to_datetime([1609459200 + i for i in range(start, start + n)], unit='s'),
+    })
+
+def test():
+    spill = SpillBuffer(1024)
+    for i in range(5):
+        spill.add(_batch(i * 100, 100), f'0x{i * 100 + 99:04x}')
+    assert len(spill.files) > 0
+    assert os.path.exists(spill.dir)
+    spillDir = spill.dir
+
+    df = spill.to_pandas(_batch(500, 10))
+    expected = pd.concat([_batch(i * 100, 100) for i in range(5)] + [_batch(500, 10)], ignore_index=True)
+    assert df.equals(expected)
+    assert spill.cursors[-1] == '0x01f3'
+    assert not os.path.exists(spillDir)
+
+def test_in_memory():
+    spill = SpillBuffer(1024 ** 3)
+    spill.add(_batch(0, 10))
+    assert len(spill.files) == 0
+    assert spill.to_pandas(pd.DataFrame()).equals(_batch(0, 10))
+
+def test_load_subgraph():
+    # A load over its memory budget spills typed batches to disk and builds the same frames as one that does not.
+    loader = sys.modules['lib.bubbletea.thegraph.__core.SubgraphLoader']
+    spill = SpillBuffer._spill
+    spilled = []
+    def count(buffer):
+        spilled.append(len(buffer.tables))
+        spill(buffer)
+    batchRows = loader.SPILL_BATCH_ROWS
+    loader.SPILL_BATCH_ROWS = 100
+    SpillBuffer._spill = count
+    deposits, pools = make_deposits(450)
+    query = '{ deposits(bypassPagination: true, orderBy: amount) { id amount timestamp pool { id } } }'
+    try:
+        with StubSubgraph(deposits, pools):
+            for useBigDecimal in [False, True]:
+                expected = beta_load_subgraph('http://localhost/stub', query, useBigDecimal=useBigDecimal)['deposits']
+                spilled.clear()
+                df = beta_load_subgraph('http://localhost/stub', query, useBigDecimal=useBigDecimal, memoryBudget=1)['deposits']
+                assert len(spilled) > 1
+                assert df.equals(expected)
+    finally:
+        loader.SPILL_BATCH_ROWS = batchRows
+        SpillBuffer._spill = spill
+
+if __name__ == "__main__":
+    test()
+    test_in_memory()
+    test_load_subgraph()
+    print("Everything passed")
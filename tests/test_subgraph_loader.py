@@ -0,0 +1,250 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import re
+import tempfile
+import threading
+import concurrent.futures
+import pandas as pd
+from tests.subgraph_stub import StubSubgraph, make_deposits
+from lib.bubbletea.thegraph.__core.SubgraphLoader import SubgraphLoader
+from lib.bubbletea.thegraph.__core import columnar, PageSizer
+from lib.bubbletea.thegraph.__core.QueryTemplate import parse_query
+from lib.bubbletea.thegraph.__core import sync_utils
+from lib.bubbletea.thegraph import beta_load_subgraph, beta_iter_subgraph_pages
+from lib.bubbletea.cache import MemoryCache, set_cache
+
+URL = 'http://localhost/stub'
+
+def _ids(rows):
+    return [r['id'] for r in rows]
+
+def test_ordered_first_page():
+    # The first page of an ordered entity follows `orderBy` while the schema is still loading.
+    deposits, pools = make_deposits(450)
+    with StubSubgraph(deposits, pools) as stub:
+        sl = SubgraphLoader(URL, '{ deposits(bypassPagination: true, orderBy: amount, orderDirection: desc) { id amount } }')
+        sl.schemaFuture = concurrent.futures.Future()
+        assert sl._load_page(None, True, sl.entities)
+        assert 'orderBy: amount' in stub.queries[-1] and 'cursor' not in stub.queries[-1]
+        assert not sl.schemaFuture.done()
+        sl.schemaFuture.set_result(sl._load_schema_index())
+        sl._load_page(None, False, sl.entities)
+        assert 'amount_lte: $deposits_cursor' in stub.queries[-1]
+
+def test_ordered_load():
+    deposits, pools = make_deposits(450)
+    with StubSubgraph(deposits, pools) as stub:
+        df = SubgraphLoader(URL, '{ deposits(bypassPagination: true, orderBy: amount, orderDirection: desc) { id amount } }').beta_load_subgraph()
+        expected = sorted(sorted(deposits, key=lambda d: d['id']), key=lambda d: d['amount'], reverse=True)
+        assert list(df['deposits']['id']) == _ids(expected)
+        # The cursor field is selected for the pages when the query does not select it.
+        df = SubgraphLoader(URL, '{ deposits(bypassPagination: true, orderBy: amount, orderDirection: desc) { id } }').beta_load_subgraph()
+        assert list(df['deposits']['id']) == _ids(expected)
+        # `rank` is nullable, the pages start over by id after the first one and the result is sorted on `rank`.
+        df = SubgraphLoader(URL, '{ deposits(bypassPagination: true, orderBy: rank) { id rank } }').beta_load_subgraph()['deposits']
+        assert 'id_gt: $deposits_lastId' in stub.queries[-1]
+        assert sorted(df['id']) == sorted(_ids(deposits))
+        assert df['rank'].is_monotonic_increasing
+
+def test_id_shard_filters():
+    for shards in [2, 4, 16, 17, 300]:
+        sl = SubgraphLoader(URL, '{ deposits(bypassPagination: true, shards: %d) { id } }' % shards)
+        filters = sl._shard_filters(sl.entities[0])
+        assert len(filters) == shards
+        bounds = [f[-1].value.value for f in filters[:-1]]
+        # Whole bytes, which `Bytes` ids accept.
+        assert all(re.fullmatch('0x([0-9a-f]{2})+', b) for b in bounds)
+        assert bounds == sorted(set(bounds))
+
+def test_int_datatypes():
+    # `Int` columns in the timestamp range become datetimes, whether the subgraph sends numbers or strings.
+    deposits, pools = make_deposits(10)
+    with StubSubgraph(deposits, pools):
+        sl = SubgraphLoader(URL, '{ deposits { id createdAt blockNumber } }')
+        sl.schema = sl._load_schema_index()
+        e = sl.entities[0]
+        def convert(items):
+            return sl._process_datatypes(e, [columnar.page_to_columns(items)], False)
+        numbers = [{'id': 'a', 'createdAt': 1600000000, 'blockNumber': 12}, {'id': 'b', 'createdAt': 1700000000, 'blockNumber': 13}]
+        strings = [{k: v if k == 'id' else str(v) for k, v in i.items()} for i in numbers]
+        for df in [convert(numbers), convert(strings)]:
+            assert list(df['createdAt']) == list(pd.to_datetime([1600000000, 1700000000], unit='s'))
+            assert df['blockNumber'].dtype == 'int64' and list(df['blockNumber']) == [12, 13]
+        # Strings up to 1999999999 are timestamps, like the regex they replace. Numbers stop at `TIMESTAMP_MAX`.
+        df = convert([{'id': 'a', 'createdAt': '1900000000', 'blockNumber': 1900000000}])
+        assert df['createdAt'][0] == pd.to_datetime(1900000000, unit='s')
+        assert df['blockNumber'].dtype == 'int64'
+        # A value that is not a number keeps the column as it was sent.
+        df = convert([{'id': 'a', 'createdAt': '1600000000', 'blockNumber': 'n/a'}])
+        assert list(df['blockNumber']) == ['n/a']
+
+def test_nested_page_limit():
+    # The page limit a nested field runs into is learned for its endpoint only.
+    deposits, pools = make_deposits(450)
+    with StubSubgraph(deposits, pools):
+        sl = SubgraphLoader(URL, '{ pools(bypassPagination: true) { id deposits(bypassPagination: true) { id } } }')
+        result = sl.beta_load_subgraph()
+        assert len(result['pools.deposits']) == 450
+        assert sl.entities[0].nested[0].pageSizer.url == URL
+        assert None not in PageSizer._limits
+
+def test_nested_order():
+    # Nested items page by id and are sorted on their `orderBy` per parent once loaded.
+    deposits, pools = make_deposits(450)
+    with StubSubgraph(deposits, pools):
+        query = '{ pools(bypassPagination: true) { id deposits(bypassPagination: true, orderBy: amount, orderDirection: desc) { id amount } } }'
+        df = SubgraphLoader(URL, query).beta_load_subgraph()['pools.deposits']
+        expected = sorted(sorted(deposits, key=lambda d: d['id']), key=lambda d: d['amount'], reverse=True)
+        expected = sorted(expected, key=lambda d: d['pool']['id'])
+        assert list(df['id']) == _ids(expected)
+        # The field is added to the items when they do not select it, fields of child entities can not be.
+        df = SubgraphLoader(URL, query.replace('{ id amount }', '{ id }')).beta_load_subgraph()['pools.deposits']
+        assert list(df['id']) == _ids(expected)
+        try:
+            SubgraphLoader(URL, query.replace('orderBy: amount', 'orderBy: pool__id')).beta_load_subgraph()
+            assert False
+        except ValueError as err:
+            assert 'must be a field' in str(err)
+
+def test_entity_streams():
+    # Every root entity pages in requests of its own, the progress of all of them reaches the calling thread.
+    deposits, pools = make_deposits(450)
+    with StubSubgraph(deposits, pools) as stub:
+        sl = SubgraphLoader(URL, '{ deposits(bypassPagination: true) { id } pools(bypassPagination: true) { id } }')
+        progress = []
+        result = sl.beta_load_subgraph(lambda p: progress.append((threading.get_ident(), p)))
+        assert (len(result['deposits']), len(result['pools'])) == (450, 3)
+        pages = [q for q in stub.queries if '__schema' not in q]
+        assert not any('deposits(' in q and 'pools(' in q for q in pages)
+        assert all(thread == threading.get_ident() for thread, p in progress)
+        assert max(p.get('deposits', 0) for _, p in progress) == 450
+        assert max(p.get('pools', 0) for _, p in progress) == 3
+
+def test_failing_stream():
+    # A failing entity does not stop the others, its error is raised once they have ended.
+    deposits, pools = make_deposits(450)
+    with StubSubgraph(deposits, pools) as stub:
+        sl = SubgraphLoader(URL, '{ deposits(bypassPagination: true) { id } pools(bypassPagination: true, where: {missing_gt: 1}) { id } }')
+        try:
+            sl.beta_load_subgraph()
+            assert False
+        except ValueError as err:
+            assert 'missing' in str(err)
+        assert len(sl.entities[0].data) > 0 and not sl.entities[0].hasNextPage
+        assert sum(len(page['id']) for page in sl.entities[0].data) == 450
+        # The deposits went on paging after the pools had failed.
+        failed = next(i for i, q in enumerate(stub.queries) if 'missing_gt' in q)
+        assert any('deposits(' in q and 'id_gt' in q for q in stub.queries[failed + 1:])
+
+def test_capped_pages():
+    # An endpoint answering fewer items than asked is paged until it answers an empty page.
+    deposits, pools = make_deposits(450)
+    with StubSubgraph(deposits, pools, capFirst=40) as stub:
+        df = SubgraphLoader('http://localhost/capped', '{ deposits(bypassPagination: true) { id } }').beta_load_subgraph()['deposits']
+        assert sorted(df['id']) == sorted(_ids(deposits))
+        assert len([q for q in stub.queries if 'deposits(' in q]) == 14
+    assert 'http://localhost/capped' not in PageSizer._accepted
+
+def test_cached_pages():
+    # Pages are found in the cache whatever page size a later load asks them with.
+    deposits, pools = make_deposits(450)
+    query = '{ deposits(bypassPagination: true) { id amount } pools(bypassPagination: true) { id deposits(bypassPagination: true) { id } } }'
+    with StubSubgraph(deposits, pools) as stub:
+        set_cache(MemoryCache())
+        first = SubgraphLoader(URL, query).beta_load_subgraph()
+        requests = len(stub.queries)
+        for name in ['deposits', 'pools.deposits']:
+            PageSizer.get_page_sizer(URL, name).size = 60
+        second = SubgraphLoader(URL, query).beta_load_subgraph()
+        assert len(stub.queries) == requests
+        for name, df in first.items():
+            assert second[name].equals(df)
+
+def test_iter_pages():
+    # Pages are handed out one by one in the order they were loaded, together they are the whole load.
+    deposits, pools = make_deposits(450)
+    url = 'http://localhost/iter'
+    query = '{ deposits(bypassPagination: true) { id amount } pools(bypassPagination: true) { id } }'
+    with StubSubgraph(deposits, pools):
+        pages = list(beta_iter_subgraph_pages(url, query))
+        expected = beta_load_subgraph(url, query)
+    assert [(name, len(df)) for name, df in pages] == [('deposits', 100)] * 4 + [('deposits', 50), ('pools', 3)]
+    ids = sorted(_ids(deposits))
+    for i, (name, df) in enumerate(pages[:5]):
+        assert list(df['id']) == ids[i * 100:(i + 1) * 100]
+    for name, df in expected.items():
+        joined = pd.concat([page for n, page in pages if n == name], ignore_index=True)
+        assert joined.equals(df)
+
+def test_pinned_block():
+    # Root, ordered, sharded, nested and first N fields all read the block the load was pinned to.
+    deposits, pools = make_deposits(450)
+    query = '''{ deposits(bypassPagination: true, orderBy: amount) { id amount } big: deposits(shards: 4, shardBy: timestamp) { id }
+        pools(bypassPagination: true) { id deposits(bypassPagination: true) { id } } top: pools(first: 2) { id } }'''
+    with StubSubgraph(deposits, pools, head=1234) as stub:
+        result = SubgraphLoader(URL, query, block='latest').beta_load_subgraph()
+    assert {name: len(df) for name, df in result.items()} == {'deposits': 450, 'big': 450, 'pools': 3, 'pools.deposits': 450, 'top': 2}
+    names = set()
+    cursorPages = 0
+    for q in stub.queries:
+        if '__schema' in q or '_meta' in q:
+            continue
+        cursorPages += 'cursor' in q or 'lastId' in q
+        for s in parse_query(q).definitions[0].selection_set.selections:
+            [block] = [a.value for a in s.arguments if a.name.value == 'block']
+            assert [(f.name.value, f.value.value) for f in block.fields] == [('number', '1234')]
+            names.add(s.name.value if s.alias == None else s.alias.value)
+    assert names == {'deposits', 'big', 'lower', 'upper', 'pools', 'p0', 'p1', 'p2', 'top'}
+    assert cursorPages > 0
+
+def test_sync_round_trip():
+    # The saved state is loaded back, the next load asks for the items from the saved cursor on in one query.
+    deposits, pools = make_deposits(250)
+    query = '{ deposits(bypassPagination: true, syncBy: timestamp) { id amount timestamp } }'
+    with tempfile.TemporaryDirectory() as tmp:
+        with StubSubgraph(deposits[:200], pools):
+            df = beta_load_subgraph(URL, query, syncDir=tmp)['deposits']
+        [name] = os.listdir(tmp)
+        state = sync_utils.load_state(tmp, name[:-len('.pkl')])
+        assert state['cursor'] == str(deposits[199]['timestamp'])
+        assert state['df'].equals(df)
+        with StubSubgraph(deposits, pools) as stub:
+            df = beta_load_subgraph(URL, query, syncDir=tmp)['deposits']
+            [delta] = [q for q in stub.queries if 'deposits(' in q]
+            expected = beta_load_subgraph(URL, '{ deposits(bypassPagination: true) { id amount timestamp } }')['deposits']
+        assert 'timestamp_gte: "%d"' % deposits[199]['timestamp'] in delta
+        assert df.equals(expected)
+        assert sync_utils.load_state(tmp, name[:-len('.pkl')])['cursor'] == str(deposits[-1]['timestamp'])
+
+def test_sync_newer_head():
+    # The state of a load pinned to the latest block is found again at a newer head, only the new items are queried.
+    deposits, pools = make_deposits(250)
+    query = '{ deposits(bypassPagination: true, syncBy: timestamp) { id timestamp } }'
+    with tempfile.TemporaryDirectory() as tmp:
+        with StubSubgraph(deposits[:200], pools, head=1000):
+            df = SubgraphLoader(URL, query, syncDir=tmp, block='latest').beta_load_subgraph()['deposits']
+            assert len(df) == 200
+        with StubSubgraph(deposits, pools, head=1001) as stub:
+            df = SubgraphLoader(URL, query, syncDir=tmp, block='latest').beta_load_subgraph()['deposits']
+        assert len(os.listdir(tmp)) == 1
+        assert sorted(df['id']) == sorted(_ids(deposits))
+        pages = [q for q in stub.queries if 'deposits(' in q]
+        assert all('timestamp_gte: "%d"' % deposits[199]['timestamp'] in q and 'number: 1001' in q for q in pages)
+
+if __name__ == "__main__":
+    test_ordered_first_page()
+    test_ordered_load()
+    test_id_shard_filters()
+    test_int_datatypes()
+    test_nested_page_limit()
+    test_nested_order()
+    test_entity_streams()
+    test_failing_stream()
+    test_capped_pages()
+    test_cached_pages()
+    test_iter_pages()
+    test_pinned_block()
+    test_sync_round_trip()
+    test_sync_newer_head()
+    print("Everything passed")
@@ -0,0 +1,104 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from graphql import parse, ObjectFieldNode, NameNode, StringValueNode
+from lib.bubbletea.thegraph.__core.TheGraphEntity import TheGraphEntity
+
+query = """{
+    transfers(
+        where:{timestamp_gte:1609459200, timestamp_lt:1610236800}
+        shards: 4
+        shardBy: timestamp
+    ) {
+        amount
+        timestamp
+    }
+}
+"""
+
+def _entity(q):
+    ast = parse(q, no_location=True)
+    return TheGraphEntity(ast.definitions[0].selection_set.selections[0])
+
+def test_shard_arguments():
+    e = _entity(query)
+    assert e.shards == 4
+    assert e.shardBy == 'timestamp'
+    assert e.bypassPagination
+    assert 'shards' not in e.initialQuery
+    assert 'shardBy' not in e.initialQuery
+    assert e.where_filters() == {'timestamp_gte': '1609459200', 'timestamp_lt': '1610236800'}
+
+def test_shard_filters():
+    e = _entity(query)
+    shard = e.with_filters([ObjectFieldNode(name=NameNode(value='timestamp_gte'), value=StringValueNode(value='1609800000'))])
+    assert shard.shards == 1
+    assert 'timestamp_gte: "1609800000"' in shard.initialQuery
+    assert '1609459200' not in shard.initialQuery
+    assert 'timestamp_lt: 1610236800' in shard.paginationQuery
+    assert 'id_gt: $__lastId' in shard.paginationQuery
+
+def test_page_size():
+    e = _entity(query)
+    e.pageSizer.size = 250
+    text, variables = e.build_query(True)
+    assert 'first: $transfers_first' in text
+    assert variables == {'transfers_first': ('Int', 250)}
+    assert e.pageSize == 250
+    e.use_cursor_types('ID')
+    e.lastId = '0x10'
+    text, variables = e.build_query()
+    assert 'id_gt: $transfers_lastId' in text
+    assert variables['transfers_lastId'] == ('ID', '0x10')
+
+def test_order_cursor():
+    e = _entity("""{ swaps(bypassPagination: true, orderBy: timestamp, where: {timestamp_gte: 5}) { timestamp } }""")
+    e.use_cursor_types('ID', 'BigInt')
+    e.pageSizer.size = 3
+    text, variables = e.build_query(True)
+    assert 'orderBy: timestamp' in text
+    items, more = e.advance([{'id': 'a', 'timestamp': '5'}, {'id': 'b', 'timestamp': '6'}, {'id': 'c', 'timestamp': '6'}])
+    assert more and len(items) == 3
+    # The next page starts at the last value, the items already read with it are dropped.
+    text, variables = e.build_query()
+    assert 'timestamp_gte: $swaps_cursor' in text
+    assert 'timestamp_gte: 5' not in text
+    assert variables['swaps_cursor'] == ('BigInt', '6')
+    items, more = e.advance([{'id': 'b', 'timestamp': '6'}, {'id': 'c', 'timestamp': '6'}, {'id': 'd', 'timestamp': '6'}])
+    assert [i['id'] for i in items] == ['d']
+    # A page of one value goes on by id within it, then after it.
+    text, variables = e.build_query()
+    assert 'timestamp: $swaps_cursor' in text and 'orderBy: id' in text and 'id_gt' not in text
+    items, more = e.advance([{'id': 'b', 'timestamp': '6'}, {'id': 'c', 'timestamp': '6'}, {'id': 'd', 'timestamp': '6'}])
+    assert more and items == []
+    text, variables = e.build_query()
+    assert variables['swaps_lastId'] == ('ID', 'd')
+    items, more = e.advance([{'id': 'e', 'timestamp': '6'}])
+    assert more and [i['id'] for i in items] == ['e']
+    text, variables = e.build_query()
+    assert 'timestamp_gt: $swaps_cursor' in text
+    items, more = e.advance([{'id': 'f', 'timestamp': '7'}])
+    assert not more
+
+def test_nested():
+    e = _entity("""{ pools(first: 5) { name swaps(bypassPagination: true) { amount } } }""")
+    assert [c.name for c in e.nested] == ['swaps']
+    assert 'bypassPagination' not in e.initialQuery
+    assert 'swaps(orderBy: id, orderDirection: asc, first: 100)' in e.initialQuery
+    # The parent ids link the nested items to their parents.
+    assert e.initialQuery.rstrip().endswith('id\n}')
+    e.nested[0].use_cursor_types('ID')
+    lookups, variables = e.nested[0].build_nested_query('pool', [('p0', '0x01'), ('p1', '0x02')])
+    assert lookups[1].startswith('p1: pool(id: $p1_parent)')
+    assert 'id_gt: $p1_lastId' in lookups[1]
+    assert variables['p1_lastId'] == ('ID', '0x02')
+    assert variables['p0_parent'] == ('ID!', 'p0')
+    assert variables['p0_first'] == ('Int', 1000)
+
+if __name__ == "__main__":
+    test_shard_arguments()
+    test_shard_filters()
+    test_page_size()
+    test_order_cursor()
+    test_nested()
+    print("Everything passed")
@@ -0,0 +1,33 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+from lib.bubbletea.thegraph.__core.WorkerPool import WorkerPool
+
+def test():
+    pool = WorkerPool(1)
+    release = threading.Event()
+    order = []
+    blocker = pool.submit(release.wait)
+    futures = [pool.submit(order.append, name, priority=p) for name, p in [('prefetch', 0), ('interactive', 10), ('prefetch2', 0)]]
+    release.set()
+    blocker.result()
+    [f.result() for f in futures]
+    assert order == ['interactive', 'prefetch', 'prefetch2']
+    assert len(pool.threads) == 1
+
+def test_error():
+    pool = WorkerPool(2)
+    def fail():
+        raise ValueError('The Graph Error')
+    try:
+        pool.submit(fail).result()
+        assert False
+    except ValueError:
+        pass
+    assert pool.submit(lambda: 1).result() == 1
+
+if __name__ == "__main__":
+    test()
+    test_error()
+    print("Everything passed")